@@ -20,9 +20,11 @@
 // ------------------------------ 
 
 struct Tree {
-    char * species_name;
+    int species_code;             // code of the species in the table used to read the file (see b_extract_data_and_memory.c)
     double crown_height;          // m, total_height - trunc_height
     double crown_diameter;        // m  
+    unsigned char crown_height_imputed;     // 1 if the crown height was missing in the CSV file and set to the average of the measured values
+    unsigned char crown_diameter_imputed;   // same for the crown diameter
     double position_y;            // coordinates
     double position_x;            // coordinates
     double position_y_grid;
@@ -71,6 +73,7 @@ struct Tree {
 // O3_removal_yearly_func    
 // O3_removed_mass_yearly_func
 // O3_net_uptake_yearly_func 
+// model_functions
 
 // -------------------------------- 
 // Leaf area of a single tree : LA
@@ -248,4 +251,19 @@ void O3_net_uptake_yearly_func(struct Tree * tree) {
     tree->O3_net_uptake_yearly = O3_net_uptake_yearly; 
 };
 
-
+// ------------------------------------------------------------------------------------------
+// Whole model for a single tree : applies all of the functions above in the required order
+// ------------------------------------------------------------------------------------------
+
+void model_functions(struct Tree * tree, double conc_PM10_city, double conc_O3_city) {
+    leaf_area_func(tree);
+    leaf_dry_weight_func(tree);
+    OFP_hourly_func(tree);
+    OFP_yearly_func(tree);
+    PM10_yearly_func(tree, conc_PM10_city);
+    O3_instantaneous_func(tree, conc_O3_city);
+    O3_yearly_func(tree);
+    O3_removal_yearly_func(tree);
+    O3_removed_mass_yearly_func(tree);
+    O3_net_uptake_yearly_func(tree);
+};
@@ -2,10 +2,32 @@
 #include <math.h>
 #include <stdlib.h>
 #include <string.h>
+#include <time.h>
+#include <ctype.h>
+#ifdef _WIN32
+#define WIN32_LEAN_AND_MEAN
+#define NOMINMAX
+#include <windows.h>
+#else
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+#endif
 #include "a_model_functions.c" 
 
+// The library can be compiled with -fopenmp to run the calculations on several threads; without it, everything runs on one thread
+#ifdef _OPENMP
+#include <omp.h>
+#define THREAD_NUM omp_get_thread_num()
+#define THREAD_COUNT omp_get_num_threads()
+#else
+#define THREAD_NUM 0
+#define THREAD_COUNT 1
+#endif
+
 #define PI 3.14159265358979323846 
-#define MAX_Line_Length 1024
+#define LINE_BLOCK 4096                          // number of lines of the CSV file parsed at once by one thread
 #define LEAVE_DAYS_EVERGREENS 365                // value taken from Kofel, Donato, et al.
 #define LEAVE_DAYS_BROADLEAVES 183               // value taken from Kofel, Donato, et al.
 #define STOMATAL_COND_EVERGREENS 16.896          // value taken from Zeppel et al.
@@ -15,106 +37,725 @@
 // This file contains the functions to read the CSV document with the trees in Geneva, as well as the functions to allocate and free memory.
 // -------------------------------------------------------------------------------------------------------------------------------------------
 
-// ---------------------------------------------------------------------------------------------------------------------------
-// my_strndup: This function is used within the readwriteDocument function to allocate memory for strings into the structure.
-// ---------------------------------------------------------------------------------------------------------------------------
+// -------------------------------------------------------------------------------------------------------------------------------------------
+// Profiling: every stage of the C code adds its wall time, its CPU time (of all threads) and the amount of items it handled (trees, lines or
+// grid cells) to a counter. The counters are only updated once per call of a stage, never per tree, and are read from Python with
+// get_profile (see Functions/q_profiling.py).
+// -------------------------------------------------------------------------------------------------------------------------------------------
+
+enum ProfileStage {PROFILE_PARSE, PROFILE_IMPUTATION, PROFILE_CONTROL_FILE, PROFILE_COORDINATES, PROFILE_ALLOCATION, PROFILE_MODEL, PROFILE_BINNING, PROFILE_CONVERSION, PROFILE_STAGES};
+static const char *profile_names[PROFILE_STAGES] = {"parse", "imputation", "control_file", "coordinates", "allocation", "model", "binning", "conversion"};
+static double profile_wall[PROFILE_STAGES];
+static double profile_cpu[PROFILE_STAGES];
+static long long profile_items[PROFILE_STAGES];
+static long long profile_calls[PROFILE_STAGES];
+
+struct ProfileClock {
+    double wall;         // seconds
+    double cpu;          // seconds of CPU time of the process
+};
+
+// ---------------------------------------------------------------------------------------------------
+// profile_start: This function returns the current wall and CPU time, at the beginning of a stage.
+// ---------------------------------------------------------------------------------------------------
+
+struct ProfileClock profile_start(void) {
+    struct ProfileClock now;
+    struct timespec clock_time;
+#ifdef CLOCK_MONOTONIC
+    clock_gettime(CLOCK_MONOTONIC, &clock_time);
+#else
+    timespec_get(&clock_time, TIME_UTC);
+#endif
+    now.wall = clock_time.tv_sec + clock_time.tv_nsec * 1e-9;
+    now.cpu = (double)clock() / CLOCKS_PER_SEC;
+    return now;
+}
+
+// ---------------------------------------------------------------------------------------------------
+// profile_stop: This function adds the time elapsed since profile_start to the counters of a stage.
+// Input: stage, time returned by profile_start, amount of items handled
+// Output: None
+// ---------------------------------------------------------------------------------------------------
+
+void profile_stop(int stage, struct ProfileClock start, long long items) {
+    struct ProfileClock now = profile_start();
+    profile_wall[stage] += now.wall - start.wall;
+    profile_cpu[stage] += now.cpu - start.cpu;
+    profile_items[stage] += items;
+    profile_calls[stage] += 1;
+}
+
+// ---------------------------------------------------------------------------------------------------
+// reset_profile: This function sets all the counters to zero.
+// ---------------------------------------------------------------------------------------------------
 
-char *my_strndup(const char *str, size_t n) {
-    // Allocate memory for the substring and for the null terminator
-    char *dup = malloc(n + 1);
-    if (dup == NULL) {
-        return NULL;  // Return NULL if malloc fails
+void reset_profile(void) {
+    for(int stage = 0; stage < PROFILE_STAGES; stage++) {
+        profile_wall[stage] = 0.0;
+        profile_cpu[stage] = 0.0;
+        profile_items[stage] = 0;
+        profile_calls[stage] = 0;
     }
-    // Copy the substring
-    memcpy(dup, str, n);
-    dup[n] = '\0';  // Null-terminate the copied string
-    return dup;
+}
+
+// -----------------------------------------------------------------------------------------------------------
+// get_profile: This function copies the counters into arrays of PROFILE_STAGES elements allocated by Python.
+// Input: arrays for the wall time, the CPU time, the amount of items and the amount of calls of every stage
+// Output: number of stages
+// -----------------------------------------------------------------------------------------------------------
+
+int get_profile(double *wall, double *cpu, long long *items, long long *calls) {
+    for(int stage = 0; stage < PROFILE_STAGES; stage++) {
+        wall[stage] = profile_wall[stage];
+        cpu[stage] = profile_cpu[stage];
+        items[stage] = profile_items[stage];
+        calls[stage] = profile_calls[stage];
+    }
+    return PROFILE_STAGES;
+}
+
+// ---------------------------------------------------------------------------------------------------
+// profile_stage_name: This function returns the name of a stage.
+// ---------------------------------------------------------------------------------------------------
+
+const char *profile_stage_name(int stage) {
+    return stage >= 0 && stage < PROFILE_STAGES ? profile_names[stage] : "";
+}
+
+static int nr_threads = 0;   // number of threads used for the calculations and the reading of the CSV file, 0 for the default of OpenMP (OMP_NUM_THREADS or all cores)
+
+// ---------------------------------------------------------------------------------------------------
+// set_threads: This function sets the number of threads used for the calculations and the reading.
+// Input: number of threads, 0 for the default of OpenMP
+// Output: number of threads that will be used (always 1 if the library was compiled without OpenMP)
+// ---------------------------------------------------------------------------------------------------
+
+int set_threads(int threads) {
+    nr_threads = threads > 0 ? threads : 0;
+#ifdef _OPENMP
+    return nr_threads > 0 ? nr_threads : omp_get_max_threads();
+#else
+    return 1;
+#endif
+}
+
+// ---------------------------------------------------------------------------------------------------
+// get_threads: This function returns the number of threads used for the calculations and the reading.
+// ---------------------------------------------------------------------------------------------------
+
+int get_threads(void) {
+#ifdef _OPENMP
+    return nr_threads > 0 ? nr_threads : omp_get_max_threads();
+#else
+    return 1;
+#endif
+}
+
+// ------------------------------------------------------------------------------------------------------------------------------------------
+// Reading of the CSV file: the file is memory-mapped and every line is split into its fields once, in place, without any copy. The numbers
+// are converted directly from the mapped bytes. The lines are first located (one memchr per line) and grouped into blocks of LINE_BLOCK
+// lines, each one a range of bytes of the file, which are then parsed by several threads. Every tree is written at its own index, so the
+// result does not depend on the number of threads.
+// ------------------------------------------------------------------------------------------------------------------------------------------
+
+struct MappedFile {
+    const char *data;    // content of the file, NULL for an empty file
+    size_t size;         // bytes
+#ifdef _WIN32
+    HANDLE file;
+    HANDLE mapping;
+#endif
+};
+
+// Fields of one line of the CSV file used by the program; the species name points into the line and is not null-terminated
+struct ParsedTree {
+    const char *species_name;    // NULL if the line has less than 2 fields
+    int species_length;
+    double crown_height;
+    double crown_diameter;
+    double position_x;
+    double position_y;
+    int leaves_days;
+    double stomatal_conductance;
+};
+
+// ---------------------------------------------------------------------------------------------------
+// map_file: This function maps a file into memory, read-only.
+// Input: filepath, MappedFile structure
+// Output: 0 if the file is mapped, -1 if it could not be opened
+// ---------------------------------------------------------------------------------------------------
+
+int map_file(const char *filename, struct MappedFile *mapped) {
+    mapped->data = NULL;
+    mapped->size = 0;
+#ifdef _WIN32
+    mapped->mapping = NULL;
+    mapped->file = CreateFileA(filename, GENERIC_READ, FILE_SHARE_READ, NULL, OPEN_EXISTING, FILE_ATTRIBUTE_NORMAL, NULL);
+    if(mapped->file == INVALID_HANDLE_VALUE) return -1;
+    LARGE_INTEGER size;
+    if(!GetFileSizeEx(mapped->file, &size)) {
+        CloseHandle(mapped->file);
+        return -1;
+    }
+    mapped->size = (size_t)size.QuadPart;
+    if(mapped->size == 0) return 0;
+    mapped->mapping = CreateFileMappingA(mapped->file, NULL, PAGE_READONLY, 0, 0, NULL);
+    if(mapped->mapping != NULL) mapped->data = MapViewOfFile(mapped->mapping, FILE_MAP_READ, 0, 0, 0);
+    if(mapped->data == NULL) {
+        if(mapped->mapping != NULL) CloseHandle(mapped->mapping);
+        CloseHandle(mapped->file);
+        return -1;
+    }
+#else
+    int descriptor = open(filename, O_RDONLY);
+    if(descriptor < 0) return -1;
+    struct stat status;
+    if(fstat(descriptor, &status) != 0) {
+        close(descriptor);
+        return -1;
+    }
+    mapped->size = (size_t)status.st_size;
+    if(mapped->size > 0) {
+        void *data = mmap(NULL, mapped->size, PROT_READ, MAP_PRIVATE, descriptor, 0);
+        if(data == MAP_FAILED) {
+            close(descriptor);
+            return -1;
+        }
+        mapped->data = data;
+    }
+    close(descriptor);      // the mapping stays valid
+#endif
+    return 0;
+}
+
+// ---------------------------------------------------------------------------------------------------
+// unmap_file: This function unmaps a file mapped by map_file.
+// ---------------------------------------------------------------------------------------------------
+
+void unmap_file(struct MappedFile *mapped) {
+#ifdef _WIN32
+    if(mapped->data != NULL) UnmapViewOfFile(mapped->data);
+    if(mapped->mapping != NULL) CloseHandle(mapped->mapping);
+    CloseHandle(mapped->file);
+#else
+    if(mapped->data != NULL) munmap((void *)mapped->data, mapped->size);
+#endif
+    mapped->data = NULL;
+    mapped->size = 0;
+}
+
+// ---------------------------------------------------------------------------------------------------
+// line_end: This function returns the end of the line starting at line (its line break or the end of
+//           the file).
+// ---------------------------------------------------------------------------------------------------
+
+const char *line_end(const char *line, const char *end) {
+    const char *next = memchr(line, '\n', end - line);
+    return next != NULL ? next : end;
+}
+
+// ---------------------------------------------------------------------------------------------------------------------------------
+// parse_number: This function converts the number at the beginning of a field, like atof, without copying the field. Decimal numbers
+//               with at most 15 significant digits and a small exponent are converted with one exact multiplication or division, so
+//               the result is the same as the one of atof; all the other numbers are converted by strtod.
+// Input: beginning and end of the field
+// Output: number, 0 if the field does not start with a number
+// ---------------------------------------------------------------------------------------------------------------------------------
+
+double parse_number(const char *field, const char *end) {
+    static const double powers[] = {1e0, 1e1, 1e2, 1e3, 1e4, 1e5, 1e6, 1e7, 1e8, 1e9, 1e10, 1e11, 1e12, 1e13, 1e14, 1e15,
+                                    1e16, 1e17, 1e18, 1e19, 1e20, 1e21, 1e22};
+    const char *p = field;
+    while(p < end && isspace((unsigned char)*p)) p++;
+    int negative = 0;
+    if(p < end && (*p == '-' || *p == '+')) {
+        negative = *p == '-';
+        p++;
+    }
+
+    long long mantissa = 0;
+    int digits = 0;              // significant digits in the mantissa
+    int exponent = 0;
+    int any_digit = 0;
+    while(p < end && *p >= '0' && *p <= '9') {
+        if(mantissa > 0 || *p != '0') digits++;
+        if(digits <= 15) mantissa = 10 * mantissa + (*p - '0');
+        else exponent++;
+        any_digit = 1;
+        p++;
+    }
+    if(p < end && *p == '.') {
+        p++;
+        while(p < end && *p >= '0' && *p <= '9') {
+            if(mantissa > 0 || *p != '0') digits++;
+            if(digits <= 15) {
+                mantissa = 10 * mantissa + (*p - '0');
+                exponent--;
+            }
+            any_digit = 1;
+            p++;
+        }
+    }
+    if(p < end && (*p == 'e' || *p == 'E') && any_digit) {
+        const char *q = p + 1;
+        int exponent_negative = 0;
+        if(q < end && (*q == '-' || *q == '+')) {
+            exponent_negative = *q == '-';
+            q++;
+        }
+        if(q < end && *q >= '0' && *q <= '9') {
+            int value = 0;
+            while(q < end && *q >= '0' && *q <= '9') {
+                if(value < 10000) value = 10 * value + (*q - '0');
+                q++;
+            }
+            exponent += exponent_negative ? -value : value;
+            p = q;
+        }
+    }
+
+    // Numbers that cannot be converted exactly here (more digits, large exponents, hexadecimal, inf, nan): strtod on a copy of the field
+    if(!any_digit || digits > 15 || exponent > 22 || exponent < -22 || (p < end && (*p == 'x' || *p == 'X' || *p == 'n' || *p == 'N'))) {
+        char buffer[128];
+        size_t length = (size_t)(end - field) < sizeof(buffer) - 1 ? (size_t)(end - field) : sizeof(buffer) - 1;
+        memcpy(buffer, field, length);
+        buffer[length] = '\0';
+        return strtod(buffer, NULL);
+    }
+    double value = exponent >= 0 ? (double)mantissa * powers[exponent] : (double)mantissa / powers[-exponent];
+    return negative ? -value : value;
+}
+
+// ------------------------------------------------------------------------------------------------------------------------------------------
+// Dictionary of the species: every distinct species name gets a small integer code (0, 1, 2, ... in the order in which the names are first
+// found in the file) and the trees only keep the code of their species. The table also gives the genus (first word of the name) of every
+// species as a code, with the names of the genera, so that the scientific parameters are looked up once per genus and given to the trees
+// with a plain array index (see genus_filter in e_filter_trees.py). Codes never change once given, so one table can be used for all the
+// chunks of a file. The names are cut to SPECIES_NAME_LENGTH - 1 characters.
+// ------------------------------------------------------------------------------------------------------------------------------------------
+
+#define SPECIES_NAME_LENGTH 64         // number of characters stored per name, including the null terminator
+
+// Names with their hash table (open addressing, the slots hold code + 1 and 0 if they are empty)
+struct NameIndex {
+    int count;                         // number of names
+    int capacity;                      // number of names that fit into names, half of slot_count
+    char *names;                       // capacity * SPECIES_NAME_LENGTH characters, one null-terminated name per code
+    int *slots;
+    int slot_count;                    // power of 2
+};
+
+struct SpeciesTable {
+    struct NameIndex species;
+    struct NameIndex genera;
+    int *genus;                        // genus code of every species, species.capacity values
+};
+
+// Species name of a line, pointing into the mapped file until it is encoded
+struct ParsedName {
+    const char *name;
+    int length;
+};
+
+// ---------------------------------------------------------------------------------------------------
+// name_hash: This function returns the FNV-1a hash of a name.
+// ---------------------------------------------------------------------------------------------------
+
+unsigned long long name_hash(const char *name, int length) {
+    unsigned long long hash = 14695981039346656037ULL;
+    for(int i = 0; i < length; i++) {
+        hash ^= (unsigned char)name[i];
+        hash *= 1099511628211ULL;
+    }
+    return hash;
+}
+
+// ---------------------------------------------------------------------------------------------------
+// init_index, free_index: These functions allocate and free the memory of a NameIndex.
+// ---------------------------------------------------------------------------------------------------
+
+int init_index(struct NameIndex *index) {
+    index->count = 0;
+    index->capacity = 64;
+    index->slot_count = 128;
+    index->names = malloc((size_t)index->capacity * SPECIES_NAME_LENGTH);
+    index->slots = calloc(index->slot_count, sizeof(int));
+    return index->names != NULL && index->slots != NULL ? 0 : -1;
+}
+
+void free_index(struct NameIndex *index) {
+    free(index->names);
+    free(index->slots);
+    index->names = NULL;
+    index->slots = NULL;
+}
+
+// ---------------------------------------------------------------------------------------------------
+// grow_index: This function doubles the capacity of a NameIndex and puts its names into the new slots.
+// Output: 0, -1 if the memory allocation failed
+// ---------------------------------------------------------------------------------------------------
+
+int grow_index(struct NameIndex *index) {
+    char *names = realloc(index->names, (size_t)2 * index->capacity * SPECIES_NAME_LENGTH);
+    if(names == NULL) return -1;
+    index->names = names;
+    int *slots = calloc((size_t)2 * index->slot_count, sizeof(int));
+    if(slots == NULL) return -1;
+    free(index->slots);
+    index->slots = slots;
+    index->capacity *= 2;
+    index->slot_count *= 2;
+
+    size_t mask = (size_t)index->slot_count - 1;
+    for(int code = 0; code < index->count; code++) {
+        const char *name = index->names + (size_t)code * SPECIES_NAME_LENGTH;
+        size_t slot = name_hash(name, (int)strlen(name)) & mask;
+        while(index->slots[slot] != 0) slot = (slot + 1) & mask;
+        index->slots[slot] = code + 1;
+    }
+    return 0;
+}
+
+// ---------------------------------------------------------------------------------------------------
+// find_name: This function returns the code of a name, which is added to the NameIndex if it is new.
+// Input: NameIndex, name (not null-terminated) and its length, pointer set to 1 if the name was added
+// Output: code, -1 if the memory allocation failed
+// ---------------------------------------------------------------------------------------------------
+
+int find_name(struct NameIndex *index, const char *name, int length, int *added) {
+    unsigned long long hash = name_hash(name, length);
+    size_t mask = (size_t)index->slot_count - 1;
+    size_t slot = hash & mask;
+    *added = 0;
+    while(index->slots[slot] != 0) {
+        const char *candidate = index->names + (size_t)(index->slots[slot] - 1) * SPECIES_NAME_LENGTH;
+        if(memcmp(candidate, name, length) == 0 && candidate[length] == '\0') return index->slots[slot] - 1;
+        slot = (slot + 1) & mask;
+    }
+
+    // New name: the whole place of the name is written, the rest with zeros
+    if(index->count == index->capacity) {
+        if(grow_index(index) != 0) return -1;
+        mask = (size_t)index->slot_count - 1;
+        slot = hash & mask;
+        while(index->slots[slot] != 0) slot = (slot + 1) & mask;
+    }
+    int code = index->count++;
+    char *stored = index->names + (size_t)code * SPECIES_NAME_LENGTH;
+    memcpy(stored, name, length);
+    memset(stored + length, 0, SPECIES_NAME_LENGTH - length);
+    index->slots[slot] = code + 1;
+    *added = 1;
+    return code;
+}
+
+// ---------------------------------------------------------------------------------------------------
+// new_species_table, free_species_table: These functions allocate and free a SpeciesTable. The table
+//                                        is kept by Python while the file is read (see e_filter_trees.py).
+// ---------------------------------------------------------------------------------------------------
+
+void free_species_table(struct SpeciesTable *table) {
+    if(table == NULL) return;
+    free_index(&table->species);
+    free_index(&table->genera);
+    free(table->genus);
+    free(table);
+}
+
+struct SpeciesTable *new_species_table(void) {
+    struct SpeciesTable *table = calloc(1, sizeof(struct SpeciesTable));
+    if(table == NULL) return NULL;
+    int failed = init_index(&table->species) != 0;
+    failed |= init_index(&table->genera) != 0;
+    table->genus = malloc((size_t)table->species.capacity * sizeof(int));
+    if(failed || table->genus == NULL) {
+        free_species_table(table);
+        return NULL;
+    }
+    return table;
+}
+
+// ---------------------------------------------------------------------------------------------------
+// whitespace_length: This function returns the length of the whitespace character at p in UTF-8 (the
+//                    characters separating words for str.split in Python), 0 if it is not whitespace.
+// ---------------------------------------------------------------------------------------------------
+
+int whitespace_length(const unsigned char *p, const unsigned char *end) {
+    if(*p == ' ' || (*p >= '\t' && *p <= '\r') || (*p >= 0x1c && *p <= 0x1f)) return 1;
+    if(end - p >= 2 && p[0] == 0xc2 && (p[1] == 0x85 || p[1] == 0xa0)) return 2;
+    if(end - p >= 3) {
+        unsigned int c = ((unsigned int)p[0] << 16) | ((unsigned int)p[1] << 8) | p[2];
+        if(c == 0xe19a80 || (c >= 0xe28080 && c <= 0xe2808a) || c == 0xe280a8 || c == 0xe280a9 || c == 0xe280af || c == 0xe2819f || c == 0xe38080) return 3;
+    }
+    return 0;
+}
+
+// ---------------------------------------------------------------------------------------------------------------
+// species_code: This function returns the code of a species. A new species is added to the table with its genus.
+// Input: table, name (not null-terminated) and its length
+// Output: code, -1 if the memory allocation failed
+// ---------------------------------------------------------------------------------------------------------------
+
+int species_code(struct SpeciesTable *table, const char *name, int length) {
+    if(length > SPECIES_NAME_LENGTH - 1) length = SPECIES_NAME_LENGTH - 1;
+    const char *zero = length > 0 ? memchr(name, '\0', length) : NULL;
+    if(zero != NULL) length = (int)(zero - name);
+
+    int capacity = table->species.capacity;
+    int added;
+    int code = find_name(&table->species, name, length, &added);
+    if(code < 0 || !added) return code;
+    if(table->species.capacity != capacity) {
+        int *genus = realloc(table->genus, (size_t)table->species.capacity * sizeof(int));
+        if(genus == NULL) return -1;
+        table->genus = genus;
+    }
+
+    // Genus: first word of the name
+    const unsigned char *p = (const unsigned char *)table->species.names + (size_t)code * SPECIES_NAME_LENGTH;
+    const unsigned char *end = p + length;
+    int skip;
+    while(p < end && (skip = whitespace_length(p, end)) > 0) p += skip;
+    const unsigned char *word = p;
+    while(p < end && whitespace_length(p, end) == 0) p++;
+    table->genus[code] = find_name(&table->genera, (const char *)word, (int)(p - word), &added);
+    return table->genus[code] < 0 ? -1 : code;
+}
+
+// ---------------------------------------------------------------------------------------------------------------------
+// encode_species: This function gives every tree the code of its species, one tree after the other so that the codes
+//                 follow the order of the file. A tree with the same species as the previous one gets its code directly.
+// Input: table, names of the trees found by parse_lines, amount of trees, array of codes
+// Output: 0, -1 if the memory allocation failed
+// ---------------------------------------------------------------------------------------------------------------------
+
+int encode_species(struct SpeciesTable *table, struct ParsedName *names, int lines, int *codes) {
+    const char *previous = NULL;
+    int previous_length = -1;
+    int previous_code = -1;
+    for(int k = 0; k < lines; k++) {
+        if(names[k].length != previous_length || memcmp(names[k].name, previous, previous_length) != 0) {
+            previous = names[k].name;
+            previous_length = names[k].length;
+            previous_code = species_code(table, previous, previous_length);
+            if(previous_code < 0) return -1;
+        }
+        codes[k] = previous_code;
+    }
+    return 0;
+}
+
+// ---------------------------------------------------------------------------------------------------
+// get_species_count, get_genus_count: These functions return the number of species and of genera.
+// ---------------------------------------------------------------------------------------------------
+
+int get_species_count(struct SpeciesTable *table) {
+    return table->species.count;
+}
+
+int get_genus_count(struct SpeciesTable *table) {
+    return table->genera.count;
+}
+
+// -------------------------------------------------------------------------------------------------------------------
+// copy_species_table: This function copies the table into arrays allocated by Python.
+// Input: table, species names (SPECIES_NAME_LENGTH characters per species), genus code of every species, genus names
+// Output: nothing
+// -------------------------------------------------------------------------------------------------------------------
+
+void copy_species_table(struct SpeciesTable *table, char *species, int *species_genus, char *genera) {
+    memcpy(species, table->species.names, (size_t)table->species.count * SPECIES_NAME_LENGTH);
+    memcpy(species_genus, table->genus, (size_t)table->species.count * sizeof(int));
+    memcpy(genera, table->genera.names, (size_t)table->genera.count * SPECIES_NAME_LENGTH);
+}
+
+// -------------------------------------------------------------------------------------------------------------------------------------
+// tokenize_line: This function splits one line of the CSV file into its fields and converts the fields used by the program.
+//                A field is only used if the separator after it is found, and the y coordinate is read from the rest of the line.
+//                Note: readwriteDocument has always set the crown height to the total height of the tree (field 9), since the trunk
+//                height was reset for every field it parsed; this is kept so that the results do not change (see f_numpy_model.py).
+// Input: beginning and end of the line (without its line break), ParsedTree structure
+// Output: nothing
+// -------------------------------------------------------------------------------------------------------------------------------------
+
+void tokenize_line(const char *line, const char *end, struct ParsedTree *tree) {
+    tree->species_name = NULL;
+    tree->species_length = 0;
+    tree->crown_height = 0.0;
+    tree->crown_diameter = 0.0;
+    tree->position_x = 0.0;
+    tree->position_y = 0.0;
+    tree->leaves_days = 0;
+    tree->stomatal_conductance = 0.0;
+
+    const char *field = line;
+    for(int separator = 1; separator <= 29; separator++) {
+        const char *next = memchr(field, ';', end - field);
+        if(next == NULL) return;
+
+        // The field ending at this separator is the field number separator - 1
+        switch(separator) {
+            case 2:      // species name
+                tree->species_name = field;
+                tree->species_length = (int)(next - field);
+                break;
+            case 10:     // total height
+                tree->crown_height = parse_number(field, next);
+                break;
+            case 11:     // crown diameter
+                tree->crown_diameter = parse_number(field, next);
+                break;
+            case 23:     // evergreen or deciduous, values found in tables and in Kofel, Donato, et al.
+                if(next - field == sizeof("Feuillus") - 1 && memcmp(field, "Feuillus", sizeof("Feuillus") - 1) == 0) {
+                    tree->leaves_days = LEAVE_DAYS_BROADLEAVES;
+                    tree->stomatal_conductance = STOMATAL_COND_BROADLEAVES;
+                }
+                if(next - field == sizeof("Conifères") - 1 && memcmp(field, "Conifères", sizeof("Conifères") - 1) == 0) {
+                    tree->leaves_days = LEAVE_DAYS_EVERGREENS;
+                    tree->stomatal_conductance = STOMATAL_COND_EVERGREENS;
+                }
+                break;
+            case 29:     // position; coordinate system used is LV95
+                tree->position_x = parse_number(field, next);
+                tree->position_y = parse_number(next + 1, end);
+                break;
+        }
+        field = next + 1;
+    }
+}
+
+// ------------------------------------------------------------------------------------------------------------------------------------
+// index_lines: This function finds the lines of the file starting at the byte begin, up to max_lines lines, and returns the beginning
+//              of every block of LINE_BLOCK lines. With skip_empty, the empty lines are skipped and do not count.
+// Input: mapped file, first byte, maximum amount of lines, whether empty lines are skipped, pointer to the array of the beginnings of
+//        the blocks (allocated here, to be freed by the caller), pointer to the byte after the last line
+// Output: amount of lines found, -1 if the memory allocation failed
+// ------------------------------------------------------------------------------------------------------------------------------------
+
+int index_lines(struct MappedFile *mapped, size_t begin, int max_lines, int skip_empty, size_t **block_starts, size_t *stop) {
+    const char *data = mapped->data;
+    const char *end = data + mapped->size;
+    *block_starts = malloc(((size_t)max_lines / LINE_BLOCK + 1) * sizeof(size_t));
+    if(*block_starts == NULL) return -1;
+
+    int lines = 0;
+    size_t position = begin;
+    while(lines < max_lines && position < mapped->size) {
+        const char *line = data + position;
+        const char *next = line_end(line, end);
+        if(!skip_empty || (line != next && *line != '\r')) {
+            if(lines % LINE_BLOCK == 0) (*block_starts)[lines / LINE_BLOCK] = position;
+            lines++;
+        }
+        position = (size_t)(next - data) + 1;
+    }
+    *stop = position < mapped->size ? position : mapped->size;
+    return lines;
+}
+
+// ------------------------------------------------------------------------------------------------------------------------------------
+// parse_lines: This function parses the lines found by index_lines on several threads, one block of lines at a time, and gives every
+//              tree to the function store with its index. The species names are kept in names, to be encoded by encode_species.
+// Input: mapped file, beginnings of the blocks, amount of lines, whether empty lines are skipped, function storing a tree, structure
+//        in which the trees are stored, array of the species names (one per line)
+// Output: nothing
+// ------------------------------------------------------------------------------------------------------------------------------------
+
+void parse_lines(struct MappedFile *mapped, size_t *block_starts, int lines, int skip_empty, void (*store)(struct ParsedTree *, void *, int), void *target, struct ParsedName *names) {
+    const char *data = mapped->data;
+    const char *end = data + mapped->size;
+    int blocks = (lines + LINE_BLOCK - 1) / LINE_BLOCK;
+
+    #pragma omp parallel for num_threads(get_threads()) schedule(dynamic)
+    for(int b = 0; b < blocks; b++) {
+        const char *line = data + block_starts[b];
+        int last = (b + 1) * LINE_BLOCK < lines ? (b + 1) * LINE_BLOCK : lines;
+        int k = b * LINE_BLOCK;
+        while(k < last) {
+            const char *next = line_end(line, end);
+            if(!skip_empty || (line != next && *line != '\r')) {
+                struct ParsedTree tree;
+                tokenize_line(line, next, &tree);
+                store(&tree, target, k);
+                names[k].name = tree.species_name != NULL ? tree.species_name : "";
+                names[k].length = tree.species_length;
+                k++;
+            }
+            line = next + 1;
+        }
+    }
+}
+
+// ------------------------------------------------------------------------------------------------------------------------------------
+// parse_species_lines: This function parses the lines found by index_lines (see parse_lines) and gives every tree the code of its
+//                      species in the table.
+// Input: mapped file, beginnings of the blocks, amount of lines, whether empty lines are skipped, function storing a tree, structure
+//        in which the trees are stored, table of the species, array of the codes of the species (one per line)
+// Output: 0, -1 if the memory allocation failed
+// ------------------------------------------------------------------------------------------------------------------------------------
+
+int parse_species_lines(struct MappedFile *mapped, size_t *block_starts, int lines, int skip_empty, void (*store)(struct ParsedTree *, void *, int), void *target, struct SpeciesTable *species, int *codes) {
+    struct ParsedName *names = malloc((lines > 0 ? (size_t)lines : 1) * sizeof(struct ParsedName));
+    if(names == NULL) return -1;
+    parse_lines(mapped, block_starts, lines, skip_empty, store, target, names);
+    int result = encode_species(species, names, lines, codes);
+    free(names);
+    return result;
+}
+
+// ------------------------------------------------------------------------------------------------------------------------------
+// store_parsed_tree: This function copies the fields of a parsed line into the Tree structure number k.
+// ------------------------------------------------------------------------------------------------------------------------------
+
+void store_parsed_tree(struct ParsedTree *parsed, void *target, int k) {
+    struct Tree *tree = (struct Tree *)target + k;
+    tree->crown_height = parsed->crown_height;
+    tree->crown_diameter = parsed->crown_diameter;
+    tree->position_x = parsed->position_x;
+    tree->position_y = parsed->position_y;
+    tree->leaves_days = parsed->leaves_days;
+    tree->stomatal_conductance = parsed->stomatal_conductance;
 }
 
 // -----------------------------------------------------------------------------------------------------------------------------------
 // readwriteDocument: This function opens the CSV file and saves the data about the trees into a predefined array of Tree structures.
-// Input: filepath, allocated empty tree array, amount of trees for computations
+//                    Every tree gets the code of its species in the table (trees missing from the file get the empty name).
+// Input: filepath, allocated empty tree array, amount of trees for computations, table of the species (see new_species_table)
 // Output: nothing
 // -----------------------------------------------------------------------------------------------------------------------------------
 
-void readwriteDocument(char *filename, struct Tree *trees, int size_org) {    // size_org is the length of the trees array and hence the amount of values we read in from the CSV file.
-   // Open the CSV file
-   FILE *file = fopen(filename, "r");
-    if (file == NULL) {
+void readwriteDocument(char *filename, struct Tree *trees, int size_org, struct SpeciesTable *species) {    // size_org is the length of the trees array and hence the amount of values we read in from the CSV file.
+    // Open the CSV file
+    struct MappedFile mapped;
+    if (map_file(filename, &mapped) != 0) {
         printf("Error opening file\n");
         exit(-1);
     }
-    int index = 0;
     printf("File opening worked\n");
-    static char line[MAX_Line_Length];
-    
-    // Read in first line
-    fgets(line, sizeof(line), file);
-    
-    // Read in the rest and parse it
-    while(index <= size_org) {
-        fgets(line, sizeof(line), file);
-        line[strcspn(line, "\n")] = '\0';
-        char *substring = strstr(line, ";");  // will send a substring to the first ;
-        int position = 0;
-        int last_position = 0;
-        int matches = 1;
-
-        // This loop turns as long as a substring is found
-        while(substring) {
-            last_position = position;
-            position = substring - line;
-            char *substring_saved = substring;
-            substring = strstr(substring+1, ";");
-
-            // Species name -> amount of matches needs to be counted in the actual CSV document
-            if(matches == 2) {
-                trees[index].species_name = my_strndup(line + last_position + 1, position - last_position - 1);
-            }
-            
-            // Crown height
-            double trunk_height = 0.0;
-            if(matches == 9) {
-                trunk_height = atof(my_strndup(line + last_position + 1, position - last_position - 1));
-            }
-            if(matches == 10) {
-                double total_height = atof(my_strndup(line + last_position + 1, position - last_position - 1));
-                trees[index].crown_height = total_height - trunk_height;
-            }
-            
-            // Crown diameter
-            if(matches == 11) {
-                double value = atof(my_strndup(line + last_position + 1, position - last_position - 1));
-                trees[index].crown_diameter = value;
-            }
 
-            // Adding attributes to the Tree structure based on whether the tree is evergreen or deciduous.
-            // Values found in tables and in Kofel, Donato, et al.
-            if(matches == 23) {
-                char *type = my_strndup(line + last_position + 1, position - last_position - 1);
-                
-                if(strcmp(type, "Feuillus") == 0) {
-                    trees[index].leaves_days = LEAVE_DAYS_BROADLEAVES;
-                    trees[index].stomatal_conductance = STOMATAL_COND_BROADLEAVES; 
-                }
-                if(strcmp(type,"Conifères") == 0) {
-                    trees[index].leaves_days = LEAVE_DAYS_EVERGREENS;
-                    trees[index].stomatal_conductance = STOMATAL_COND_EVERGREENS;
-                }
-            }
-            
-            // Postition; coordinate system used is LV95
-            if(matches == 29) {
-                trees[index].position_x = atof(my_strndup(line + last_position + 1, position - last_position - 1));
-                trees[index].position_y = atof(my_strndup(line + position+ 1, strlen(line) - position));
-            }
-            matches += 1;
-        }
-        index += 1;
+    // Skip the first line, then read in the rest and parse it
+    struct ProfileClock start = profile_start();
+    size_t begin = mapped.size > 0 ? (size_t)(line_end(mapped.data, mapped.data + mapped.size) - mapped.data) + 1 : 0;
+    size_t *block_starts;
+    size_t stop;
+    int index = index_lines(&mapped, begin, size_org, 0, &block_starts, &stop);
+    int *codes = malloc((size_org > 0 ? (size_t)size_org : 1) * sizeof(int));
+    if(index < 0 || codes == NULL || parse_species_lines(&mapped, block_starts, index, 0, store_parsed_tree, trees, species, codes) != 0) {
+        printf("Memory allocation for the lines failed\n");
+        exit(-1);
     }
-    fclose(file);
+    free(block_starts);
+    unmap_file(&mapped);
+    int empty = index < size_org ? species_code(species, "", 0) : 0;
+    for(int i = 0; i < size_org; i++) {
+        trees[i].species_code = i < index ? codes[i] : empty;
+    }
+    free(codes);
+    profile_stop(PROFILE_PARSE, start, index);
     
     // Calculation of the average height and crown diameter for trees missing these measured values in the CSV file 
+    start = profile_start();
     int count_h = 0;
     int count_d = 0;
     double sum_h = 0.0;
@@ -134,8 +775,10 @@ void readwriteDocument(char *filename, struct Tree *trees, int size_org) {    //
     double average_height = sum_h/count_h;           
     double average_crown_diameter = sum_d/count_d; 
 
-    // Adding the average values to the Tree structures of the trees missing these measured values in the CSV file
+    // Adding the average values to the Tree structures of the trees missing these measured values in the CSV file, and flagging them
     for(int i = 0; i < size_org; i++){
+        trees[i].crown_height_imputed = trees[i].crown_height == 0.0;
+        trees[i].crown_diameter_imputed = trees[i].crown_diameter == 0.0;
         if(trees[i].crown_height == 0.0) {
             trees[i].crown_height = average_height;
         }
@@ -143,8 +786,10 @@ void readwriteDocument(char *filename, struct Tree *trees, int size_org) {    //
             trees[i].crown_diameter = average_crown_diameter;
         }
     }
+    profile_stop(PROFILE_IMPUTATION, start, (size_org - count_h) + (size_org - count_d));
     
     // Write content to a control CSV file --> not necessary but helps to check for errors
+    start = profile_start();
     FILE *file_out = fopen("Results/trees_GE.csv", "w");    // Open the file in write mode
 
     // Check if the control file was opened successfully
@@ -157,11 +802,12 @@ void readwriteDocument(char *filename, struct Tree *trees, int size_org) {    //
     fprintf(file_out, "Tree name; Crown Height; Crown Diameter, Position X, Position Y, Leaves Days\n");
 
     for(int i = 0; i < size_org; i++) {
-        fprintf(file_out, "%s ; %f ; %f ; %f ; %f ; %d \n ", trees[i].species_name, trees[i].crown_height, trees[i].crown_diameter, trees[i].position_x, trees[i].position_y, trees[i].leaves_days);
+        fprintf(file_out, "%s ; %f ; %f ; %f ; %f ; %d \n ", species->species.names + (size_t)trees[i].species_code * SPECIES_NAME_LENGTH, trees[i].crown_height, trees[i].crown_diameter, trees[i].position_x, trees[i].position_y, trees[i].leaves_days);
     }
     
     // Close the file
     fclose(file_out);
+    profile_stop(PROFILE_CONTROL_FILE, start, size_org);
     printf("Data written to 'trees_GE.txt' successfully!\n");
 }
 
@@ -174,34 +820,33 @@ double *getarray(int size) {
     return arr;
 }
 
-// ------------------------------------------------------------------------------------------
-// get_gridarray: This function is used to allocate memory for a 2D array used for the grid.
-// ------------------------------------------------------------------------------------------
+// ----------------------------------------------------------------------------------------------------------------------
+// get_gridarray: This function is used to allocate memory for a 2D array used for the grid. The cells are allocated as
+//                one contiguous block of rows * columns values set to zero, and grid[i] points to the beginning of row i,
+//                so that grid[0] can be used in Python as a NumPy array without any copy.
+// ----------------------------------------------------------------------------------------------------------------------
 
 double **get_gridarray(int rows, int columns) {
+    struct ProfileClock start = profile_start();
     
-    // Memory allocation for rows
+    // Memory allocation for the row pointers
     double **grid = malloc(rows * sizeof(double *));
     if (grid == NULL) {
         printf("Memory allocation failed for grid rows.\n");
         return NULL;
     }
     
-    // Memory allocation for columns
-    for (int i = 0; i < rows; i++) {
-        grid[i] = (double *)malloc(columns * sizeof(double));
-        if (grid[i] == NULL) {
-            printf("Memory allocation failed for grid columns.\n");
-            return NULL;
-        }
+    // Memory allocation for all the cells at once, initialized to zero
+    double *cells = calloc((size_t)rows * (size_t)columns, sizeof(double));
+    if (cells == NULL) {
+        printf("Memory allocation failed for grid columns.\n");
+        free(grid);
+        return NULL;
     }
-    
-    // Initialize the grid cells to zero
-    for(int i = 0; i < rows; i++) {
-        for(int j = 0; j < columns; j++) {
-            grid[i][j] = 0.0;
-        }
+    for (int i = 0; i < rows; i++) {
+        grid[i] = cells + (size_t)i * (size_t)columns;
     }
+    profile_stop(PROFILE_ALLOCATION, start, (long long)rows * columns);
     return grid;
 }
 
@@ -213,8 +858,11 @@ struct Tree *gettreearray(int size) {
     struct Tree *trees = malloc(size * sizeof(struct Tree));
     for(int i = 0; i < size; i++){
         struct Tree *tree = &trees[i];
+        tree->species_code = 0;
         tree->crown_height = 0.0;
         tree->crown_diameter = 0.0;
+        tree->crown_height_imputed = 0;
+        tree->crown_diameter_imputed = 0;
         tree->position_y = 0.0;
         tree->position_x = 0.0;
         tree->position_y_grid = 0;
@@ -241,11 +889,6 @@ struct Tree *gettreearray(int size) {
     return trees;
 }
 
-// Initialize the name of the species to NULL
-void memory_allocation(struct Tree *tree) {
-    tree->species_name = NULL;
-}
-
 // ----------------------------------------------------------------------------
 // freearray: This function is used to free the memory allocated for an array.
 // ----------------------------------------------------------------------------
@@ -254,19 +897,16 @@ void freearray(double *arr) {
     free(arr);
 }
 
-// ---------------------------------------------------------------------------------------------
-// free_memory: This function is used to free the memory allocated for the name of the species.
-// ---------------------------------------------------------------------------------------------
-
-void free_memory(struct Tree *tree) {
-    free(tree->species_name);
-}
-
-// ---------------------------------------------------------------------------------------
-// free_grid: This function is used to free the memory allocated for the grid (2D array).
-// ---------------------------------------------------------------------------------------
+// ----------------------------------------------------------------------------------------------------------
+// free_grid: This function is used to free the memory allocated for the grid (2D array): the block of cells
+//            and the row pointers.
+// ----------------------------------------------------------------------------------------------------------
 
 void free_grid(double **grid) {
+    if (grid == NULL) {
+        return;
+    }
+    free(grid[0]);
     free(grid);
 }
 
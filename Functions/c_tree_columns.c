@@ -0,0 +1,403 @@
+#include <stdio.h>
+#include <math.h>
+#include <stdlib.h>
+#include <string.h>
+
+#include "b_extract_data_and_memory.c"
+
+//--------------------------------------------------------------------------------------------------------------------------------
+// This file contains the TreeColumns structure, which stores the trees column by column (one contiguous array per field) instead
+// of as an array of Tree structures. The arrays are allocated by NumPy in Python and only their pointers are passed to C, so that
+// no conversion is needed between Python and C. This file also contains the functions reading the CSV document into the columns.
+// Only the inputs of the model are stored for every tree: the intermediate values are computed in a local Tree structure, and the
+// per-tree results are only stored on request. The crown sizes and the scientific parameters can also be stored in single precision
+// (float) to halve their memory; they are converted back to double before the model is applied to them.
+//--------------------------------------------------------------------------------------------------------------------------------
+
+// ----------------------------------
+// Structure for the columns of trees:
+// ----------------------------------
+
+struct TreeColumns {
+    int size;                              // number of trees in each column
+    int *species_code;                     // code of the species in the table used to read the file (see b_extract_data_and_memory.c)
+    double *crown_height;                  // m
+    double *crown_diameter;                // m
+    double *position_y;                    // coordinates
+    double *position_x;                    // coordinates
+    double *shading_factor;                // no units, %
+    double *conversion_factor;             // g/m2
+    int *leaves_days;                      // number of days
+    double *stomatal_conductance;          // mmol(water vapor)/m2/s
+    double *mass_emission_factor;          // size * 3 values, ug(VOC)/gdw/h for isoprene, monoterpenes and sesquiterpenes of each tree
+    double *max_incremental_reactivity;    // 3 values shared by all trees, g(O3)/g(VOC) for isoprene, monoterpenes and sesquiterpenes
+    unsigned char *crown_height_imputed;   // 1 if the crown height was missing in the CSV file and set to the average, 0 if it was measured
+    unsigned char *crown_diameter_imputed; // same for the crown diameter; both flags are not used by the model and are only filled if not NULL
+
+    // Per-tree results: these columns are optional and are only filled if the pointer is not NULL
+    double *position_y_grid;
+    double *position_x_grid;
+    double *OFP_yearly;                    // ug(O3)/y
+    double *PM10_yearly;                   // ug(PM10)/y
+    double *O3_removed_mass_yearly;        // g(O3)/y
+    double *O3_net_uptake_yearly;          // g(O3)/y
+
+    // Single precision: if one of these pointers is not NULL, it is used instead of the double column of the same name, which is
+    // then not needed. The columns read from the CSV file are always in double precision.
+    float *crown_height_single;
+    float *crown_diameter_single;
+    float *shading_factor_single;
+    float *conversion_factor_single;
+    float *stomatal_conductance_single;
+    float *mass_emission_factor_single;
+};
+
+// --------------------------------------------------------------------------------------------------------------------
+// column_value: This function returns the element k of a column stored either in double precision or, if column_single
+//               is not NULL, in single precision.
+// Input: double column, single column (or NULL), index of the element
+// Output: value of the element as a double
+// --------------------------------------------------------------------------------------------------------------------
+
+double column_value(double *column, float *column_single, long long k) {
+    return column_single != NULL ? (double)column_single[k] : column[k];
+}
+
+// --------------------------------------------------------------------------------------------------------------------
+// load_tree: This function copies the input fields of one tree from the columns into a Tree structure, so that the
+//            functions of a_model_functions.c can be applied to it. The intermediate results stay in that structure.
+//            The columns in single precision are converted to double.
+// Input: columns, index of the tree, Tree structure
+// Output: nothing
+// --------------------------------------------------------------------------------------------------------------------
+
+void load_tree(struct TreeColumns *columns, int k, struct Tree *tree) {
+    tree->species_code = columns->species_code[k];
+    tree->crown_height = column_value(columns->crown_height, columns->crown_height_single, k);
+    tree->crown_diameter = column_value(columns->crown_diameter, columns->crown_diameter_single, k);
+    tree->position_y = columns->position_y[k];
+    tree->position_x = columns->position_x[k];
+    tree->shading_factor = column_value(columns->shading_factor, columns->shading_factor_single, k);
+    tree->conversion_factor = column_value(columns->conversion_factor, columns->conversion_factor_single, k);
+    tree->leaves_days = columns->leaves_days[k];
+    tree->stomatal_conductance = column_value(columns->stomatal_conductance, columns->stomatal_conductance_single, k);
+    for (int i = 0; i < 3; i++) {
+        tree->mass_emission_factor[i] = column_value(columns->mass_emission_factor, columns->mass_emission_factor_single, 3 * (long long)k + i);
+        tree->max_incremental_reactivity[i] = columns->max_incremental_reactivity[i];
+    }
+}
+
+// --------------------------------------------------------------------------------------------------------------------
+// store_parsed_columns: This function copies the fields of a parsed line into the columns at the index k. The code of
+//                       the species is given afterwards by encode_species.
+// Input: ParsedTree structure filled by tokenize_line, columns, index of the tree
+// Output: nothing
+// --------------------------------------------------------------------------------------------------------------------
+
+void store_parsed_columns(struct ParsedTree *tree, void *target, int k) {
+    struct TreeColumns *columns = target;
+    columns->crown_height[k] = tree->crown_height;
+    columns->crown_diameter[k] = tree->crown_diameter;
+    columns->position_y[k] = tree->position_y;
+    columns->position_x[k] = tree->position_x;
+    columns->leaves_days[k] = tree->leaves_days;
+    columns->stomatal_conductance[k] = tree->stomatal_conductance;
+}
+
+// --------------------------------------------------------------------------------------------------------------------
+// clear_columns: This function sets the input fields read from the CSV file of the trees k, ..., columns->size - 1
+//                to zero and their species to the empty name (trees missing from the file).
+// --------------------------------------------------------------------------------------------------------------------
+
+void clear_columns(struct TreeColumns *columns, int k, struct SpeciesTable *species) {
+    if(k >= columns->size) return;
+    struct ParsedTree empty = {0};
+    int code = species_code(species, "", 0);
+    for(; k < columns->size; k++) {
+        store_parsed_columns(&empty, columns, k);
+        columns->species_code[k] = code;
+    }
+}
+
+// ---------------------------------------------------------------------------------------------------------------------------------
+// readwriteDocument_columns: This function opens the CSV file and saves the data about the trees into the predefined columns.
+//                            It reads exactly columns->size trees, fills in missing crown heights and diameters with the average
+//                            of the measured values (and flags them) and writes the same control file as readwriteDocument.
+// Input: filepath, columns allocated in Python, table of the species (see new_species_table)
+// Output: nothing
+// ---------------------------------------------------------------------------------------------------------------------------------
+
+void readwriteDocument_columns(char *filename, struct TreeColumns *columns, struct SpeciesTable *species) {
+    // Open the CSV file
+    struct MappedFile mapped;
+    if (map_file(filename, &mapped) != 0) {
+        printf("Error opening file\n");
+        exit(-1);
+    }
+    printf("File opening worked\n");
+
+    // Skip the first line, then read in the rest and parse it into the columns
+    struct ProfileClock start = profile_start();
+    size_t begin = mapped.size > 0 ? (size_t)(line_end(mapped.data, mapped.data + mapped.size) - mapped.data) + 1 : 0;
+    size_t *block_starts;
+    size_t stop;
+    int lines = index_lines(&mapped, begin, columns->size, 0, &block_starts, &stop);
+    if(lines < 0 || parse_species_lines(&mapped, block_starts, lines, 0, store_parsed_columns, columns, species, columns->species_code) != 0) {
+        printf("Memory allocation for the lines failed\n");
+        exit(-1);
+    }
+    clear_columns(columns, lines, species);
+    free(block_starts);
+    unmap_file(&mapped);
+    profile_stop(PROFILE_PARSE, start, columns->size);
+
+    // Calculation of the average height and crown diameter for trees missing these measured values in the CSV file
+    start = profile_start();
+    int count_h = 0;
+    int count_d = 0;
+    double sum_h = 0.0;
+    double sum_d = 0.0;
+
+    for(int k = 0; k < columns->size; k++) {
+        if(columns->crown_height[k] != 0.0) {
+            count_h += 1;
+            sum_h += columns->crown_height[k];
+        }
+        if(columns->crown_diameter[k] != 0.0) {
+            count_d += 1;
+            sum_d += columns->crown_diameter[k];
+        }
+    }
+
+    double average_height = sum_h/count_h;
+    double average_crown_diameter = sum_d/count_d;
+
+    // Adding the average values to the trees missing these measured values in the CSV file, and flagging them
+    for(int k = 0; k < columns->size; k++) {
+        if(columns->crown_height_imputed != NULL) columns->crown_height_imputed[k] = columns->crown_height[k] == 0.0;
+        if(columns->crown_diameter_imputed != NULL) columns->crown_diameter_imputed[k] = columns->crown_diameter[k] == 0.0;
+        if(columns->crown_height[k] == 0.0) {
+            columns->crown_height[k] = average_height;
+        }
+        if(columns->crown_diameter[k] == 0.0) {
+            columns->crown_diameter[k] = average_crown_diameter;
+        }
+    }
+    profile_stop(PROFILE_IMPUTATION, start, (columns->size - count_h) + (columns->size - count_d));
+
+    // Write content to a control CSV file --> not necessary but helps to check for errors
+    start = profile_start();
+    FILE *file_out = fopen("Results/trees_GE.csv", "w");
+
+    if (file_out == NULL) {
+        printf("Error opening file!\n");
+        exit(-1);
+    }
+
+    fprintf(file_out, "Tree name; Crown Height; Crown Diameter, Position X, Position Y, Leaves Days\n");
+    for(int k = 0; k < columns->size; k++) {
+        fprintf(file_out, "%s ; %f ; %f ; %f ; %f ; %d \n ", species->species.names + (size_t)columns->species_code[k] * SPECIES_NAME_LENGTH, columns->crown_height[k], columns->crown_diameter[k], columns->position_x[k], columns->position_y[k], columns->leaves_days[k]);
+    }
+
+    fclose(file_out);
+    profile_stop(PROFILE_CONTROL_FILE, start, columns->size);
+    printf("Data written to 'trees_GE.txt' successfully!\n");
+}
+
+// ---------------------------------------------------------------------------------------------------------------------------------
+// read_mapped_chunk: This function reads the next chunk of at most columns->size trees of a mapped CSV file, starting at the byte
+//                    *offset (0 for the beginning of the file, in which case the header is skipped). Empty lines are skipped.
+// Input: mapped file, offset in the file (updated to the beginning of the next chunk), columns, table of the species
+// Output: number of trees read, 0 once the end of the file is reached, -1 if the memory allocation failed
+// ---------------------------------------------------------------------------------------------------------------------------------
+
+int read_mapped_chunk(struct MappedFile *mapped, size_t *offset, struct TreeColumns *columns, struct SpeciesTable *species) {
+    // Skip the header or go to the beginning of the chunk
+    struct ProfileClock start = profile_start();
+    size_t begin = *offset;
+    if(*offset == 0 && mapped->size > 0) {
+        begin = (size_t)(line_end(mapped->data, mapped->data + mapped->size) - mapped->data) + 1;
+    }
+
+    size_t *block_starts;
+    size_t stop = mapped->size;
+    int k = begin < mapped->size ? index_lines(mapped, begin, columns->size, 1, &block_starts, &stop) : 0;
+    if(k < 0) return -1;
+    if(begin < mapped->size) {
+        int result = parse_species_lines(mapped, block_starts, k, 1, store_parsed_columns, columns, species, columns->species_code);
+        free(block_starts);
+        if(result != 0) return -1;
+    }
+    *offset = stop;
+    profile_stop(PROFILE_PARSE, start, k);
+    return k;
+}
+
+// ---------------------------------------------------------------------------------------------------------------------------------
+// read_chunk_columns: This function reads the next chunk of at most columns->size trees of the CSV file (see read_mapped_chunk).
+//                     No average values are filled in and no control file is written, since this needs all the trees. 
+// Input: filepath, offset in the file (updated to the beginning of the next chunk), columns allocated in Python, table of the
+//        species, kept for all the chunks of the file so that the codes are the same in every chunk
+// Output: number of trees read, 0 once the end of the file is reached, -1 if an error occurred
+// ---------------------------------------------------------------------------------------------------------------------------------
+
+int read_chunk_columns(char *filename, long long *offset, struct TreeColumns *columns, struct SpeciesTable *species) {
+    struct MappedFile mapped;
+    if (map_file(filename, &mapped) != 0) {
+        printf("Error opening file\n");
+        return -1;
+    }
+    size_t position = (size_t)*offset;
+    int k = read_mapped_chunk(&mapped, &position, columns, species);
+    if(k >= 0) *offset = (long long)position;
+    unmap_file(&mapped);
+    return k;
+}
+
+// ----------------------------------------------------------------------------------
+// free_columns: This function frees the columns allocated by allocate_columns.
+// ----------------------------------------------------------------------------------
+
+void free_columns(struct TreeColumns *columns) {
+    free(columns->species_code);
+    free(columns->crown_height);
+    free(columns->crown_diameter);
+    free(columns->position_y);
+    free(columns->position_x);
+    free(columns->shading_factor);
+    free(columns->conversion_factor);
+    free(columns->leaves_days);
+    free(columns->stomatal_conductance);
+    free(columns->mass_emission_factor);
+    memset(columns, 0, sizeof(struct TreeColumns));
+}
+
+// ---------------------------------------------------------------------------------------------------------------------------------
+// allocate_columns: This function allocates the input columns of size trees in C, for the chunks of the fused mode (see
+//                   scan_inventory and add_file_to_grids). The optional columns and the single precision columns are set to NULL,
+//                   and the MIR values are given by the caller.
+// Input: columns, amount of trees
+// Output: 0, -1 if the memory allocation failed (the columns are then freed)
+// ---------------------------------------------------------------------------------------------------------------------------------
+
+int allocate_columns(struct TreeColumns *columns, int size) {
+    memset(columns, 0, sizeof(struct TreeColumns));
+    columns->size = size;
+    size_t count = size > 0 ? (size_t)size : 1;
+    columns->species_code = malloc(count * sizeof(int));
+    columns->crown_height = malloc(count * sizeof(double));
+    columns->crown_diameter = malloc(count * sizeof(double));
+    columns->position_y = malloc(count * sizeof(double));
+    columns->position_x = malloc(count * sizeof(double));
+    columns->shading_factor = malloc(count * sizeof(double));
+    columns->conversion_factor = malloc(count * sizeof(double));
+    columns->leaves_days = malloc(count * sizeof(int));
+    columns->stomatal_conductance = malloc(count * sizeof(double));
+    columns->mass_emission_factor = malloc(3 * count * sizeof(double));
+    if(columns->species_code == NULL || columns->crown_height == NULL || columns->crown_diameter == NULL || columns->position_y == NULL ||
+       columns->position_x == NULL || columns->shading_factor == NULL || columns->conversion_factor == NULL || columns->leaves_days == NULL ||
+       columns->stomatal_conductance == NULL || columns->mass_emission_factor == NULL) {
+        free_columns(columns);
+        return -1;
+    }
+    return 0;
+}
+
+// ------------------------------------------------------------------------------------------------
+// Structure for the statistics of a whole CSV file, filled by scan_inventory (mirrored in Python):
+// ------------------------------------------------------------------------------------------------
+
+struct InventoryStatistics {
+    long long size;                        // number of trees in the file
+    double sum_height;                     // sum and number of the measured crown heights (not 0)
+    long long count_height;
+    double sum_crown_diameter;             // sum and number of the measured crown diameters (not 0)
+    long long count_crown_diameter;
+    int capacity;                          // number of species codes for which the arrays below have room
+    long long *species_count;              // number of trees of every species code
+    double *species_extent;                // min_x, max_x, min_y, max_y of the trees of every species code
+};
+
+// ---------------------------------------------------------------------------------------------------------------------------------
+// free_inventory_statistics: This function frees the arrays of the statistics (the structure itself belongs to the caller).
+// ---------------------------------------------------------------------------------------------------------------------------------
+
+void free_inventory_statistics(struct InventoryStatistics *statistics) {
+    free(statistics->species_count);
+    free(statistics->species_extent);
+    statistics->species_count = NULL;
+    statistics->species_extent = NULL;
+    statistics->capacity = 0;
+}
+
+// ---------------------------------------------------------------------------------------------------------------------------------
+// scan_inventory: This function is the first pass of the fused mode over the CSV file. It reads the file chunk by chunk into columns
+//                 of chunk_size trees allocated here, fills in the species table and adds every tree to the statistics. The crown
+//                 heights and diameters are summed in the order of the file, like in readwriteDocument_columns. The memory used only
+//                 depends on chunk_size and on the number of species.
+// Input: filepath, amount of trees per chunk, table of the species, statistics set to zero by the caller
+// Output: 0, -1 if an error occurred
+// ---------------------------------------------------------------------------------------------------------------------------------
+
+int scan_inventory(char *filename, int chunk_size, struct SpeciesTable *species, struct InventoryStatistics *statistics) {
+    struct MappedFile mapped;
+    if (map_file(filename, &mapped) != 0) {
+        printf("Error opening file\n");
+        return -1;
+    }
+    struct TreeColumns columns;
+    if(allocate_columns(&columns, chunk_size) != 0) {
+        unmap_file(&mapped);
+        return -1;
+    }
+
+    size_t offset = 0;
+    int size;
+    int result = 0;
+    while((size = read_mapped_chunk(&mapped, &offset, &columns, species)) > 0) {
+        // Room for the new species of the chunk
+        if(species->species.count > statistics->capacity) {
+            int capacity = species->species.capacity;
+            long long *species_count = realloc(statistics->species_count, (size_t)capacity * sizeof(long long));
+            if(species_count != NULL) statistics->species_count = species_count;
+            double *species_extent = realloc(statistics->species_extent, 4 * (size_t)capacity * sizeof(double));
+            if(species_extent != NULL) statistics->species_extent = species_extent;
+            if(species_count == NULL || species_extent == NULL) {
+                result = -1;
+                break;
+            }
+            for(int code = statistics->capacity; code < capacity; code++) {
+                statistics->species_count[code] = 0;
+                statistics->species_extent[4 * code] = INFINITY;
+                statistics->species_extent[4 * code + 1] = -INFINITY;
+                statistics->species_extent[4 * code + 2] = INFINITY;
+                statistics->species_extent[4 * code + 3] = -INFINITY;
+            }
+            statistics->capacity = capacity;
+        }
+
+        for(int k = 0; k < size; k++) {
+            if(columns.crown_height[k] != 0.0) {
+                statistics->count_height += 1;
+                statistics->sum_height += columns.crown_height[k];
+            }
+            if(columns.crown_diameter[k] != 0.0) {
+                statistics->count_crown_diameter += 1;
+                statistics->sum_crown_diameter += columns.crown_diameter[k];
+            }
+            int code = columns.species_code[k];
+            double *extent = statistics->species_extent + 4 * (size_t)code;
+            statistics->species_count[code] += 1;
+            if(columns.position_x[k] < extent[0]) extent[0] = columns.position_x[k];
+            if(columns.position_x[k] > extent[1]) extent[1] = columns.position_x[k];
+            if(columns.position_y[k] < extent[2]) extent[2] = columns.position_y[k];
+            if(columns.position_y[k] > extent[3]) extent[3] = columns.position_y[k];
+        }
+        statistics->size += size;
+    }
+    if(size < 0) result = -1;
+
+    free_columns(&columns);
+    unmap_file(&mapped);
+    return result;
+}
@@ -3,11 +3,27 @@
 #include <stdlib.h>
 #include <string.h>
 
-#include "b_extract_data_and_memory.c"
+#include "c_tree_columns.c"
 
-//-----------------------------------------------------------------------
+#define BLOCK_SIZE 65536     // number of trees whose results are computed in parallel before being added to the grids
+
+//-----------------------------------------------------------------------------------------------------------------------------------
 // This file includes the functions related to the creation of the grid.
-//-----------------------------------------------------------------------
+// The calculations run in two steps. First, the trees are divided among the threads and the model is applied to each of them.
+// Then, every thread adds the results of the trees lying in its own band of grid rows, in the order of the trees. Each grid cell is
+// therefore always summed in the same order as with one thread, so the grids are identical whatever the number of threads.
+//-----------------------------------------------------------------------------------------------------------------------------------
+
+// --------------------------------------------------------------------------------------------------------
+// row_band: This function returns the band of grid rows [first_row, last_row) of the calling thread.
+// Input: number of rows of the grid, pointers to the first row and to the row after the last one
+// Output: None
+// --------------------------------------------------------------------------------------------------------
+
+void row_band(int length_y, int *first_row, int *last_row) {
+    *first_row = (int)((long long)length_y * THREAD_NUM / THREAD_COUNT);
+    *last_row = (int)((long long)length_y * (THREAD_NUM + 1) / THREAD_COUNT);
+}
 
 // -----------------------------------------------------------------
 // max: This function finds the maximum within an array of doubles.
@@ -85,7 +101,7 @@ void coordinates_adaption(struct Tree *trees, double *x, double *y, int size_tre
 // distance: This function finds the point with the minimum x and y coordinates and the point with the maximum x and y coordinates.
 //           It then calculates the distance between these two points and divides it by the size of the grid. We use gridsize = 100
 //           to distribute the trees over square fields of 100 x 100 m. The distance is given in meters since we are using the LV95 
-//           coordinate system. 
+//           coordinate system. The grid always has at least one cell, so that trees sharing the same coordinate are still counted.
 // ---------------------------------------------------------------------------------------------------------------------------------
 
 int distance(double *points, int size_trees_array, int gridsize) {
@@ -94,51 +110,377 @@ int distance(double *points, int size_trees_array, int gridsize) {
     double max_p = max(points, size_trees_array);
     
     // Calculate the distance between these points and divide it by gridsize
-    return (int)ceil((max_p - min_p)/gridsize);
+    int length = (int)ceil((max_p - min_p)/gridsize);
+    if(length < 1) length = 1;
+    return length;
+}
+
+// ------------------------------------------------------------------------------------------------------------------------------
+// cell_index: This function returns the index of the grid cell containing a (shifted) coordinate. Cells are half-open intervals
+//             [k * gridsize, (k + 1) * gridsize), so that a tree lying on the edge between two cells is assigned to exactly one 
+//             of them. The last cell also contains its upper edge, which is where the tree with the maximum coordinate lies.
+// Input: shifted coordinate, size of grid cells, number of cells in that direction
+// Output: index of the cell
+// ------------------------------------------------------------------------------------------------------------------------------
+
+int cell_index(double position_grid, int gridsize, int length) {
+    int index = (int)floor(position_grid / gridsize);
+    if(index >= length) index = length - 1;
+    if(index < 0) index = 0;
+    return index;
+}
+
+// ------------------------------------------------------------------------------------------------------------------------------
+// tile_index: This function does the same as cell_index for a grid that only covers the cells first, first + 1, ..., first +
+//             length - 1 of a larger grid (e.g. a tile of the canton grid). The cells are counted from the same origin, so a tree
+//             is in the same cell whether it is computed alone, in a tile or in the whole canton.
+// Input: shifted coordinate, size of grid cells, index of the first cell of the grid, number of cells in that direction
+// Output: index of the cell within the grid
+// ------------------------------------------------------------------------------------------------------------------------------
+
+int tile_index(double position_grid, int gridsize, int first, int length) {
+    int index = (int)floor(position_grid / gridsize) - first;
+    if(index >= length) index = length - 1;
+    if(index < 0) index = 0;
+    return index;
 }
 
 // --------------------------------------------------------------------------------------------------------------------------------------------------------
 // calculations: This function calculates all the properties necessary to find the PM10 deposition, the OFP and the O3 removal. 
-//               It applies the formulas of the model to all the trees present in a 100 x 100 m square field and adds the sum of 
-//               the results to the corresponding grid cell.
+//               The formulas of the model are applied to the trees in parallel, and the grid cell of each tree is kept in a buffer. Then each
+//               thread scans the buffer and adds the trees of its band of grid rows to their grid cells. The sums are converted to kg/y once all trees have been added.
 // Inputs: Size of tree array, distances of grid in x and y direction, previously allocated grids, tree array, pollutant concentrations, size of gridcells
 // Ouputs: None
 // --------------------------------------------------------------------------------------------------------------------------------------------------------
 
 void calculations(int size_trees_array_filtered_trees, int length_y, int length_x, double **grid_OFP, double **grid_PM10, double **grid_O3, double **grid_O3_net_uptake, struct Tree *trees, double conc_PM10_city, double conc_O3_city, int gridsize) {
+    int *cell_y = malloc(size_trees_array_filtered_trees * sizeof(int));
+    int *cell_x = malloc(size_trees_array_filtered_trees * sizeof(int));
+    if (size_trees_array_filtered_trees > 0 && (cell_y == NULL || cell_x == NULL)) {
+        printf("Memory allocation failed for the grid cells of the trees.\n");
+        exit(-1);
+    }
+
+    // Find the grid cell of each tree and apply the functions defined in a_model_functions.c to it
+    struct ProfileClock start = profile_start();
+    #pragma omp parallel for num_threads(get_threads()) schedule(static)
+    for(int k = 0; k < size_trees_array_filtered_trees; k++) {
+        cell_y[k] = cell_index(trees[k].position_y_grid, gridsize, length_y);
+        cell_x[k] = cell_index(trees[k].position_x_grid, gridsize, length_x);
+        model_functions(&trees[k], conc_PM10_city, conc_O3_city);
+    }
+    profile_stop(PROFILE_MODEL, start, size_trees_array_filtered_trees);
+
+    // Add the results of each tree to its grid cell
+    start = profile_start();
+    #pragma omp parallel num_threads(get_threads())
+    {
+        int first_row, last_row;
+        row_band(length_y, &first_row, &last_row);
+        for(int k = 0; k < size_trees_array_filtered_trees; k++) {
+            int i = cell_y[k];
+            if(i < first_row || i >= last_row) continue;
+            int j = cell_x[k];
+            grid_OFP[i][j] += trees[k].OFP_yearly;
+            grid_PM10[i][j] += trees[k].PM10_yearly;
+            grid_O3[i][j] += trees[k].O3_removed_mass_yearly;
+            grid_O3_net_uptake[i][j] += trees[k].O3_net_uptake_yearly;
+        }
+    }
+    profile_stop(PROFILE_BINNING, start, size_trees_array_filtered_trees);
+    free(cell_y);
+    free(cell_x);
+
+    // Convert the values in the grid cells to kg/y
+    start = profile_start();
+    #pragma omp parallel for num_threads(get_threads()) schedule(static)
+    for(int i = 0; i < length_y; i++) {
+        for(int j = 0; j < length_x; j++) {
+            grid_OFP[i][j] = grid_OFP[i][j] * pow(10, -9);
+            grid_O3[i][j] = grid_O3[i][j] * pow(10, -3);
+            grid_O3_net_uptake[i][j] = grid_O3_net_uptake[i][j] * pow(10, -3);
+        }
+    }
+    profile_stop(PROFILE_CONVERSION, start, (long long)length_y * length_x);
+}
+
+// ---------------------------------------------------------------------------------------------------------------------------------------
+// add_columns_to_cells: This function does the same as calculations, but for trees stored in columns (see c_tree_columns.c), and without
+//                       the conversion to kg/y, so that it can be called several times on the same grids (e.g. for chunks of trees).
+//                       The grids cover the cells first_row, ..., first_row + length_y - 1 and first_column, ..., first_column + length_x - 1
+//                       counted from the origin (see tile_index).
+//                       The trees are handled by blocks of BLOCK_SIZE trees: the inputs of each tree are loaded into a local Tree structure
+//                       and its grid cell and results are kept in buffers of the size of a block, which are then added to the grids.
+//                       The per-tree results are only stored if the corresponding columns were allocated.
+// Inputs: columns of filtered trees, coordinates of the origin, index of the first row and column of the grids, distances of grid in y and
+//         x direction, previously allocated grids, pollutant concentrations, size of gridcells
+// Ouputs: None
+// ---------------------------------------------------------------------------------------------------------------------------------------
+
+void add_columns_to_cells(struct TreeColumns *columns, double origin_x, double origin_y, int first_row, int first_column, int length_y, int length_x, double **grid_OFP, double **grid_PM10, double **grid_O3, double **grid_O3_net_uptake, double conc_PM10_city, double conc_O3_city, int gridsize) {
+    int *cell_y = malloc(BLOCK_SIZE * sizeof(int));
+    int *cell_x = malloc(BLOCK_SIZE * sizeof(int));
+    double *results = malloc(4 * BLOCK_SIZE * sizeof(double));     // OFP, PM10, O3 removed mass and O3 net uptake of each tree
+    if (cell_y == NULL || cell_x == NULL || results == NULL) {
+        printf("Memory allocation failed for the results of the trees.\n");
+        exit(-1);
+    }
+
+    for(int start = 0; start < columns->size; start += BLOCK_SIZE) {
+        int end = columns->size - start < BLOCK_SIZE ? columns->size : start + BLOCK_SIZE;
+
+        // Find the grid cell of each tree and apply the functions defined in a_model_functions.c to it
+        struct ProfileClock clock_start = profile_start();
+        #pragma omp parallel for num_threads(get_threads()) schedule(static)
+        for(int k = start; k < end; k++) {
+            struct Tree tree;
+            load_tree(columns, k, &tree);
+            double position_x_grid = tree.position_x - origin_x;
+            double position_y_grid = tree.position_y - origin_y;
+            cell_y[k - start] = tile_index(position_y_grid, gridsize, first_row, length_y);
+            cell_x[k - start] = tile_index(position_x_grid, gridsize, first_column, length_x);
+
+            model_functions(&tree, conc_PM10_city, conc_O3_city);
+            results[4 * (k - start)] = tree.OFP_yearly;
+            results[4 * (k - start) + 1] = tree.PM10_yearly;
+            results[4 * (k - start) + 2] = tree.O3_removed_mass_yearly;
+            results[4 * (k - start) + 3] = tree.O3_net_uptake_yearly;
+
+            // Store the per-tree results if they are needed
+            if(columns->position_x_grid != NULL) columns->position_x_grid[k] = position_x_grid;
+            if(columns->position_y_grid != NULL) columns->position_y_grid[k] = position_y_grid;
+            if(columns->OFP_yearly != NULL) columns->OFP_yearly[k] = tree.OFP_yearly;
+            if(columns->PM10_yearly != NULL) columns->PM10_yearly[k] = tree.PM10_yearly;
+            if(columns->O3_removed_mass_yearly != NULL) columns->O3_removed_mass_yearly[k] = tree.O3_removed_mass_yearly;
+            if(columns->O3_net_uptake_yearly != NULL) columns->O3_net_uptake_yearly[k] = tree.O3_net_uptake_yearly;
+        }
+        profile_stop(PROFILE_MODEL, clock_start, end - start);
+
+        // Add the results of each tree of the block to its grid cell
+        clock_start = profile_start();
+        #pragma omp parallel num_threads(get_threads())
+        {
+            int first_row, last_row;
+            row_band(length_y, &first_row, &last_row);
+            for(int k = 0; k < end - start; k++) {
+                int i = cell_y[k];
+                if(i < first_row || i >= last_row) continue;
+                int j = cell_x[k];
+                grid_OFP[i][j] += results[4 * k];
+                grid_PM10[i][j] += results[4 * k + 1];
+                grid_O3[i][j] += results[4 * k + 2];
+                grid_O3_net_uptake[i][j] += results[4 * k + 3];
+            }
+        }
+        profile_stop(PROFILE_BINNING, clock_start, end - start);
+    }
+
+    free(cell_y);
+    free(cell_x);
+    free(results);
+}
+
+// ---------------------------------------------------------------------------------------------------------------------------------------
+// add_columns_to_grids: This function adds the trees stored in columns to grids whose origin is the most southwestern point (see
+//                       add_columns_to_cells).
+// Inputs: columns of filtered trees, coordinates of the origin, distances of grid in y and x direction, previously allocated grids, 
+//         pollutant concentrations, size of gridcells
+// Ouputs: None
+// ---------------------------------------------------------------------------------------------------------------------------------------
+
+void add_columns_to_grids(struct TreeColumns *columns, double min_x, double min_y, int length_y, int length_x, double **grid_OFP, double **grid_PM10, double **grid_O3, double **grid_O3_net_uptake, double conc_PM10_city, double conc_O3_city, int gridsize) {
+    add_columns_to_cells(columns, min_x, min_y, 0, 0, length_y, length_x, grid_OFP, grid_PM10, grid_O3, grid_O3_net_uptake, conc_PM10_city, conc_O3_city, gridsize);
+}
+
+// ------------------------------------------------------------------------------------------------------
+// convert_grids: This function converts the sums added by add_columns_to_cells to kg/y. The PM10 grid is
+//                already in kg/y and is only given so that all the callers pass the four grids.
+// Inputs: distances of grid in y and x direction, grids
+// Ouputs: None
+// ------------------------------------------------------------------------------------------------------
+
+void convert_grids(int length_y, int length_x, double **grid_OFP, double **grid_PM10, double **grid_O3, double **grid_O3_net_uptake) {
+    (void)grid_PM10;                       // unused: the PM10 sums are already in kg/y
+    struct ProfileClock start = profile_start();
+    #pragma omp parallel for num_threads(get_threads()) schedule(static)
     for(int i = 0; i < length_y; i++) {
         for(int j = 0; j < length_x; j++) {
-            double OFP_tot = 0.0;
-            double PM10_tot = 0.0;
-            double O3_uptake_tot = 0.0;
-            double O3_net_uptake_tot = 0.0;
-
-            for(int k = 0; k < size_trees_array_filtered_trees; k++) {
-                if((trees[k].position_x_grid <= j * gridsize + gridsize && trees[k].position_x_grid >= j * gridsize) && (trees[k].position_y_grid >= i * gridsize && trees[k].position_y_grid <= i * gridsize + gridsize)) {  // tree needs to be within the grid cell that we are currently analyzing
-                    // Apply the functions defined in a_model_functions.c to each tree present in a square field
-                    leaf_area_func(&trees[k]);
-                    leaf_dry_weight_func(&trees[k]);
-                    OFP_hourly_func(&trees[k]);
-                    OFP_yearly_func(&trees[k]);
-                    OFP_tot += trees[k].OFP_yearly;
-                    PM10_yearly_func(&trees[k], conc_PM10_city);
-                    PM10_tot += trees[k].PM10_yearly;
-                    O3_instantaneous_func(&trees[k], conc_O3_city);
-                    O3_yearly_func(&trees[k]);
-                    O3_removal_yearly_func(&trees[k]);
-                    O3_removed_mass_yearly_func(&trees[k]);
-                    O3_uptake_tot += trees[k].O3_removed_mass_yearly;
-                    O3_net_uptake_yearly_func(&trees[k]);
-                    O3_net_uptake_tot += trees[k].O3_net_uptake_yearly;
-                }
+            grid_OFP[i][j] = grid_OFP[i][j] * pow(10, -9);
+            grid_O3[i][j] = grid_O3[i][j] * pow(10, -3);
+            grid_O3_net_uptake[i][j] = grid_O3_net_uptake[i][j] * pow(10, -3);
+        }
+    }
+    profile_stop(PROFILE_CONVERSION, start, (long long)length_y * length_x);
+}
+
+// ------------------------------------------------------------------------------------------------------------------
+// Structure for the scientific parameters of every genus code of a species table (mirrored in Python, see
+// genus_parameters in e_filter_trees.py):
+// ------------------------------------------------------------------------------------------------------------------
+
+struct GenusParameters {
+    int count;                             // number of genus codes
+    unsigned char *known;                  // 1 if the genus is found in all the files of parameters, 0 otherwise
+    double *conversion_factor;             // g/m2
+    double *mass_emission_factor;          // 3 values per genus, ug(VOC)/gdw/h
+    double *shading_factor;                // no units, %
+    double *max_incremental_reactivity;    // 3 values shared by all genera, g(O3)/g(VOC)
+};
+
+// ---------------------------------------------------------------------------------------------------------------------------------------
+// add_file_to_grids: This function is the second pass of the fused mode over the CSV file. It reads the file chunk by chunk into columns
+//                    of chunk_size trees allocated here, fills in the missing crown heights and diameters, keeps the trees whose genus is
+//                    known and gives them the parameters of their genus, and adds them to the grids (see add_columns_to_cells). No tree
+//                    is kept after its chunk, so the memory used only depends on chunk_size, on the grids and on the tables. The trees are
+//                    added in the order of the file, so the grids are the same as the ones of the columns of all the filtered trees.
+// Inputs: filepath, amount of trees per chunk, table of the species filled by scan_inventory, parameters of its genus codes, average
+//         crown height and diameter, coordinates of the origin, distances of grid in y and x direction, previously allocated grids,
+//         pollutant concentrations, size of gridcells
+// Ouputs: number of trees added to the grids, -1 if an error occurred
+// ---------------------------------------------------------------------------------------------------------------------------------------
+
+long long add_file_to_grids(char *filename, int chunk_size, struct SpeciesTable *species, struct GenusParameters *parameters, double average_height, double average_crown_diameter, double min_x, double min_y, int length_y, int length_x, double **grid_OFP, double **grid_PM10, double **grid_O3, double **grid_O3_net_uptake, double conc_PM10_city, double conc_O3_city, int gridsize) {
+    struct MappedFile mapped;
+    if (map_file(filename, &mapped) != 0) {
+        printf("Error opening file\n");
+        return -1;
+    }
+    struct TreeColumns columns;
+    if(allocate_columns(&columns, chunk_size) != 0) {
+        unmap_file(&mapped);
+        return -1;
+    }
+    columns.max_incremental_reactivity = parameters->max_incremental_reactivity;
+
+    size_t offset = 0;
+    int size;
+    long long added = 0;
+    while((size = read_mapped_chunk(&mapped, &offset, &columns, species)) > 0) {
+        // Filter the trees of the chunk and move the kept ones to the beginning of the columns
+        struct ProfileClock start = profile_start();
+        int kept = 0;
+        for(int k = 0; k < size; k++) {
+            int genus = species->genus[columns.species_code[k]];
+            if(genus >= parameters->count || !parameters->known[genus]) continue;
+            columns.species_code[kept] = columns.species_code[k];
+            columns.crown_height[kept] = columns.crown_height[k] != 0.0 ? columns.crown_height[k] : average_height;
+            columns.crown_diameter[kept] = columns.crown_diameter[k] != 0.0 ? columns.crown_diameter[k] : average_crown_diameter;
+            columns.position_y[kept] = columns.position_y[k];
+            columns.position_x[kept] = columns.position_x[k];
+            columns.leaves_days[kept] = columns.leaves_days[k];
+            columns.stomatal_conductance[kept] = columns.stomatal_conductance[k];
+            columns.shading_factor[kept] = parameters->shading_factor[genus];
+            columns.conversion_factor[kept] = parameters->conversion_factor[genus];
+            for(int i = 0; i < 3; i++) {
+                columns.mass_emission_factor[3 * kept + i] = parameters->mass_emission_factor[3 * genus + i];
             }
-            
-            // Add the values to the fields in the grid and convert them to kg/y
-            grid_OFP[i][j] = OFP_tot * pow(10, -9);
-            grid_PM10[i][j] = PM10_tot;
-            grid_O3[i][j] = O3_uptake_tot * pow(10,-3);
-            grid_O3_net_uptake[i][j] = O3_net_uptake_tot * pow(10,-3);
+            kept++;
         }
+        profile_stop(PROFILE_IMPUTATION, start, size);
+
+        // Add the kept trees to the grids, then give the columns their full size again for the next chunk
+        columns.size = kept;
+        add_columns_to_grids(&columns, min_x, min_y, length_y, length_x, grid_OFP, grid_PM10, grid_O3, grid_O3_net_uptake, conc_PM10_city, conc_O3_city, gridsize);
+        columns.size = chunk_size;
+        added += kept;
     }
+
+    free_columns(&columns);
+    unmap_file(&mapped);
+    return size < 0 ? -1 : added;
 }
 
+// ----------------------------------------------------------------------------------
+// Structure linking a tree to its grid cell, used to sort the trees by grid cell:
+// ----------------------------------------------------------------------------------
+
+struct SparseEntry {
+    long long cell;      // index of the cell in the grid: row * length_x + column
+    int tree;            // index of the tree in the columns
+};
+
+// ---------------------------------------------------------------------------------------------
+// compare_sparse_entries: This function orders the entries by cell, then by tree (for qsort).
+// ---------------------------------------------------------------------------------------------
+
+int compare_sparse_entries(const void *a, const void *b) {
+    const struct SparseEntry *entry_a = a;
+    const struct SparseEntry *entry_b = b;
+    if(entry_a->cell != entry_b->cell) return entry_a->cell < entry_b->cell ? -1 : 1;
+    return (entry_a->tree > entry_b->tree) - (entry_a->tree < entry_b->tree);
+}
+
+// -------------------------------------------------------------------------------------------------------------------------------------------
+// columns_to_sparse_cells: This function does the same as add_columns_to_grids followed by convert_grids, but only returns the occupied
+//                          cells of the grids, sorted by index (coordinate list). The memory used depends on the number of trees and not on
+//                          the size of the grid. The trees are sorted by cell and the trees of each cell are added in their order, so the
+//                          values are the same as the ones of the dense grids.
+// Inputs: columns of filtered trees, coordinates of the origin, distances of grid in y and x direction, arrays of at least columns->size
+//         elements for the cells and for the values of each output, pollutant concentrations, size of gridcells
+// Ouputs: number of occupied cells (the first elements of the arrays), -1 if the memory allocation failed
+// -------------------------------------------------------------------------------------------------------------------------------------------
+
+int columns_to_sparse_cells(struct TreeColumns *columns, double min_x, double min_y, int length_y, int length_x, long long *cells, double *sparse_OFP, double *sparse_PM10, double *sparse_O3, double *sparse_O3_net_uptake, double conc_PM10_city, double conc_O3_city, int gridsize) {
+    int size = columns->size;
+    struct SparseEntry *entries = malloc((size > 0 ? size : 1) * sizeof(struct SparseEntry));
+    double *results = malloc((size > 0 ? 4 * size : 1) * sizeof(double));       // OFP, PM10, O3 removed mass and O3 net uptake of each tree
+    if (entries == NULL || results == NULL) {
+        printf("Memory allocation failed for the results of the trees.\n");
+        free(entries);
+        free(results);
+        return -1;
+    }
+
+    // Find the grid cell of each tree and apply the functions defined in a_model_functions.c to it
+    struct ProfileClock start = profile_start();
+    #pragma omp parallel for num_threads(get_threads()) schedule(static)
+    for(int k = 0; k < size; k++) {
+        struct Tree tree;
+        load_tree(columns, k, &tree);
+        int i = cell_index(tree.position_y - min_y, gridsize, length_y);
+        int j = cell_index(tree.position_x - min_x, gridsize, length_x);
+        entries[k].cell = (long long)i * length_x + j;
+        entries[k].tree = k;
+
+        model_functions(&tree, conc_PM10_city, conc_O3_city);
+        results[4 * k] = tree.OFP_yearly;
+        results[4 * k + 1] = tree.PM10_yearly;
+        results[4 * k + 2] = tree.O3_removed_mass_yearly;
+        results[4 * k + 3] = tree.O3_net_uptake_yearly;
+    }
+    profile_stop(PROFILE_MODEL, start, size);
+
+    // Sort the trees by cell and add the results of the trees of each cell
+    start = profile_start();
+    qsort(entries, size, sizeof(struct SparseEntry), compare_sparse_entries);
+    int count = 0;
+    for(int k = 0; k < size; k++) {
+        int tree = entries[k].tree;
+        if(k == 0 || entries[k].cell != entries[k - 1].cell) {
+            cells[count] = entries[k].cell;
+            sparse_OFP[count] = 0.0;
+            sparse_PM10[count] = 0.0;
+            sparse_O3[count] = 0.0;
+            sparse_O3_net_uptake[count] = 0.0;
+            count += 1;
+        }
+        sparse_OFP[count - 1] += results[4 * tree];
+        sparse_PM10[count - 1] += results[4 * tree + 1];
+        sparse_O3[count - 1] += results[4 * tree + 2];
+        sparse_O3_net_uptake[count - 1] += results[4 * tree + 3];
+    }
+    profile_stop(PROFILE_BINNING, start, size);
+
+    // Convert the values in the cells to kg/y
+    start = profile_start();
+    for(int k = 0; k < count; k++) {
+        sparse_OFP[k] = sparse_OFP[k] * pow(10, -9);
+        sparse_O3[k] = sparse_O3[k] * pow(10, -3);
+        sparse_O3_net_uptake[k] = sparse_O3_net_uptake[k] * pow(10, -3);
+    }
+    profile_stop(PROFILE_CONVERSION, start, count);
+
+    free(entries);
+    free(results);
+    return count;
+}
@@ -2,11 +2,14 @@ import numpy as np
 import math
 from Functions.h_structures import *
 import ctypes
+import weakref
 
 # -----------------------------------------------------------------------------------------------------------------------
 # This file contains a function that filters through the initial array of trees to identify the genera for which we have 
 # all the required data. Trees that do not meet this criterion are excluded. The function then creates a new nd.array for
-# the filtered trees. This file also contains a function used to change C_POINTERS into 2D arrays for visualization.
+# the filtered trees (or new columns of trees). The trees only carry the code of their species; the genus of every species
+# and the parameters of every genus come from the species table (see h_structures.py), built by C while the CSV file is
+# read. This file also contains a function used to wrap C_POINTERS as 2D arrays for visualization.
 # -----------------------------------------------------------------------------------------------------------------------
 
 # -------------------------------------------------------------------------------------------------
@@ -24,7 +27,7 @@ def readfile(file_name):
             data = line.split(";")
             full_name = data[0]                                     # extract the whole name: genus + species
             first_name = full_name.split()[0]                       # extract only the genus 
-            names_values_dic[first_name] = []                       # create a dictionary with the genera as keys 
+            names_values_dic.setdefault(first_name, [])             # create a dictionary with the genera as keys, keeping the values of the previous species of the genus
             
             n = len(data[1:])                                       # count how many values follow the name  
             if n == 1:                                              # this applies for the conversion factor and the shading coefficient 
@@ -56,54 +59,237 @@ def readfile(file_name):
   
     return names_values_dic     
 
-# --------------------------------------------------------------------------------------------------------------------------------------------------------------              
-# filter_trees: This function creates dictionaries based on different files containing scientific parameters. An average value of the scientific parameter
-#               is calculated for each tree genus present in that file. Then, the function iterates over the array of trees in Geneva and tests if data can 
-#               be found for the tree (only the genus is considered) in ALL of the dictionaries. Only in that case, the tree is added to a new array containing
-#               the filtered trees.
-# Inputs: filled tree array, empty tree array, four file paths
-# Outputs: filtered tree array (fills the empty tree array)
-# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# -------------------------------------------------------------------------------------------------------------------------------------------------
+# genus_of: This function extracts the genus (first word) of a species name. The name can be a string or bytes (names of the species table).
+# Input: species name
+# Output: genus, empty string if the name is empty
+# -------------------------------------------------------------------------------------------------------------------------------------------------
+
+def genus_of(species_name):
+    if isinstance(species_name, bytes):
+        species_name = species_name.decode('utf-8', errors='replace')
+    words = str(species_name).split()
+    return words[0] if words else ""
+
+# ----------------------------------------------------------------------------------------------------------------------------------
+# read_parameters: This function reads the four files containing scientific parameters (see readfile).
+# Inputs: four file paths
+# Outputs: dictionaries of the conversion factor, EF, shading coefficient and MIR
+# ----------------------------------------------------------------------------------------------------------------------------------
 
-def filter_trees(trees, filtered_trees, conversion_factor, EF, shading_coeff, MIR):
+def read_parameters(conversion_factor, EF, shading_coeff, MIR):
     dic_conversion_factor = readfile(conversion_factor)
     dic_EF = readfile(EF)
     dic_shading_coefficient = readfile(shading_coeff)        # filtering is done for conversion factor, EF and shading coefficient; it is not necessary for MIR
-    dic_MIR = readfile(MIR)                                           
-
-    names1 = list(dic_conversion_factor.keys())
-    names2 = list(dic_EF.keys())
-    names3 = list(dic_shading_coefficient.keys())
-    counts = 0
-    hits = 0
-    for i in range(len(trees)):
-        full_species_name = str(trees[i]['species_name'])
-        first_species_name = full_species_name.split()[0]         # for each tree in the array of trees in Geneva, extract the genus
-        counts += 1
-        if first_species_name in names1 and first_species_name in names2 and first_species_name in names3:    # test if the genus is present in ALL the dictionaries containing the scientific parameters 
-            filtered_trees = np.append(filtered_trees, trees[i])
-            index1 = names1.index(first_species_name)
-            index2 = names2.index(first_species_name)
-            index3 = names3.index(first_species_name)
-            filtered_trees[hits]['conversion_factor'] = dic_conversion_factor[first_species_name]              # add the scientific parameters to the tree structure 
-            filtered_trees[hits]['mass_emission_factor'] = dic_EF[first_species_name]
-            filtered_trees[hits]['shading_factor'] = dic_shading_coefficient[first_species_name]
-            filtered_trees[hits]['max_incremental_reactivity'][0] = dic_MIR['isoprene']                        # furthermore, add the MIR data to the tree structure
-            filtered_trees[hits]['max_incremental_reactivity'][1] = dic_MIR['monoterpenes']
-            filtered_trees[hits]['max_incremental_reactivity'][2] = dic_MIR['sesquiterpenes']
-            hits += 1
-        
+    dic_MIR = readfile(MIR)
+    return dic_conversion_factor, dic_EF, dic_shading_coefficient, dic_MIR
+
+# ----------------------------------------------------------------------------------------------------------------------------------
+# declare_species_functions: This function defines the C functions creating, reading and freeing the species table.
+# Input: shared library
+# Output: None
+# ----------------------------------------------------------------------------------------------------------------------------------
+
+def declare_species_functions(clibrary):
+    clibrary.new_species_table.argtypes = []
+    clibrary.new_species_table.restype = ctypes.c_void_p
+    clibrary.free_species_table.argtypes = [ctypes.c_void_p]
+    clibrary.free_species_table.restype = None
+    clibrary.get_species_count.argtypes = [ctypes.c_void_p]
+    clibrary.get_species_count.restype = ctypes.c_int
+    clibrary.get_genus_count.argtypes = [ctypes.c_void_p]
+    clibrary.get_genus_count.restype = ctypes.c_int
+    clibrary.copy_species_table.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.POINTER(ctypes.c_int), ctypes.c_char_p]
+    clibrary.copy_species_table.restype = None
+    clibrary.main_function1_columns.argtypes = [ctypes.c_char_p, ctypes.POINTER(TreeColumns), ctypes.c_void_p]
+    clibrary.main_function1_columns.restype = None
+
+# ----------------------------------------------------------------------------------------------------------------------------------
+# species_table_columns: This function copies the species table of C into NumPy arrays (see get_species_table).
+# Input: shared library, species table created by new_species_table
+# Output: dictionary of NumPy arrays
+# ----------------------------------------------------------------------------------------------------------------------------------
+
+def species_table_columns(clibrary, table):
+    species = get_species_table(clibrary.get_species_count(table), clibrary.get_genus_count(table))
+    clibrary.copy_species_table(table, species['species'].ctypes.data_as(ctypes.c_char_p), species['species_genus'].ctypes.data_as(ctypes.POINTER(ctypes.c_int)),
+                                species['genera'].ctypes.data_as(ctypes.c_char_p))
+    return species
+
+# ----------------------------------------------------------------------------------------------------------------------------------
+# read_tree_columns: This function reads the CSV file with the trees in Geneva into columns with C (main_function1_columns) and
+#                    adds the species table of their codes to the columns.
+# Input: shared library, filepath, columns allocated by get_tree_columns (their size is the amount of trees read)
+# Output: columns
+# ----------------------------------------------------------------------------------------------------------------------------------
+
+def read_tree_columns(clibrary, file_name, columns):
+    declare_species_functions(clibrary)
+    table = clibrary.new_species_table()
+    if not table:
+        raise MemoryError("The species table could not be allocated")
+    try:
+        clibrary.main_function1_columns(file_name.encode(encoding="utf-8"), ctypes.byref(c_tree_columns(columns)), table)
+        columns.update(species_table_columns(clibrary, table))
+    finally:
+        clibrary.free_species_table(table)
+    return columns
+
+# ----------------------------------------------------------------------------------------------------------------------------------
+# encode_species: This function gives species codes to names the same way as C does while reading the CSV file: the names are cut
+#                 to SPECIES_NAME_LENGTH - 1 bytes and new species (and genera) are added at the end of the table, so the codes of
+#                 the species already in it do not change.
+# Inputs: species names (strings or bytes), optional species table
+# Outputs: species codes, species table with the new species
+# ----------------------------------------------------------------------------------------------------------------------------------
+
+def encode_species(names, species=None):
+    species = get_species_table() if species is None else species
+    species_codes = {name: code for code, name in enumerate(species['species'])}
+    genus_codes = {name: code for code, name in enumerate(species['genera'])}
+    new_species, new_genus, new_genera = [], [], []
+    codes = np.empty(len(names), dtype=column_dtypes['species_code'])
+    for k, name in enumerate(names):
+        name = name.encode('utf-8') if isinstance(name, str) else bytes(name)
+        name = name[:SPECIES_NAME_LENGTH - 1].split(b'\0')[0]
+        if name not in species_codes:
+            words = name.decode('utf-8', errors='surrogateescape').split()
+            genus = words[0].encode('utf-8', errors='surrogateescape') if words else b''
+            if genus not in genus_codes:
+                genus_codes[genus] = len(genus_codes)
+                new_genera.append(genus)
+            species_codes[name] = len(species_codes)
+            new_species.append(name)
+            new_genus.append(genus_codes[genus])
+        codes[k] = species_codes[name]
+
+    table = get_species_table(len(species_codes), len(genus_codes))
+    table['species'][:] = list(species['species']) + new_species
+    table['species_genus'][:] = list(species['species_genus']) + new_genus
+    table['genera'][:] = list(species['genera']) + new_genera
+    return codes, table
+
+# ----------------------------------------------------------------------------------------------------------------------------------
+# genus_names: This function decodes the names of the genera of a species table.
+# Input: species table (or columns containing it)
+# Output: list of strings, one per genus code
+# ----------------------------------------------------------------------------------------------------------------------------------
+
+def genus_names(species):
+    return [genus.decode('utf-8', errors='replace') for genus in species['genera']]
+
+# ----------------------------------------------------------------------------------------------------------------------------------
+# genus_parameters: This function puts the scientific parameters of the genera of a species table into dense arrays, one entry per
+#                   genus code. Genera missing from one of the files get zeros.
+# Inputs: list of genera (see genus_names), dictionaries of the conversion factor, EF and shading coefficient (see read_parameters)
+# Outputs: boolean array of the genera found in ALL the dictionaries, dictionary of the parameters for each genus code
+# ----------------------------------------------------------------------------------------------------------------------------------
+
+def genus_parameters(genera, dic_conversion_factor, dic_EF, dic_shading_coefficient):
+    known = np.array([genus in dic_conversion_factor and genus in dic_EF and genus in dic_shading_coefficient for genus in genera], dtype=bool)
+    parameters = {
+        'conversion_factor': np.array([dic_conversion_factor.get(genus, 0.0) for genus in genera], dtype=np.float64),
+        'mass_emission_factor': np.array([dic_EF.get(genus, [0.0, 0.0, 0.0]) for genus in genera], dtype=np.float64).reshape(-1, 3),
+        'shading_factor': np.array([dic_shading_coefficient.get(genus, 0.0) for genus in genera], dtype=np.float64)
+    }
+    return known, parameters
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# genus_filter: This function creates dictionaries based on the files containing scientific parameters. An average value of each scientific parameter is
+#               calculated for each tree genus present in that file (see readfile). The parameters are stored in dense arrays indexed by the genus codes of
+#               the species table, and the genus code of each tree is the one of its species, so that the trees for which data is found in ALL of the
+#               dictionaries are selected with a boolean mask, without looking at any name.
+# Inputs: species code of each tree, species table (or columns containing it), four file paths, optional dictionary filled with the amount of trees kept
+#         and dropped for each genus, optional dictionaries already read from the four files (see read_parameters), used instead of reading them again
+# Outputs: boolean mask of the trees to keep, genus code of each tree, dictionary of the parameters for each genus code
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def genus_filter(species_code, species, conversion_factor, EF, shading_coeff, MIR, report=None, dictionaries=None):
+    if dictionaries is None:
+        dictionaries = read_parameters(conversion_factor, EF, shading_coeff, MIR)
+    dic_conversion_factor, dic_EF, dic_shading_coefficient, dic_MIR = dictionaries
+
+    # Dense arrays of parameters, one entry per genus
+    genera = genus_names(species)
+    known, parameters = genus_parameters(genera, dic_conversion_factor, dic_EF, dic_shading_coefficient)
+    parameters['max_incremental_reactivity'] = np.array([dic_MIR['isoprene'], dic_MIR['monoterpenes'], dic_MIR['sesquiterpenes']])
+
+    # Test if the genus of each tree is present in ALL the dictionaries containing the scientific parameters
+    genus_codes = species['species_genus'][species_code]
+    mask = known[genus_codes]
+
+    # Amount of trees kept and dropped for each genus
+    if report is not None:
+        counts = np.bincount(genus_codes, minlength=len(genera))
+        for genus, count, kept in zip(genera, counts, known):
+            if count > 0:
+                previous = report.get(genus, (0, 0))
+                report[genus] = (previous[0] + int(count), previous[1]) if kept else (previous[0], previous[1] + int(count))
+
+    return mask, genus_codes, parameters
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# filter_trees: This function keeps the trees of the array of trees in Geneva for which data is found in ALL the files containing scientific parameters
+#               (see genus_filter). The new array is created in one step and the scientific parameters are added to it column by column.
+# Inputs: filled tree array, species table of its codes, four file paths, optional dictionary filled with the amount of trees kept and dropped for each genus
+# Outputs: filtered tree array
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def filter_trees(trees, species, conversion_factor, EF, shading_coeff, MIR, report=None):
+    mask, genus_codes, parameters = genus_filter(trees['species_code'], species, conversion_factor, EF, shading_coeff, MIR, report)
+    codes = genus_codes[mask]
+
+    filtered_trees = trees[mask]
+    filtered_trees['conversion_factor'] = parameters['conversion_factor'][codes]              # add the scientific parameters to the tree array
+    filtered_trees['mass_emission_factor'] = parameters['mass_emission_factor'][codes]
+    filtered_trees['shading_factor'] = parameters['shading_factor'][codes]
+    filtered_trees['max_incremental_reactivity'] = parameters['max_incremental_reactivity']    # furthermore, add the MIR data to the tree array
     return filtered_trees
 
-# -------------------------------------------------------------------------
-# c_pp_to_np: This function turns a pointer pointer into a 2D NumPy array.
-# Input: length in y and x, POINTER(POINTER(ctypes.c_double))
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# filter_tree_columns: This function does the same as filter_trees for the columns of trees defined in h_structures.py, which contain their species table.
+#                      The crown sizes and the scientific parameters of the filtered trees are stored in the given precision (see set_precision).
+# Inputs: dictionary of columns, four file paths, optional dictionary filled with the amount of trees kept and dropped for each genus, precision
+#         ("double" or "single"), optional dictionaries already read from the four files (see genus_filter)
+# Outputs: dictionary of columns of the filtered trees
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def filter_tree_columns(columns, conversion_factor, EF, shading_coeff, MIR, report=None, precision="double", dictionaries=None):
+    mask, genus_codes, parameters = genus_filter(columns['species_code'], columns, conversion_factor, EF, shading_coeff, MIR, report, dictionaries)
+    codes = genus_codes[mask]
+    dtype = precision_dtypes[precision]
+
+    filtered_columns = select_tree_columns(columns, mask)
+    filtered_columns['conversion_factor'] = parameters['conversion_factor'].astype(dtype)[codes]
+    filtered_columns['mass_emission_factor'] = parameters['mass_emission_factor'].astype(dtype)[codes]
+    filtered_columns['shading_factor'] = parameters['shading_factor'].astype(dtype)[codes]
+    filtered_columns['max_incremental_reactivity'] = parameters['max_incremental_reactivity']
+    return set_precision(filtered_columns, precision)
+
+# ---------------------------------------------------------------------------------------------------
+# write_genus_report: This function writes the amount of trees kept and dropped for each genus into
+#                     a semicolon-delimited file, sorted by the amount of dropped trees.
+# Input: dictionary filled by filter_trees or filter_tree_columns, filepath
+# Output: None
+# ---------------------------------------------------------------------------------------------------
+
+def write_genus_report(report, file_name):
+    with open(file_name, "w") as file:
+        file.write("Genus;Trees kept;Trees dropped\n")
+        for genus, (kept, dropped) in sorted(report.items(), key=lambda item: (-item[1][1], -item[1][0], item[0])):
+            file.write(f"{genus};{kept};{dropped}\n")
+
+# ---------------------------------------------------------------------------------------------------------------------
+# c_pp_to_np: This function turns a pointer pointer allocated by get_gridarray into a 2D NumPy array without any copy.
+#             The cells of the grid are one contiguous block starting at grid[0], which the NumPy array uses directly.
+#             If free_grid is given, the NumPy array owns the grid: the grid is freed by C once the array and all the
+#             views of it are deleted, so free_grid must not be called on it anymore.
+# Input: length in y and x, POINTER(POINTER(ctypes.c_double)), optional C function free_grid
 # Output: 2D NumPy array
-# -------------------------------------------------------------------------
+# ---------------------------------------------------------------------------------------------------------------------
 
-def c_pp_to_np(y,  x, grid):
-    grid_np = np.zeros((y, x))     # initialize a NumPy array
-    for i in range(y):
-        row_ptr = grid[i]          # dereference the row pointer
-        grid_np[i, :] = np.ctypeslib.as_array(row_ptr, shape=(x,))
+def c_pp_to_np(y,  x, grid, free_grid=None):
+    grid_np = np.ctypeslib.as_array(grid[0], shape=(y, x))
+    if free_grid is not None:
+        weakref.finalize(grid_np, free_grid, grid)
     return grid_np
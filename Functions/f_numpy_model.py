@@ -0,0 +1,278 @@
+import numpy as np
+import math
+from Functions.h_structures import *
+from Functions.e_filter_trees import encode_species
+
+# ------------------------------------------------------------------------------------------------------------------------
+# This file contains a pure NumPy version of the model. The functions mirror the ones written in C (a_model_functions.c,
+# b_extract_data_and_memory.c, d_grid_functions.c), but they work on whole columns of a NumPy array of type tree_dtype
+# at once instead of on a single Tree structure (the dictionaries of columns defined in h_structures.py work as well).
+# This backend can be used on machines where the shared library has not been built, and gives the same results as the
+# C backend.
+# ------------------------------------------------------------------------------------------------------------------------
+
+# Same constants as in a_model_functions.c and b_extract_data_and_memory.c
+PI = 3.14159265358979323846
+MW_O3 = 47.997                       # molar weight of O3 in g/mol
+MOLAR_VOLUME = 0.02445               # molar volume of air at STP in m³/mol
+P = 12                               # photoperiod: approximation of 12 h/day
+Vd = 0.0064                          # dry deposition velocity of PM10 in m/s
+DIFF_RATIO = 0.613                   # diffusibility ratio between ozone and water vapor
+PART_SUSP_RATE = 0.5                 # particle resuspension rate back to the atmosphere
+STOMATAL_O3_FLUX = 0.3               # a stomatal flux of 30% of total potential O3 was considered
+LEAVE_DAYS_EVERGREENS = 365          # value taken from Kofel, Donato, et al.
+LEAVE_DAYS_BROADLEAVES = 183         # value taken from Kofel, Donato, et al.
+STOMATAL_COND_EVERGREENS = 16.896    # value taken from Zeppel et al.
+STOMATAL_COND_BROADLEAVES = 72.637   # value taken from Zeppel et al.
+
+# ---------------------------------------------------------------------------------------------------------------------
+# csv_field: This function returns the field k of a split line of the CSV file if the separator after it was found, and
+#            the empty string otherwise (see tokenize_line in C).
+# Input: list of the fields of the line, index of the field
+# Output: field
+# ---------------------------------------------------------------------------------------------------------------------
+
+def csv_field(data, k):
+    return data[k] if k < len(data) - 1 else ""
+
+# -------------------------------------------------------------------------------------------------------------------------
+# main_function1_numpy: This function reads the CSV file with the trees in Geneva into a NumPy array of type tree_dtype.
+#                       It reads the same fields as readwriteDocument in C and fills in missing crown heights and diameters
+#                       with the average of the measured values (flagged in crown_height_imputed and crown_diameter_imputed).
+#                       No control file is written.
+#                       Note: readwriteDocument resets the trunk height for every field it parses, so the crown height it
+#                       stores is the total height of the tree. The same is done here so that both backends agree.
+#                       The species get the same codes as in C (see encode_species). As in C, a field is only used if the
+#                       separator after it is found (see tokenize_line), and the trees missing at the end of the file get
+#                       the empty species and zeros.
+# Input: filepath, amount of trees for computations
+# Output: tree array, species table of its codes
+# -------------------------------------------------------------------------------------------------------------------------
+
+def main_function1_numpy(file_name, size_org):
+    species_name, height, diameter, tree_type, position_x, position_y = [], [], [], [], [], []
+
+    with open(file_name, "r", encoding="utf-8") as file:
+        file.readline()                                           # skip the header
+        for i in range(size_org):
+            line = file.readline()
+            if not line:
+                break                                             # end of the file
+            data = line.rstrip("\n").split(";")
+            species_name.append(csv_field(data, 1))
+            height.append(float(csv_field(data, 9) or 0.0))       # an empty field counts as missing (0.0), like atof in C
+            diameter.append(float(csv_field(data, 10) or 0.0))
+            tree_type.append(csv_field(data, 22))
+            position_x.append(float(csv_field(data, 28) or 0.0))
+            position_y.append(float((data[29] if len(data) > 29 else "") or 0.0))     # the rest of the line, like in C
+
+    # Trees missing from the file
+    missing = size_org - len(species_name)
+    species_name += [""] * missing
+    tree_type += [""] * missing
+    for values in [height, diameter, position_x, position_y]:
+        values += [0.0] * missing
+
+    species_code, species = encode_species(species_name)
+    trees = np.zeros(size_org, dtype=tree_dtype)
+    trees['species_code'] = species_code
+    trees['crown_height'] = height
+    trees['crown_diameter'] = diameter
+    trees['position_x'] = position_x
+    trees['position_y'] = position_y
+
+    # Add the attributes depending on whether the tree is evergreen or deciduous
+    tree_type = np.array(tree_type)
+    broadleaves = tree_type == "Feuillus"
+    evergreens = tree_type == "Conifères"
+    trees['leaves_days'][broadleaves] = LEAVE_DAYS_BROADLEAVES
+    trees['stomatal_conductance'][broadleaves] = STOMATAL_COND_BROADLEAVES
+    trees['leaves_days'][evergreens] = LEAVE_DAYS_EVERGREENS
+    trees['stomatal_conductance'][evergreens] = STOMATAL_COND_EVERGREENS
+
+    # Add the average values to the trees missing the measured crown height or diameter, and flag them
+    for field in ['crown_height', 'crown_diameter']:
+        missing = trees[field] == 0.0
+        trees[field + '_imputed'] = missing
+        trees[field][missing] = trees[field][~missing].mean()
+
+    return trees, species
+
+# --------------------------------------------------------------------------------------------------
+# Model functions: each function computes one field of a_model_functions.c for all the trees at once
+# --------------------------------------------------------------------------------------------------
+
+# Input column in double precision: like load_tree in C, the columns stored in single precision are converted first
+def double_column(trees, name):
+    return np.asarray(trees[name], dtype=np.float64)
+
+# Leaf area : LA
+def leaf_area_func(trees):
+    H = double_column(trees, 'crown_height')
+    D = double_column(trees, 'crown_diameter')
+    S = double_column(trees, 'shading_factor')
+    C = PI * D * (H + D) / 2                                                 # C is based on the outer surface area of the tree crown.
+    ln_LA = -4.33 + 0.29 * H + 0.73 * D + 5.72 * S - 0.01 * C                # regression equation
+    trees['leaf_area'] = np.exp(ln_LA)
+
+# Leaf biomass / leaf dry weight : LW
+def leaf_dry_weight_func(trees):
+    trees['leaf_dry_wright'] = trees['leaf_area'] * double_column(trees, 'conversion_factor')
+
+# Ozone-forming potential (per hour) : OFP_hourly
+def OFP_hourly_func(trees):
+    EF = double_column(trees, 'mass_emission_factor')
+    MIR = trees['max_incremental_reactivity']
+    sum_EF_MIR = EF[..., 0] * MIR[..., 0] + EF[..., 1] * MIR[..., 1] + EF[..., 2] * MIR[..., 2]     # MIR is either given per tree or shared by all trees (columns)
+    trees['OFP_hourly'] = trees['leaf_dry_wright'] * sum_EF_MIR
+
+# Annual ozone-forming potential (per year) : OFP_yearly
+def OFP_yearly_func(trees):
+    trees['OFP_yearly'] = trees['OFP_hourly'] * trees['leaves_days'] * 24
+
+# Yearly PM10 deposition (per year) : PM10_yearly
+def PM10_yearly_func(trees, conc_PM10_city):
+    trees['PM10_yearly'] = Vd * conc_PM10_city * trees['leaf_area'] * trees['leaves_days'] * 24 * 3600 * PART_SUSP_RATE * 10.0**-9
+
+# Instantaneous stomatal O3 flux (per second) : O3_instantaneous
+def O3_instantaneous_func(trees, conc_O3_city):
+    conc_O3 = conc_O3_city * 10.0**-6                                        # g(O3)/m3
+    ppb_O3 = 10.0**9 * (conc_O3 * MOLAR_VOLUME) / MW_O3                      # ppb, nmol(O3)/mol(air)
+    trees['O3_instantaneous'] = double_column(trees, 'stomatal_conductance') * 10.0**-3 * ppb_O3 * DIFF_RATIO
+
+# Total annual cumulated O3 flux (per year) : O3_yearly
+def O3_yearly_func(trees):
+    trees['O3_yearly'] = trees['O3_instantaneous'] * P * trees['leaves_days'] * 3600 * 10.0**-9
+
+# Total potential O3 removal (per year) : O3_removal_yearly
+def O3_removal_yearly_func(trees):
+    trees['O3_removal_yearly'] = trees['O3_yearly'] / STOMATAL_O3_FLUX
+
+# Annual mass of removed O3 (per year) : O3_removed_mass_yearly
+def O3_removed_mass_yearly_func(trees):
+    trees['O3_removed_mass_yearly'] = trees['O3_removal_yearly'] * trees['leaf_area'] * MW_O3
+
+# Net ozone uptake (per year) : O3_net_uptake_yearly
+def O3_net_uptake_yearly_func(trees):
+    trees['O3_net_uptake_yearly'] = trees['O3_removed_mass_yearly'] - trees['OFP_yearly'] * 10.0**-6
+
+# Whole model, applies all of the functions above in the required order
+def model_functions(trees, conc_PM10_city, conc_O3_city):
+    leaf_area_func(trees)
+    leaf_dry_weight_func(trees)
+    OFP_hourly_func(trees)
+    OFP_yearly_func(trees)
+    PM10_yearly_func(trees, conc_PM10_city)
+    O3_instantaneous_func(trees, conc_O3_city)
+    O3_yearly_func(trees)
+    O3_removal_yearly_func(trees)
+    O3_removed_mass_yearly_func(trees)
+    O3_net_uptake_yearly_func(trees)
+
+# ------------------------------------------------------------------------------------------------------------------
+# Grid functions: same definitions as in d_grid_functions.c
+# ------------------------------------------------------------------------------------------------------------------
+
+# Shift the coordinates so that the origin is the tree located at the most southwestern point
+def coordinates_adaption(trees):
+    trees['position_x_grid'] = trees['position_x'] - trees['position_x'].min()
+    trees['position_y_grid'] = trees['position_y'] - trees['position_y'].min()
+
+# Number of grid cells needed in one direction (at least one)
+def distance(points, gridsize):
+    return max(int(math.ceil((points.max() - points.min()) / gridsize)), 1)
+
+# Index of the cell containing each shifted coordinate; cells are half-open, the last one also contains its upper edge
+def cell_index(positions_grid, gridsize, length):
+    return np.clip(np.floor(positions_grid / gridsize).astype(np.int64), 0, length - 1)
+
+# Same as cell_index for a grid covering the cells first, ..., first + length - 1 counted from the origin
+def tile_index(positions_grid, gridsize, first, length):
+    return np.clip(np.floor(positions_grid / gridsize).astype(np.int64) - first, 0, length - 1)
+
+# --------------------------------------------------------------------------------------------------------------------------
+# main_function2_numpy: This function calculates the values across the grid, like main_function2 in C. The trees are added
+#                       to their grid cell in the order of the array, so the sums are the same as the ones computed in C.
+# Inputs: array of filtered trees, concentration of PM10 in the city, concentration of O3 in the city, gridsize
+# Outputs: grid_OFP, grid_PM10, grid_O3, grid_O3_net_uptake as 2D NumPy arrays (kg/y)
+# --------------------------------------------------------------------------------------------------------------------------
+
+def main_function2_numpy(filtered_trees, C_PM10, C_O3, gridsize):
+    coordinates_adaption(filtered_trees)
+    length_y = distance(filtered_trees['position_y'], gridsize)
+    length_x = distance(filtered_trees['position_x'], gridsize)
+    print(f"These are the lengths of our grid: {length_y}, {length_x}")
+
+    model_functions(filtered_trees, C_PM10, C_O3)
+
+    i = cell_index(filtered_trees['position_y_grid'], gridsize, length_y)
+    j = cell_index(filtered_trees['position_x_grid'], gridsize, length_x)
+    cells = i * length_x + j
+
+    def grid(field):
+        return np.bincount(cells, weights=filtered_trees[field], minlength=length_y * length_x).reshape(length_y, length_x)
+
+    grid_OFP = grid('OFP_yearly') * 10.0**-9
+    grid_PM10 = grid('PM10_yearly')
+    grid_O3 = grid('O3_removed_mass_yearly') * 10.0**-3
+    grid_O3_net_uptake = grid('O3_net_uptake_yearly') * 10.0**-3
+    print("Calculations are done")
+
+    return grid_OFP, grid_PM10, grid_O3, grid_O3_net_uptake
+
+# --------------------------------------------------------------------------------------------------------------------------
+# main_function2_sparse_numpy: This function calculates the values across the grid like main_function2_numpy, but returns
+#                              only the occupied cells (like main_function2_sparse in C).
+# Inputs: array of filtered trees, concentration of PM10 in the city, concentration of O3 in the city, gridsize
+# Outputs: distances of grid in y and x direction, sorted index of the occupied cells (row * length_x + column), values of
+#          the OFP, PM10, O3 removed mass and O3 net uptake in these cells (kg/y)
+# --------------------------------------------------------------------------------------------------------------------------
+
+def main_function2_sparse_numpy(filtered_trees, C_PM10, C_O3, gridsize):
+    coordinates_adaption(filtered_trees)
+    length_y = distance(filtered_trees['position_y'], gridsize)
+    length_x = distance(filtered_trees['position_x'], gridsize)
+    print(f"These are the lengths of our grid: {length_y}, {length_x}")
+
+    model_functions(filtered_trees, C_PM10, C_O3)
+
+    i = cell_index(filtered_trees['position_y_grid'], gridsize, length_y)
+    j = cell_index(filtered_trees['position_x_grid'], gridsize, length_x)
+    cells, occupied = np.unique(i * length_x + j, return_inverse=True)
+
+    def values(field):
+        return np.bincount(occupied.ravel(), weights=filtered_trees[field], minlength=len(cells))
+
+    sparse_OFP = values('OFP_yearly') * 10.0**-9
+    sparse_PM10 = values('PM10_yearly')
+    sparse_O3 = values('O3_removed_mass_yearly') * 10.0**-3
+    sparse_O3_net_uptake = values('O3_net_uptake_yearly') * 10.0**-3
+    print("Calculations are done")
+
+    return length_y, length_x, cells, sparse_OFP, sparse_PM10, sparse_O3, sparse_O3_net_uptake
+
+# --------------------------------------------------------------------------------------------------------------------------
+# main_function2_tile_numpy: This function calculates the values across a grid whose cells are counted from the LV95 origin,
+#                            like main_function2_tile in C. The grid covers the cells first_row, ..., first_row + length_y - 1
+#                            and first_column, ..., first_column + length_x - 1.
+# Inputs: array (or dictionary of columns) of filtered trees, index of the first row and column, number of rows and columns,
+#         concentration of PM10 in the city, concentration of O3 in the city, gridsize
+# Outputs: grid_OFP, grid_PM10, grid_O3, grid_O3_net_uptake as 2D NumPy arrays (kg/y)
+# --------------------------------------------------------------------------------------------------------------------------
+
+def main_function2_tile_numpy(filtered_trees, first_row, first_column, length_y, length_x, C_PM10, C_O3, gridsize):
+    model_functions(filtered_trees, C_PM10, C_O3)
+
+    i = tile_index(filtered_trees['position_y'], gridsize, first_row, length_y)
+    j = tile_index(filtered_trees['position_x'], gridsize, first_column, length_x)
+    cells = i * length_x + j
+
+    def grid(field):
+        return np.bincount(cells, weights=filtered_trees[field], minlength=length_y * length_x).reshape(length_y, length_x)
+
+    grid_OFP = grid('OFP_yearly') * 10.0**-9
+    grid_PM10 = grid('PM10_yearly')
+    grid_O3 = grid('O3_removed_mass_yearly') * 10.0**-3
+    grid_O3_net_uptake = grid('O3_net_uptake_yearly') * 10.0**-3
+
+    return grid_OFP, grid_PM10, grid_O3, grid_O3_net_uptake
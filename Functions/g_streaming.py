@@ -0,0 +1,260 @@
+import numpy as np
+import math
+import ctypes
+import queue
+import threading
+from Functions.h_structures import *
+from Functions.e_filter_trees import *
+
+# ------------------------------------------------------------------------------------------------------------------------
+# This file contains the streaming mode of the program. The CSV file is read in chunks of a fixed amount of trees, so the
+# amount of trees does not need to be known in advance and the memory used only depends on the size of the chunks. While
+# a chunk is filtered and added to the grids, the next chunk is already read by C in a background thread.
+# The file is read twice: the first pass counts the trees and finds the averages used for missing values and the extent of
+# the grid, the second pass adds the trees to the grids. The averages are summed in the order of the file, like in C, so the
+# results are the same, bit for bit, as when all the trees are read at once with the C backend.
+# In the fused mode, both passes run in C without giving the trees to Python: the first pass only keeps the species table
+# and the count and extent of every species, and the second pass filters every chunk, gives the trees the parameters of
+# their genus and adds them to the grids. The memory used then only depends on the grids, the tables and the chunks of C.
+# ------------------------------------------------------------------------------------------------------------------------
+
+# ---------------------------------------------------------------------------------------------
+# declare_streaming_functions: This function defines the C functions used in this file.
+# Input: shared library
+# Output: None
+# ---------------------------------------------------------------------------------------------
+
+def declare_streaming_functions(clibrary):
+    declare_species_functions(clibrary)
+    clibrary.read_chunk_columns.argtypes = [ctypes.c_char_p, ctypes.POINTER(ctypes.c_longlong), ctypes.POINTER(TreeColumns), ctypes.c_void_p]
+    clibrary.read_chunk_columns.restype = ctypes.c_int
+    clibrary.add_columns_to_grids.argtypes = [ctypes.POINTER(TreeColumns), ctypes.c_double, ctypes.c_double, ctypes.c_int, ctypes.c_int] + [ctypes.POINTER(ctypes.POINTER(ctypes.c_double))] * 4 + [ctypes.c_double, ctypes.c_double, ctypes.c_int]
+    clibrary.add_columns_to_grids.restype = None
+    clibrary.convert_grids.argtypes = [ctypes.c_int, ctypes.c_int] + [ctypes.POINTER(ctypes.POINTER(ctypes.c_double))] * 4
+    clibrary.convert_grids.restype = None
+    clibrary.get_gridarray.argtypes = [ctypes.c_int, ctypes.c_int]
+    clibrary.get_gridarray.restype = ctypes.POINTER(ctypes.POINTER(ctypes.c_double))
+    clibrary.free_grid.argtypes = [ctypes.POINTER(ctypes.POINTER(ctypes.c_double))]
+    clibrary.free_grid.restype = None
+    clibrary.scan_inventory.argtypes = [ctypes.c_char_p, ctypes.c_int, ctypes.c_void_p, ctypes.POINTER(InventoryStatistics)]
+    clibrary.scan_inventory.restype = ctypes.c_int
+    clibrary.free_inventory_statistics.argtypes = [ctypes.POINTER(InventoryStatistics)]
+    clibrary.free_inventory_statistics.restype = None
+    clibrary.main_function_fused.argtypes = [ctypes.c_char_p, ctypes.c_int, ctypes.c_void_p, ctypes.POINTER(GenusParameters), ctypes.c_double, ctypes.c_double,
+                                             ctypes.c_double, ctypes.c_double] + [ctypes.POINTER(ctypes.POINTER(ctypes.POINTER(ctypes.c_double)))] * 4 + [
+                                             ctypes.c_int, ctypes.c_int, ctypes.c_double, ctypes.c_double, ctypes.c_int]
+    clibrary.main_function_fused.restype = ctypes.c_longlong
+
+# ---------------------------------------------------------------------------------------------------------------------------
+# read_chunks: This generator reads the CSV file chunk by chunk. A background thread reads the next chunk while the current
+#              one is being used, so at most three chunks are in memory at the same time. One species table is used for the whole
+#              file, so the species codes are the same in all the chunks; every chunk gets a copy of the table as it is after it.
+#              If the generator is closed early (e.g. after an exception in the caller), the thread stops at its next chunk
+#              and frees the species table.
+# Input: shared library, filepath, amount of trees per chunk
+# Output: columns of the trees of each chunk (without average values for missing crown heights and diameters)
+# ---------------------------------------------------------------------------------------------------------------------------
+
+def read_chunks(clibrary, file_name, chunk_size):
+    filepath = ctypes.c_char_p(file_name.encode(encoding="utf-8"))
+    chunks = queue.Queue(maxsize=1)
+    stop = threading.Event()
+
+    # Gives an item to the generator, unless it was closed; returns whether the item was given
+    def put(item):
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def reader():
+        table = clibrary.new_species_table()
+        try:
+            if not table:
+                raise MemoryError("The species table could not be allocated")
+            offset = ctypes.c_longlong(0)
+            while True:
+                columns = get_tree_columns(chunk_size, outputs=False)
+                size = clibrary.read_chunk_columns(filepath, ctypes.byref(offset), ctypes.byref(c_tree_columns(columns)), table)
+                if size < 0:
+                    raise OSError(f"Error reading file {file_name}")
+                if size == 0:
+                    break
+                columns = select_tree_columns(columns, slice(0, size))
+                columns.update(species_table_columns(clibrary, table))
+                if not put(columns):
+                    return
+            put(None)
+        except Exception as error:
+            put(error)
+        finally:
+            clibrary.free_species_table(table)
+
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
+    try:
+        while True:
+            columns = chunks.get()
+            if columns is None:
+                break
+            if isinstance(columns, Exception):
+                raise columns
+            yield columns
+    finally:
+        stop.set()
+        thread.join()
+
+# -------------------------------------------------------------------------------------------------------------------------------
+# inventory_statistics: This function is the first pass over the CSV file. It counts the trees, calculates the average height and
+#                       crown diameter of the trees with measured values, and finds the extent of the filtered trees.
+#                       The measured values are summed one after the other in the order of the file, like readwriteDocument_columns
+#                       in C, so the averages are the same as when all the trees are read at once.
+# Inputs: shared library, filepath, amount of trees per chunk, four file paths, optional dictionaries already read from them
+# Output: dictionary with the amount of trees, the two averages and the minimum and maximum coordinates of the filtered trees
+# -------------------------------------------------------------------------------------------------------------------------------
+
+def inventory_statistics(clibrary, file_name, chunk_size, conversion_factor, EF, shading_coeff, MIR, dictionaries=None):
+    if dictionaries is None:
+        dictionaries = read_parameters(conversion_factor, EF, shading_coeff, MIR)
+    statistics = {'size': 0, 'size_filtered': 0, 'min_x': math.inf, 'max_x': -math.inf, 'min_y': math.inf, 'max_y': -math.inf}
+    sum_h, count_h, sum_d, count_d = 0.0, 0, 0.0, 0
+
+    for columns in read_chunks(clibrary, file_name, chunk_size):
+        statistics['size'] += len(columns['crown_height'])
+        measured_h = columns['crown_height'][columns['crown_height'] != 0.0]
+        measured_d = columns['crown_diameter'][columns['crown_diameter'] != 0.0]
+        sum_h = np.add.accumulate(np.concatenate(([sum_h], measured_h)))[-1]         # sequential sum, continued from the previous chunks
+        count_h += len(measured_h)
+        sum_d = np.add.accumulate(np.concatenate(([sum_d], measured_d)))[-1]
+        count_d += len(measured_d)
+
+        mask = genus_filter(columns['species_code'], columns, conversion_factor, EF, shading_coeff, MIR, dictionaries=dictionaries)[0]
+        if mask.any():
+            statistics['size_filtered'] += int(mask.sum())
+            statistics['min_x'] = min(statistics['min_x'], columns['position_x'][mask].min())
+            statistics['max_x'] = max(statistics['max_x'], columns['position_x'][mask].max())
+            statistics['min_y'] = min(statistics['min_y'], columns['position_y'][mask].min())
+            statistics['max_y'] = max(statistics['max_y'], columns['position_y'][mask].max())
+
+    statistics['average_height'] = float(sum_h) / count_h if count_h > 0 else 0.0
+    statistics['average_crown_diameter'] = float(sum_d) / count_d if count_d > 0 else 0.0
+    return statistics
+
+# ---------------------------------------------------------------------------------------------------------------------------------
+# main_function_streaming: This function reads, filters and adds all the trees of the CSV file to the grids, chunk by chunk.
+# Inputs: shared library, filepath, amount of trees per chunk, four file paths, concentration of PM10 and O3, gridsize,
+#         optional dictionary filled with the amount of trees kept and dropped for each genus
+# Outputs: grid_OFP, grid_PM10, grid_O3, grid_O3_net_uptake as 2D NumPy arrays (kg/y), amount of trees read, amount of filtered trees,
+#          LV95 coordinates (x, y) of the southwestern corner of the grid
+# ---------------------------------------------------------------------------------------------------------------------------------
+
+def main_function_streaming(clibrary, file_name, chunk_size, conversion_factor, EF, shading_coeff, MIR, C_PM10, C_O3, gridsize, report=None):
+    declare_streaming_functions(clibrary)
+
+    # The four files of parameters are read once for both passes
+    dictionaries = read_parameters(conversion_factor, EF, shading_coeff, MIR)
+
+    # First pass
+    statistics = inventory_statistics(clibrary, file_name, chunk_size, conversion_factor, EF, shading_coeff, MIR, dictionaries)
+    if statistics['size_filtered'] == 0:
+        raise ValueError("No tree with known parameters was found in the file")
+    length_y = max(int(math.ceil((statistics['max_y'] - statistics['min_y']) / gridsize)), 1)
+    length_x = max(int(math.ceil((statistics['max_x'] - statistics['min_x']) / gridsize)), 1)
+    print(f"These are the lengths of our grid: {length_y}, {length_x}")
+    grids = [clibrary.get_gridarray(length_y, length_x) for k in range(4)]
+    if not all(grids):
+        for grid in grids:
+            clibrary.free_grid(grid)
+        raise MemoryError("The grids could not be allocated")
+    grids_np = [c_pp_to_np(length_y, length_x, grid, clibrary.free_grid) for grid in grids]       # the NumPy arrays own the grids
+
+    # Second pass
+    for columns in read_chunks(clibrary, file_name, chunk_size):
+        columns['crown_height_imputed'][...] = columns['crown_height'] == 0.0
+        columns['crown_diameter_imputed'][...] = columns['crown_diameter'] == 0.0
+        columns['crown_height'][columns['crown_height_imputed'] == 1] = statistics['average_height']
+        columns['crown_diameter'][columns['crown_diameter_imputed'] == 1] = statistics['average_crown_diameter']
+
+        chunk_report = {}
+        filtered_columns = filter_tree_columns(columns, conversion_factor, EF, shading_coeff, MIR, chunk_report, dictionaries=dictionaries)
+        if report is not None:
+            for genus, (kept, dropped) in chunk_report.items():
+                previous = report.get(genus, (0, 0))
+                report[genus] = (previous[0] + kept, previous[1] + dropped)
+
+        clibrary.add_columns_to_grids(ctypes.byref(c_tree_columns(filtered_columns)), statistics['min_x'], statistics['min_y'], length_y, length_x, *grids, C_PM10, C_O3, gridsize)
+
+    clibrary.convert_grids(length_y, length_x, *grids)
+    print("Calculations are done")
+    return (*grids_np, statistics['size'], statistics['size_filtered'], (float(statistics['min_x']), float(statistics['min_y'])))
+
+# ---------------------------------------------------------------------------------------------------------------------------------
+# main_function_fused: This function does the same as main_function_streaming, but the trees are read, filtered and added to the
+#                      grids by C (see scan_inventory and main_function_fused in C). Python only matches the genera of the species
+#                      table with the files of parameters, between both passes.
+# Inputs: shared library, filepath, amount of trees per chunk, four file paths, concentration of PM10 and O3, gridsize,
+#         optional dictionary filled with the amount of trees kept and dropped for each genus
+# Outputs: grid_OFP, grid_PM10, grid_O3, grid_O3_net_uptake as 2D NumPy arrays (kg/y), amount of trees read, amount of filtered trees,
+#          LV95 coordinates (x, y) of the southwestern corner of the grid
+# ---------------------------------------------------------------------------------------------------------------------------------
+
+def main_function_fused(clibrary, file_name, chunk_size, conversion_factor, EF, shading_coeff, MIR, C_PM10, C_O3, gridsize, report=None):
+    declare_streaming_functions(clibrary)
+    filepath = ctypes.c_char_p(file_name.encode(encoding="utf-8"))
+    table = clibrary.new_species_table()
+    statistics = InventoryStatistics()
+    try:
+        if not table:
+            raise MemoryError("The species table could not be allocated")
+
+        # First pass: species table, averages and count and extent of every species
+        if clibrary.scan_inventory(filepath, chunk_size, table, ctypes.byref(statistics)) != 0:
+            raise OSError(f"Error reading file {file_name}")
+        species = species_table_columns(clibrary, table)
+        count = len(species['species'])
+        species_count = np.ctypeslib.as_array(statistics.species_count, shape=(count,)).copy() if count > 0 else np.zeros(0, dtype=np.int64)
+        species_extent = np.ctypeslib.as_array(statistics.species_extent, shape=(count, 4)).copy() if count > 0 else np.zeros((0, 4))
+
+        # Parameters of every genus, in dense arrays indexed by the genus codes of the table (see genus_filter)
+        dic_conversion_factor, dic_EF, dic_shading_coefficient, dic_MIR = read_parameters(conversion_factor, EF, shading_coeff, MIR)
+        genera = genus_names(species)
+        known, parameters = genus_parameters(genera, dic_conversion_factor, dic_EF, dic_shading_coefficient)
+        parameters['max_incremental_reactivity'] = np.array([dic_MIR['isoprene'], dic_MIR['monoterpenes'], dic_MIR['sesquiterpenes']], dtype=np.float64)
+
+        # Amount of trees kept and dropped for each genus
+        genus_count = np.zeros(len(genera), dtype=np.int64)
+        np.add.at(genus_count, species['species_genus'], species_count)
+        if report is not None:
+            for genus, trees, kept in zip(genera, genus_count, known):
+                if trees > 0:
+                    previous = report.get(genus, (0, 0))
+                    report[genus] = (previous[0] + int(trees), previous[1]) if kept else (previous[0], previous[1] + int(trees))
+
+        # Extent of the trees with known parameters
+        kept_species = known[species['species_genus']] & (species_count > 0)
+        if not kept_species.any():
+            raise ValueError("No tree with known parameters was found in the file")
+        min_x, max_x = species_extent[kept_species, 0].min(), species_extent[kept_species, 1].max()
+        min_y, max_y = species_extent[kept_species, 2].min(), species_extent[kept_species, 3].max()
+        length_y = max(int(math.ceil((max_y - min_y) / gridsize)), 1)
+        length_x = max(int(math.ceil((max_x - min_x) / gridsize)), 1)
+        print(f"These are the lengths of our grid: {length_y}, {length_x}")
+        average_height = statistics.sum_height / statistics.count_height if statistics.count_height > 0 else 0.0
+        average_crown_diameter = statistics.sum_crown_diameter / statistics.count_crown_diameter if statistics.count_crown_diameter > 0 else 0.0
+
+        # Second pass: filtering, parameters, model and grids in C
+        grids = [ctypes.POINTER(ctypes.POINTER(ctypes.c_double))() for k in range(4)]
+        size_filtered = clibrary.main_function_fused(filepath, chunk_size, table, ctypes.byref(c_genus_parameters(known, parameters)), average_height,
+                                                     average_crown_diameter, min_x, min_y, *[ctypes.byref(grid) for grid in grids], length_y, length_x,
+                                                     C_PM10, C_O3, gridsize)
+        if size_filtered < 0:
+            raise OSError(f"Error reading file {file_name}")
+    finally:
+        clibrary.free_inventory_statistics(ctypes.byref(statistics))
+        clibrary.free_species_table(table)
+
+    grids_np = [c_pp_to_np(length_y, length_x, grid, clibrary.free_grid) for grid in grids]       # the NumPy arrays own the grids
+    return (*grids_np, statistics.size, size_filtered, (float(min_x), float(min_y)))
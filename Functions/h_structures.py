@@ -6,9 +6,11 @@ import numpy as np
 #-------------------------------------------------------------------
 
 class Tree(ctypes.Structure):
-    _fields_ = [("species_name", ctypes.c_char_p),
+    _fields_ = [("species_code", ctypes.c_int),
                 ("crown_height", ctypes.c_double),
                 ("crown_diameter", ctypes.c_double),
+                ("crown_height_imputed", ctypes.c_ubyte),
+                ("crown_diameter_imputed", ctypes.c_ubyte),
                 ("position_y", ctypes.c_double),
                 ("position_x", ctypes.c_double),
                 ("position_y_grid", ctypes.c_double),
@@ -32,9 +34,11 @@ class Tree(ctypes.Structure):
 
 # Define the dtype for the NumPy array
 tree_dtype = np.dtype([
-    ('species_name', np.object_),  # Use np.str_ for string data
+    ('species_code', np.int32),    # code of the species in the species table (see species_columns)
     ('crown_height', np.float64),
     ('crown_diameter', np.float64),
+    ('crown_height_imputed', np.uint8),     # 1 if the value was missing in the CSV file and set to the average of the measured values
+    ('crown_diameter_imputed', np.uint8),
     ('position_y', np.float64),
     ('position_x', np.float64),
     ('position_y_grid', np.float64),
@@ -56,3 +60,254 @@ tree_dtype = np.dtype([
     ('O3_removed_mass_yearly', np.float64),
     ('O3_net_uptake_yearly', np.float64)
 ], align = True)
+
+#--------------------------------------------------------------------------------------------------------------------------
+# Columns of trees: the class TreeColumns mirrors the structure in c_tree_columns.c. The columns themselves are contiguous
+# NumPy arrays kept in a dictionary, and only their pointers are given to C, so no conversion is needed between both.
+#--------------------------------------------------------------------------------------------------------------------------
+
+SPECIES_NAME_LENGTH = 64      # same as in b_extract_data_and_memory.c
+
+class TreeColumns(ctypes.Structure):
+    _fields_ = [("size", ctypes.c_int),
+                ("species_code", ctypes.POINTER(ctypes.c_int)),
+                ("crown_height", ctypes.POINTER(ctypes.c_double)),
+                ("crown_diameter", ctypes.POINTER(ctypes.c_double)),
+                ("position_y", ctypes.POINTER(ctypes.c_double)),
+                ("position_x", ctypes.POINTER(ctypes.c_double)),
+                ("shading_factor", ctypes.POINTER(ctypes.c_double)),
+                ("conversion_factor", ctypes.POINTER(ctypes.c_double)),
+                ("leaves_days", ctypes.POINTER(ctypes.c_int)),
+                ("stomatal_conductance", ctypes.POINTER(ctypes.c_double)),
+                ("mass_emission_factor", ctypes.POINTER(ctypes.c_double)),
+                ("max_incremental_reactivity", ctypes.POINTER(ctypes.c_double)),
+                ("crown_height_imputed", ctypes.POINTER(ctypes.c_ubyte)),
+                ("crown_diameter_imputed", ctypes.POINTER(ctypes.c_ubyte)),
+                ("position_y_grid", ctypes.POINTER(ctypes.c_double)),
+                ("position_x_grid", ctypes.POINTER(ctypes.c_double)),
+                ("OFP_yearly", ctypes.POINTER(ctypes.c_double)),
+                ("PM10_yearly", ctypes.POINTER(ctypes.c_double)),
+                ("O3_removed_mass_yearly", ctypes.POINTER(ctypes.c_double)),
+                ("O3_net_uptake_yearly", ctypes.POINTER(ctypes.c_double)),
+                ("crown_height_single", ctypes.POINTER(ctypes.c_float)),
+                ("crown_diameter_single", ctypes.POINTER(ctypes.c_float)),
+                ("shading_factor_single", ctypes.POINTER(ctypes.c_float)),
+                ("conversion_factor_single", ctypes.POINTER(ctypes.c_float)),
+                ("stomatal_conductance_single", ctypes.POINTER(ctypes.c_float)),
+                ("mass_emission_factor_single", ctypes.POINTER(ctypes.c_float))]
+
+# Input columns: name, dtype and shape for one tree. max_incremental_reactivity is shared by all trees. The flags of the crown sizes
+# are 1 for the values missing in the CSV file and filled in with the average of the measured values (used by the Monte Carlo mode).
+input_columns = [('species_code', np.int32, ()),
+                 ('crown_height', np.float64, ()),
+                 ('crown_diameter', np.float64, ()),
+                 ('position_y', np.float64, ()),
+                 ('position_x', np.float64, ()),
+                 ('shading_factor', np.float64, ()),
+                 ('conversion_factor', np.float64, ()),
+                 ('leaves_days', np.int32, ()),
+                 ('stomatal_conductance', np.float64, ()),
+                 ('mass_emission_factor', np.float64, (3,)),
+                 ('crown_height_imputed', np.uint8, ()),
+                 ('crown_diameter_imputed', np.uint8, ())]
+
+column_dtypes = {name: np.dtype(dtype) for name, dtype, shape in input_columns}
+
+# Species table, shared by all trees and kept with the columns: the name of every species code, the genus code of every species
+# and the name of every genus code. It is filled while the CSV file is read (see the dictionary of the species in
+# b_extract_data_and_memory.c), so the genus of a tree is species_genus[species_code].
+species_columns = [('species', f'S{SPECIES_NAME_LENGTH}'),
+                   ('species_genus', np.int32),
+                   ('genera', f'S{SPECIES_NAME_LENGTH}')]
+
+# Columns that do not have one value per tree
+shared_columns = ['max_incremental_reactivity'] + [name for name, dtype in species_columns]
+
+# Optional columns with the per-tree results
+output_columns = ['position_y_grid', 'position_x_grid', 'OFP_yearly', 'PM10_yearly', 'O3_removed_mass_yearly', 'O3_net_uptake_yearly']
+
+# Columns that can be stored in single precision (float32) instead of double precision, with 7 significant digits. The coordinates
+# are always in double precision: LV95 coordinates are around 2.5e6 m, where float32 values are 0.25 m apart, so trees would move
+# to other grid cells.
+single_columns = ['crown_height', 'crown_diameter', 'shading_factor', 'conversion_factor', 'stomatal_conductance', 'mass_emission_factor']
+precision_dtypes = {"double": np.float64, "single": np.float32}
+
+# Unit roundoff of float32: every value stored in single precision has a relative error of at most 2^-24
+SINGLE_ROUNDOFF = 2.0**-24
+
+# ------------------------------------------------------------------------------------------------------
+# get_tree_columns: This function allocates the columns for a given amount of trees, filled with zeros.
+# Input: amount of trees, whether the columns for the per-tree results are needed
+# Output: dictionary of NumPy arrays
+# ------------------------------------------------------------------------------------------------------
+
+def get_tree_columns(size, outputs=True):
+    columns = {name: np.zeros((size,) + shape, dtype=dtype) for name, dtype, shape in input_columns}
+    columns['max_incremental_reactivity'] = np.zeros(3)
+    if outputs:
+        for name in output_columns:
+            columns[name] = np.zeros(size)
+    return columns
+
+# ---------------------------------------------------------------------------------------------------------------------
+# get_species_table: This function allocates the species table for a given amount of species and genera.
+# Input: amount of species, amount of genera
+# Output: dictionary of NumPy arrays
+# ---------------------------------------------------------------------------------------------------------------------
+
+def get_species_table(species_count=0, genus_count=0):
+    return {'species': np.zeros(species_count, dtype=f'S{SPECIES_NAME_LENGTH}'),
+            'species_genus': np.zeros(species_count, dtype=np.int32),
+            'genera': np.zeros(genus_count, dtype=f'S{SPECIES_NAME_LENGTH}')}
+
+# ---------------------------------------------------------------------------------------------------------------------
+# c_tree_columns: This function creates the TreeColumns structure pointing to the NumPy columns, without any copy.
+#                 Missing output columns are passed as NULL. The dictionary needs to be kept alive while C uses it.
+# Input: dictionary of NumPy arrays
+# Output: TreeColumns structure
+# ---------------------------------------------------------------------------------------------------------------------
+
+def c_tree_columns(columns):
+    c_columns = TreeColumns()
+    c_columns.size = len(columns['crown_height'])
+    for name, c_type in TreeColumns._fields_[1:]:
+        single = name.endswith("_single")
+        column_name = name[:-len("_single")] if single else name
+        if column_name not in columns:
+            continue
+        array = columns[column_name]
+        if single != (column_name in single_columns and array.dtype == np.float32):
+            continue                    # the column is given to the field of the other precision
+        dtype = np.dtype(np.float32) if single else column_dtypes.get(name, np.dtype(np.float64))
+        if not array.flags['C_CONTIGUOUS'] or array.dtype != dtype:
+            raise ValueError(f"Column {column_name} needs to be a contiguous array of the type used in c_tree_columns.c")
+        setattr(c_columns, name, array.ctypes.data_as(c_type))
+    return c_columns
+
+#--------------------------------------------------------------------------------------------------------------------------
+# Fused mode: the class InventoryStatistics mirrors the structure in c_tree_columns.c (its arrays are allocated by C and
+# freed with free_inventory_statistics), and the class GenusParameters mirrors the structure in d_grid_functions.c.
+#--------------------------------------------------------------------------------------------------------------------------
+
+class InventoryStatistics(ctypes.Structure):
+    _fields_ = [("size", ctypes.c_longlong),
+                ("sum_height", ctypes.c_double),
+                ("count_height", ctypes.c_longlong),
+                ("sum_crown_diameter", ctypes.c_double),
+                ("count_crown_diameter", ctypes.c_longlong),
+                ("capacity", ctypes.c_int),
+                ("species_count", ctypes.POINTER(ctypes.c_longlong)),
+                ("species_extent", ctypes.POINTER(ctypes.c_double))]
+
+class GenusParameters(ctypes.Structure):
+    _fields_ = [("count", ctypes.c_int),
+                ("known", ctypes.POINTER(ctypes.c_ubyte)),
+                ("conversion_factor", ctypes.POINTER(ctypes.c_double)),
+                ("mass_emission_factor", ctypes.POINTER(ctypes.c_double)),
+                ("shading_factor", ctypes.POINTER(ctypes.c_double)),
+                ("max_incremental_reactivity", ctypes.POINTER(ctypes.c_double))]
+
+# ---------------------------------------------------------------------------------------------------------------------
+# c_genus_parameters: This function creates the GenusParameters structure pointing to the arrays of parameters of every
+#                     genus code, without any copy. The arrays need to be kept alive while C uses them.
+# Input: boolean array of the known genera, dictionary of the parameters of every genus code (see genus_parameters in
+#        e_filter_trees.py, with the MIR values)
+# Output: GenusParameters structure
+# ---------------------------------------------------------------------------------------------------------------------
+
+def c_genus_parameters(known, parameters):
+    c_parameters = GenusParameters()
+    c_parameters.count = len(known)
+    c_parameters.known = known.view(np.uint8).ctypes.data_as(ctypes.POINTER(ctypes.c_ubyte))
+    for name, c_type in GenusParameters._fields_[2:]:
+        array = parameters[name]
+        if not array.flags['C_CONTIGUOUS'] or array.dtype != np.float64:
+            raise ValueError(f"Parameter {name} needs to be a contiguous array of doubles")
+        setattr(c_parameters, name, array.ctypes.data_as(c_type))
+    return c_parameters
+
+# ---------------------------------------------------------------------------------------------------------------------
+# set_precision: This function stores the columns of single_columns in double ("double") or single ("single") precision.
+#                Columns that already have the right type are not copied.
+# Input: dictionary of NumPy arrays, precision
+# Output: dictionary of NumPy arrays
+# ---------------------------------------------------------------------------------------------------------------------
+
+def set_precision(columns, precision):
+    dtype = precision_dtypes[precision]
+    return {name: np.ascontiguousarray(column, dtype=dtype) if name in single_columns else column for name, column in columns.items()}
+
+# ---------------------------------------------------------------------------------------------------------------------
+# precision_error_bound: This function bounds the relative error of the results of every tree caused by storing the
+#                        columns of single_columns in single precision, compared with the same trees in double precision.
+#                        The model is always computed in double precision, so only the rounding of the stored inputs
+#                        (relative error u = 2^-24 each) matters. At first order, the logarithm of the leaf area
+#                        ln(LA) = -4.33 + 0.29 H + 0.73 D + 5.72 S - 0.01 C with C = pi D (H + D) / 2 changes by at most
+#                        u (0.29 H + 0.73 D + 5.72 S + 0.02 C), and the leaf area by the same relative amount. The PM10
+#                        deposition is proportional to LA, the O3 removal to LA and the stomatal conductance, and the OFP to
+#                        LA, the conversion factor and a sum of positive EF * MIR terms, which adds at most 2 u. The bound
+#                        of a grid cell (a sum of trees with the same sign) is the largest bound of its trees. For the net
+#                        O3 uptake, which is a difference, the bound is relative to the O3 removal plus the OFP.
+# Input: dictionary of NumPy arrays of filtered trees (with their scientific parameters)
+# Output: largest relative error of the OFP, PM10 and O3 of a tree
+# ---------------------------------------------------------------------------------------------------------------------
+
+def precision_error_bound(columns):
+    if len(columns['crown_height']) == 0:
+        return 0.0
+    H = np.abs(np.asarray(columns['crown_height'], dtype=np.float64))
+    D = np.abs(np.asarray(columns['crown_diameter'], dtype=np.float64))
+    S = np.abs(np.asarray(columns['shading_factor'], dtype=np.float64))
+    C = np.pi * D * (H + D) / 2
+    leaf_area_error = SINGLE_ROUNDOFF * (0.29 * H + 0.73 * D + 5.72 * S + 0.02 * C)
+    return float(np.max(leaf_area_error)) + 2 * SINGLE_ROUNDOFF
+
+# ---------------------------------------------------------------------------------------------------------------------
+# bytes_per_tree: This function returns the memory used by the columns for one tree (the shared columns are left out).
+# Input: dictionary of NumPy arrays
+# Output: amount of bytes
+# ---------------------------------------------------------------------------------------------------------------------
+
+def bytes_per_tree(columns):
+    return sum(column.itemsize * int(np.prod(column.shape[1:])) for name, column in columns.items() if name not in shared_columns)
+
+# ---------------------------------------------------------------------------------------------------------------------
+# select_tree_columns: This function selects some of the trees in every column (the shared MIR values and species table
+#                      are kept as they are). Slices give views on the columns, masks and index arrays give new contiguous
+#                      columns.
+# Input: dictionary of NumPy arrays, slice, boolean mask or index array
+# Output: dictionary of NumPy arrays
+# ---------------------------------------------------------------------------------------------------------------------
+
+def select_tree_columns(columns, selection):
+    return {name: column if name in shared_columns else column[selection] for name, column in columns.items()}
+
+# ---------------------------------------------------------------------------------------------------------------------
+# tree_columns_to_array: This function copies the columns into a NumPy array of type tree_dtype, one field at a time.
+#                        The species table is not part of the array.
+# Input: dictionary of NumPy arrays
+# Output: tree array
+# ---------------------------------------------------------------------------------------------------------------------
+
+def tree_columns_to_array(columns):
+    trees = np.zeros(len(columns['crown_height']), dtype=tree_dtype)
+    for name in columns:
+        if name in tree_dtype.names:
+            trees[name] = columns[name]
+    return trees
+
+# ---------------------------------------------------------------------------------------------------------------------
+# tree_array_to_columns: This function copies the input fields of a NumPy array of type tree_dtype into new columns.
+# Input: tree array, optional species table of the codes of the trees, whether the columns for the per-tree results are needed
+# Output: dictionary of NumPy arrays
+# ---------------------------------------------------------------------------------------------------------------------
+
+def tree_array_to_columns(trees, species=None, outputs=True):
+    columns = get_tree_columns(len(trees), outputs)
+    for name, dtype, shape in input_columns:
+        columns[name][...] = trees[name]
+    if len(trees) > 0:
+        columns['max_incremental_reactivity'][...] = trees['max_incremental_reactivity'][0]
+    if species is not None:
+        columns.update(species)
+    return columns
@@ -0,0 +1,112 @@
+import numpy as np
+import hashlib
+import json
+import os
+import shutil
+
+# ------------------------------------------------------------------------------------------------------------------------
+# This file contains the cache of the filtered trees. After a first run, the columns of the filtered trees (with their
+# scientific parameters) are saved as binary .npy files in the directory "Cache/". The name of the cache depends on the
+# content of all the input CSV files and on the settings used to read them, so a new cache is created as soon as one of
+# them changes. The next runs open the columns as memory-mapped files and skip reading and filtering the CSV files.
+# The hash of the content of every input file is kept in "Cache/fingerprints.json" with the size and modification time
+# of the file, so that a file is only read again to compute its hash when one of them changed.
+# ------------------------------------------------------------------------------------------------------------------------
+
+CACHE_VERSION = 5          # needs to be increased whenever the way the trees are read or filtered changes
+
+# -------------------------------------------------------------------------------------------------------------
+# file_hash: This function computes the hash of the content of a file, or takes it from the fingerprints if the
+#            path, size and modification time of the file did not change since it was computed.
+# Input: filepath, dictionary of the fingerprints (updated with the new hash)
+# Output: hexadecimal string
+# -------------------------------------------------------------------------------------------------------------
+
+def file_hash(file_name, fingerprints):
+    status = os.stat(file_name)
+    path = os.path.abspath(file_name)
+    fingerprint = fingerprints.get(path)
+    if fingerprint is not None and fingerprint['size'] == status.st_size and fingerprint['mtime_ns'] == status.st_mtime_ns:
+        return fingerprint['hash']
+
+    content = hashlib.blake2b(digest_size=16)
+    with open(file_name, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            content.update(block)
+    fingerprints[path] = {'size': status.st_size, 'mtime_ns': status.st_mtime_ns, 'hash': content.hexdigest()}
+    return fingerprints[path]['hash']
+
+# -------------------------------------------------------------------------------------------------------------
+# cache_key: This function computes the name of the cache from the content of the input files and the settings.
+#            With a cache directory, the hashes of the files are taken from its fingerprints when possible (see
+#            file_hash), and the new ones are saved into it.
+# Input: list of filepaths, settings used to read the files (e.g. the amount of trees, the backend), optional cache
+#        directory
+# Output: hexadecimal string
+# -------------------------------------------------------------------------------------------------------------
+
+def cache_key(file_names, *settings, directory=None):
+    fingerprints = {}
+    fingerprints_file = os.path.join(directory, "fingerprints.json") if directory is not None else None
+    if fingerprints_file is not None and os.path.isfile(fingerprints_file):
+        try:
+            with open(fingerprints_file, "r") as file:
+                fingerprints = json.load(file)
+        except (OSError, ValueError):                   # unreadable fingerprints: every file is hashed again
+            fingerprints = {}
+    known = dict(fingerprints)
+
+    key = hashlib.blake2b(digest_size=16)
+    key.update(f"version {CACHE_VERSION}".encode())
+    for file_name in file_names:
+        key.update(file_hash(file_name, fingerprints).encode())
+        key.update(b"\0")
+    key.update(repr(settings).encode())
+
+    if fingerprints_file is not None and fingerprints != known:
+        os.makedirs(directory, exist_ok=True)
+        temporary_file = f"{fingerprints_file}.tmp{os.getpid()}"
+        with open(temporary_file, "w") as file:
+            json.dump(fingerprints, file)
+        os.replace(temporary_file, fingerprints_file)
+    return key.hexdigest()
+
+# -------------------------------------------------------------------------------------------------------------------------
+# save_cache: This function saves the columns of the filtered trees and the genus report. The files are first written to a
+#             temporary directory that is renamed at the end, so that an interrupted run never leaves an incomplete cache.
+# Input: cache directory, name of the cache, dictionary of columns, dictionary of the trees kept and dropped for each genus
+# Output: None
+# -------------------------------------------------------------------------------------------------------------------------
+
+def save_cache(directory, key, columns, report):
+    final_directory = os.path.join(directory, key)
+    if os.path.isdir(final_directory):
+        return
+    temporary_directory = f"{final_directory}.tmp{os.getpid()}"
+    os.makedirs(temporary_directory, exist_ok=True)
+    for name, column in columns.items():
+        np.save(os.path.join(temporary_directory, f"{name}.npy"), np.ascontiguousarray(column))
+    with open(os.path.join(temporary_directory, "report.json"), "w") as file:
+        json.dump(report, file)
+    try:
+        os.replace(temporary_directory, final_directory)
+    except OSError:                                     # another run saved the same cache in the meantime
+        shutil.rmtree(temporary_directory, ignore_errors=True)
+
+# -------------------------------------------------------------------------------------------------------------------
+# load_cache: This function opens the columns of a cache as read-only memory-mapped arrays.
+# Input: cache directory, name of the cache
+# Output: dictionary of columns and dictionary of the trees kept and dropped for each genus, None if there is no cache
+# -------------------------------------------------------------------------------------------------------------------
+
+def load_cache(directory, key):
+    final_directory = os.path.join(directory, key)
+    if not os.path.isdir(final_directory):
+        return None
+    columns = {}
+    for file_name in os.listdir(final_directory):
+        if file_name.endswith(".npy"):
+            columns[file_name[:-4]] = np.load(os.path.join(final_directory, file_name), mmap_mode='r')
+    with open(os.path.join(final_directory, "report.json"), "r") as file:
+        report = {genus: tuple(counts) for genus, counts in json.load(file).items()}
+    return columns, report
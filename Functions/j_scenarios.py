@@ -0,0 +1,69 @@
+import numpy as np
+from Functions.f_numpy_model import *
+
+# ------------------------------------------------------------------------------------------------------------------------
+# This file contains the functions to evaluate many concentration scenarios (C_PM10, C_O3) at once. The PM10 deposition
+# is proportional to C_PM10 and the O3 removal is proportional to C_O3, while the OFP does not depend on them. The model
+# is therefore applied only once, with unit concentrations, and every scenario is obtained by scaling the unit grids:
+#   grid_PM10 = C_PM10 * unit grid_PM10,   grid_O3 = C_O3 * unit grid_O3,   grid_O3_net_uptake = grid_O3 - grid_OFP
+# (in kg/y, the net uptake is the difference between the removed O3 and the OFP).
+# ------------------------------------------------------------------------------------------------------------------------
+
+# ------------------------------------------------------------------------------------------------------------------------
+# unit_grids: This function applies the model to the filtered trees with concentrations of 1 ug/m3 for PM10 and O3.
+#             It does all the work that does not depend on the concentrations (leaf area, dry weight, OFP, grid cells).
+# Inputs: filtered trees (array of type tree_dtype or dictionary of columns), gridsize
+# Outputs: grid_OFP (kg/y), grid_PM10 and grid_O3 per unit of concentration (kg/y per ug/m3)
+# ------------------------------------------------------------------------------------------------------------------------
+
+def unit_grids(filtered_trees, gridsize):
+    if isinstance(filtered_trees, dict):
+        filtered_trees = dict(filtered_trees)        # the intermediate results are not added to the columns of the caller
+    else:
+        filtered_trees = filtered_trees.copy()
+    grid_OFP, grid_PM10, grid_O3, grid_O3_net_uptake = main_function2_numpy(filtered_trees, 1.0, 1.0, gridsize)
+    return grid_OFP, grid_PM10, grid_O3
+
+# ------------------------------------------------------------------------------------------------------------------------------
+# scenario_grids: This function computes the four grids for every scenario at once.
+# Inputs: unit grids (see unit_grids), list of scenarios (C_PM10, C_O3)
+# Outputs: grid_OFP, grid_PM10, grid_O3, grid_O3_net_uptake as 3D NumPy arrays with one layer per scenario (kg/y).
+#          grid_OFP is the same for every scenario and is returned as a read-only view.
+# ------------------------------------------------------------------------------------------------------------------------------
+
+def scenario_grids(grids, scenarios):
+    grid_OFP, grid_PM10, grid_O3 = grids
+    concentrations = np.asarray(scenarios, dtype=np.float64).reshape(-1, 2)
+    size = len(concentrations)
+
+    grids_PM10 = concentrations[:, 0, None, None] * grid_PM10
+    grids_O3 = concentrations[:, 1, None, None] * grid_O3
+    grids_O3_net_uptake = grids_O3 - grid_OFP
+    grids_OFP = np.broadcast_to(grid_OFP, (size,) + grid_OFP.shape)
+    return grids_OFP, grids_PM10, grids_O3, grids_O3_net_uptake
+
+# ------------------------------------------------------------------------------------------------------------------------------
+# scenario_totals: This function computes the totals over the grid for every scenario, directly from the unit grids.
+# Inputs: unit grids (see unit_grids), list of scenarios (C_PM10, C_O3)
+# Outputs: 2D NumPy array with one row per scenario: C_PM10, C_O3, total OFP, PM10, O3 and net O3 uptake (kg/y)
+# ------------------------------------------------------------------------------------------------------------------------------
+
+def scenario_totals(grids, scenarios):
+    grid_OFP, grid_PM10, grid_O3 = grids
+    concentrations = np.asarray(scenarios, dtype=np.float64).reshape(-1, 2)
+    OFP_tot = np.full(len(concentrations), np.sum(grid_OFP))
+    PM10_tot = concentrations[:, 0] * np.sum(grid_PM10)
+    O3_tot = concentrations[:, 1] * np.sum(grid_O3)
+    return np.column_stack([concentrations, OFP_tot, PM10_tot, O3_tot, O3_tot - OFP_tot])
+
+# ------------------------------------------------------------------------------------------------------
+# write_scenarios: This function writes the totals of every scenario into a semicolon-delimited file.
+# Input: totals (see scenario_totals), filepath
+# Output: None
+# ------------------------------------------------------------------------------------------------------
+
+def write_scenarios(totals, file_name):
+    with open(file_name, "w") as file:
+        file.write("C_PM10;C_O3;Total OFP (kg/y);Total PM10 absorbed (kg/y);Total ozone absorbed (kg/y);Total net ozone absorbed (kg/y)\n")
+        for row in totals:
+            file.write(";".join(str(value) for value in row) + "\n")
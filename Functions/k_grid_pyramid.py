@@ -0,0 +1,65 @@
+import numpy as np
+import math
+from Functions.n_sparse_grids import *
+
+# ------------------------------------------------------------------------------------------------------------------------
+# This file contains the functions to build coarser grids from the grids computed at the base gridsize. Every coarse cell
+# is the sum of a block of factor x factor base cells, where factor = coarse gridsize / base gridsize. Since the cells of
+# the base grid start at the same origin, each tree is in exactly one block, so the coarse grids are the same as the ones
+# computed directly with the coarse gridsize and the totals are the same at every level (up to the rounding of the sums
+# of the blocks, which write_pyramid reports).
+# ------------------------------------------------------------------------------------------------------------------------
+
+# ------------------------------------------------------------------------------------------------------------------------
+# block_sum: This function sums the cells of a grid by blocks of factor x factor cells. The grid is padded with empty
+#            cells at the top and on the right if its lengths are not multiples of factor.
+# Input: 2D NumPy array (or sparse grid, see n_sparse_grids.py), integer factor
+# Output: 2D NumPy array (or sparse grid) of lengths ceil(length_y / factor) and ceil(length_x / factor)
+# ------------------------------------------------------------------------------------------------------------------------
+
+def block_sum(grid, factor):
+    if is_sparse(grid):
+        return sparse_block_sum(grid, factor)
+    length_y, length_x = grid.shape
+    padded = np.pad(grid, ((0, -length_y % factor), (0, -length_x % factor)))
+    return padded.reshape(padded.shape[0] // factor, factor, padded.shape[1] // factor, factor).sum(axis=(1, 3))
+
+# --------------------------------------------------------------------------------------------------------------------------
+# grid_pyramid: This function builds the grids for several coarser gridsizes from the grids computed at the base gridsize.
+# Inputs: grid_OFP, grid_PM10, grid_O3, grid_O3_net_uptake at the base gridsize, base gridsize, list of coarser gridsizes
+#         (each one needs to be a positive multiple of the base gridsize)
+# Output: dictionary {gridsize: (grid_OFP, grid_PM10, grid_O3, grid_O3_net_uptake)}, including the base gridsize
+# --------------------------------------------------------------------------------------------------------------------------
+
+def grid_pyramid(grids, gridsize, gridsizes):
+    pyramid = {gridsize: tuple(grids)}
+    for size in sorted(set(gridsizes)):
+        if size <= 0 or size % gridsize != 0:
+            raise ValueError(f"The gridsize {size} is not a positive multiple of the base gridsize {gridsize}")
+        if size != gridsize:
+            pyramid[size] = tuple(block_sum(grid, size // gridsize) for grid in grids)
+    return pyramid
+
+# -----------------------------------------------------------------------------------------------------------------
+# write_pyramid: This function writes the lengths, totals and maximum values of every level of the pyramid into the
+#                summary file. The totals of every level are computed with math.fsum over its own cells. Every level
+#                is a partition of the cells of the base grids, so they only differ from the totals of the base grids
+#                by the rounding of the sums of the blocks; the largest relative difference is written at the end.
+# Input: open summary file, pyramid (see grid_pyramid), with dense or sparse grids
+# Output: None
+# -----------------------------------------------------------------------------------------------------------------
+
+def write_pyramid(summary, pyramid):
+    base_totals = None
+    difference = 0.0
+    for size, grids in sorted(pyramid.items()):
+        grid_OFP, grid_PM10, grid_O3, grid_O3_net_uptake = grids
+        totals = [math.fsum(grid['values'] if is_sparse(grid) else grid.ravel()) for grid in grids]
+        if base_totals is None:
+            base_totals = totals
+        difference = max([difference] + [abs(total - base) / abs(base) for total, base in zip(totals, base_totals) if base != 0.0])
+        length_y, length_x = grid_shape(grid_OFP)
+        summary.write(f"Grid cells of {size} m: {length_y} x {length_x} cells\n")
+        summary.write(f"    Totals (OFP, PM10, ozone, net ozone): {totals[0]} ; {totals[1]} ; {totals[2]} ; {totals[3]} kg/y\n")
+        summary.write(f"    Max for one gridcell (OFP, PM10, ozone, net ozone min): {grid_max(grid_OFP)} ; {grid_max(grid_PM10)} ; {grid_max(grid_O3)} ; {grid_min(grid_O3_net_uptake)} kg/y\n")
+    summary.write(f"Largest relative difference of the totals between the grid sizes: {difference}\n")
@@ -0,0 +1,174 @@
+import numpy as np
+import ctypes
+import hashlib
+import os
+import concurrent.futures
+from Functions.h_structures import *
+from Functions.e_filter_trees import *
+from Functions.f_numpy_model import *
+
+# ------------------------------------------------------------------------------------------------------------------------
+# This file contains the tiled mode of the program. Instead of starting at the most southwestern tree, the grid cells are
+# counted from the origin of the LV95 coordinates: the cell (i, j) covers [i * gridsize, (i + 1) * gridsize) in y and
+# [j * gridsize, (j + 1) * gridsize) in x. The grids of any subset of trees therefore line up with each other.
+# The canton is split into square tiles of tile_size x tile_size cells, also counted from the LV95 origin. The tiles are
+# computed independently by a pool of processes and their grids are copied into the grid of the canton. Since every cell
+# belongs to exactly one tile and the trees of a tile keep their order, the result is the same, bit for bit, as the one of
+# a single run over all the trees. The grids of the tiles can be saved in a directory (which can be shared between
+# machines), so that only the tiles whose trees or settings changed are computed again.
+# ------------------------------------------------------------------------------------------------------------------------
+
+clibrary = None           # shared library, loaded once in every process computing tiles
+
+# -----------------------------------------------------------------------------------------------------
+# declare_tile_functions: This function defines the C functions used in this file.
+# Input: shared library
+# Output: None
+# -----------------------------------------------------------------------------------------------------
+
+def declare_tile_functions(clibrary):
+    clibrary.main_function2_tile.argtypes = [ctypes.POINTER(TreeColumns)] + [ctypes.POINTER(ctypes.POINTER(ctypes.POINTER(ctypes.c_double)))] * 4 + [ctypes.c_int] * 4 + [ctypes.c_double, ctypes.c_double, ctypes.c_int]
+    clibrary.main_function2_tile.restype = ctypes.c_int
+    clibrary.set_threads.argtypes = [ctypes.c_int]
+    clibrary.set_threads.restype = ctypes.c_int
+    clibrary.free_grid.argtypes = [ctypes.POINTER(ctypes.POINTER(ctypes.c_double))]
+    clibrary.free_grid.restype = None
+
+# -----------------------------------------------------------------------------------------------------
+# anchored_cells: This function returns the index of the cell containing each coordinate, counted from
+#                 the LV95 origin (same as tile_index in C with first = 0).
+# Input: array of coordinates, gridsize
+# Output: array of integers
+# -----------------------------------------------------------------------------------------------------
+
+def anchored_cells(positions, gridsize):
+    return np.floor(positions / gridsize).astype(np.int64)
+
+# ---------------------------------------------------------------------------------------------------------------------------
+# split_tiles: This function splits the filtered trees into tiles. Only the tiles containing trees are returned, and each of
+#              them only covers the part of the tile within the extent of the canton grid.
+# Input: dictionary of columns of filtered trees, gridsize, number of cells per side of a tile
+# Outputs: extent of the canton grid (first row, first column, number of rows, number of columns),
+#          list of tiles, each one a dictionary with its position, its extent and the columns of its trees
+# ---------------------------------------------------------------------------------------------------------------------------
+
+def split_tiles(columns, gridsize, tile_size):
+    rows = anchored_cells(columns['position_y'], gridsize)
+    cols = anchored_cells(columns['position_x'], gridsize)
+    first_row, first_column = int(rows.min()), int(cols.min())
+    last_row, last_column = int(rows.max()) + 1, int(cols.max()) + 1
+    extent = (first_row, first_column, last_row - first_row, last_column - first_column)
+
+    # Group the trees by tile; the stable sort keeps the order of the trees within each tile
+    positions, tile_of_tree = np.unique(np.column_stack([rows // tile_size, cols // tile_size]), axis=0, return_inverse=True)
+    tile_of_tree = tile_of_tree.ravel()
+    order = np.argsort(tile_of_tree, kind='stable')
+    bounds = np.searchsorted(tile_of_tree[order], np.arange(len(positions) + 1))
+
+    tiles = []
+    for k, (tile_row, tile_column) in enumerate(positions):
+        tile_first_row = max(int(tile_row) * tile_size, first_row)
+        tile_first_column = max(int(tile_column) * tile_size, first_column)
+        tiles.append({'tile': (int(tile_row), int(tile_column)),
+                      'first_row': tile_first_row,
+                      'first_column': tile_first_column,
+                      'length_y': min((int(tile_row) + 1) * tile_size, last_row) - tile_first_row,
+                      'length_x': min((int(tile_column) + 1) * tile_size, last_column) - tile_first_column,
+                      'columns': select_tree_columns(columns, order[bounds[k]:bounds[k + 1]])})
+    return extent, tiles
+
+# ---------------------------------------------------------------------------------------------------------------------
+# tile_key: This function computes the name under which the grids of a tile are saved, from the content of its trees,
+#           its extent and the settings of the calculations. The species table is left out, since the grids only depend
+#           on the parameters already given to the trees.
+# Input: tile (see split_tiles), settings (backend, concentrations, gridsize)
+# Output: hexadecimal string
+# ---------------------------------------------------------------------------------------------------------------------
+
+def tile_key(tile, *settings):
+    key = hashlib.blake2b(digest_size=16)
+    species_table = [name for name, dtype in species_columns]
+    for name in sorted(tile['columns']):
+        if name in species_table:
+            continue
+        key.update(name.encode())
+        key.update(np.ascontiguousarray(tile['columns'][name]).tobytes())
+    key.update(repr((tile['first_row'], tile['first_column'], tile['length_y'], tile['length_x'], settings)).encode())
+    return key.hexdigest()
+
+# ---------------------------------------------------------------------------------------------------------------------
+# compute_tile: This function computes the grids of one tile. It is called in the processes of the pool.
+# Input: backend ("C" or "numpy"), path of the shared library, number of threads used by C, tile (see split_tiles),
+#        concentration of PM10 and O3, gridsize
+# Output: grid_OFP, grid_PM10, grid_O3, grid_O3_net_uptake of the tile as 2D NumPy arrays (kg/y)
+# ---------------------------------------------------------------------------------------------------------------------
+
+def compute_tile(backend, library, threads, tile, C_PM10, C_O3, gridsize):
+    if backend != "C":
+        return main_function2_tile_numpy(dict(tile['columns']), tile['first_row'], tile['first_column'], tile['length_y'], tile['length_x'], C_PM10, C_O3, gridsize)
+
+    global clibrary
+    if clibrary is None:
+        clibrary = ctypes.CDLL(library)
+        declare_tile_functions(clibrary)
+    clibrary.set_threads(threads)
+
+    grids = [ctypes.POINTER(ctypes.POINTER(ctypes.c_double))() for k in range(4)]
+    if clibrary.main_function2_tile(ctypes.byref(c_tree_columns(tile['columns'])), *[ctypes.byref(grid) for grid in grids],
+                                    tile['first_row'], tile['first_column'], tile['length_y'], tile['length_x'], C_PM10, C_O3, gridsize) != 0:
+        raise MemoryError("The grids of the tile could not be allocated")
+    return tuple(c_pp_to_np(tile['length_y'], tile['length_x'], grid, clibrary.free_grid) for grid in grids)
+
+# ------------------------------------------------------------------------------------------------------------------------------
+# main_function_tiled: This function computes the grids of the canton tile by tile and copies the grids of the tiles into them.
+# Inputs: dictionary of columns of filtered trees, concentration of PM10 and O3, gridsize, number of cells per side of a tile,
+#         number of processes (1 computes the tiles in this process), backend ("C" or "numpy"), path of the shared library,
+#         optional directory where the grids of the tiles are saved and read again, number of threads used by C in each process
+# Outputs: grid_OFP, grid_PM10, grid_O3, grid_O3_net_uptake as 2D NumPy arrays (kg/y), LV95 coordinates (x, y) of the
+#          southwestern corner of the grid
+# ------------------------------------------------------------------------------------------------------------------------------
+
+def main_function_tiled(filtered_columns, C_PM10, C_O3, gridsize, tile_size, processes=1, backend="C", library=None, directory=None, threads=1):
+    (first_row, first_column, length_y, length_x), tiles = split_tiles(filtered_columns, gridsize, tile_size)
+    print(f"These are the lengths of our grid: {length_y}, {length_x} ({len(tiles)} tiles)")
+
+    # Read the tiles that were already computed with the same trees and settings
+    results = {}
+    keys = {}
+    if directory is not None:
+        os.makedirs(directory, exist_ok=True)
+        for k, tile in enumerate(tiles):
+            keys[k] = tile_key(tile, backend, C_PM10, C_O3, gridsize)
+            file_name = os.path.join(directory, f"{keys[k]}.npy")
+            if os.path.isfile(file_name):
+                results[k] = tuple(np.load(file_name))
+    missing = [k for k in range(len(tiles)) if k not in results]
+    print(f"Computing {len(missing)} tiles, {len(results)} tiles read from the previous runs")
+
+    # Compute the other tiles
+    if processes == 1 or len(missing) <= 1:
+        for k in missing:
+            results[k] = compute_tile(backend, library, threads, tiles[k], C_PM10, C_O3, gridsize)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = {pool.submit(compute_tile, backend, library, threads, tiles[k], C_PM10, C_O3, gridsize): k for k in missing}
+            for future in concurrent.futures.as_completed(futures):
+                results[futures[future]] = future.result()
+
+    if directory is not None:
+        for k in missing:
+            file_name = os.path.join(directory, f"{keys[k]}.npy")
+            temporary_name = f"{file_name}.tmp{os.getpid()}.npy"
+            np.save(temporary_name, np.stack(results[k]))
+            os.replace(temporary_name, file_name)
+
+    # Copy the grids of the tiles into the grids of the canton; the tiles do not overlap
+    grids = [np.zeros((length_y, length_x)) for k in range(4)]
+    for k, tile in enumerate(tiles):
+        rows = slice(tile['first_row'] - first_row, tile['first_row'] - first_row + tile['length_y'])
+        cols = slice(tile['first_column'] - first_column, tile['first_column'] - first_column + tile['length_x'])
+        for grid, tile_grid in zip(grids, results[k]):
+            grid[rows, cols] = tile_grid
+    print("Calculations are done")
+
+    return (*grids, (first_column * gridsize, first_row * gridsize))
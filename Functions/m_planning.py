@@ -0,0 +1,269 @@
+import numpy as np
+from Functions.h_structures import *
+from Functions.e_filter_trees import *
+from Functions.f_numpy_model import *
+from Functions.l_tiles import anchored_cells
+
+# ------------------------------------------------------------------------------------------------------------------------
+# This file contains the planning session, which answers questions such as "what if we plant 500 Tilia here and remove 200
+# Platanus there" without running the whole program again. The session keeps the trees, the contribution of every tree to
+# its grid cell (in kg/y) and the grids. Planting, felling or changing trees only computes the model for these trees and
+# adds (or subtracts) their contributions to their cells. The grid cells are counted from the LV95 origin, like in the tiled
+# mode (see l_tiles.py), and the grids grow when trees are planted outside of them.
+# The grids are the same as the ones of a full run up to rounding; rebuild() sums all the contributions again.
+# ------------------------------------------------------------------------------------------------------------------------
+
+# Leaves days and stomatal conductance for each type of tree, as in readwriteDocument (other types get 0)
+TREE_TYPES = {"Feuillus": (LEAVE_DAYS_BROADLEAVES, STOMATAL_COND_BROADLEAVES),
+              "Conifères": (LEAVE_DAYS_EVERGREENS, STOMATAL_COND_EVERGREENS)}
+
+# Input columns kept for every tree of the session
+SESSION_COLUMNS = ['species_code', 'crown_height', 'crown_diameter', 'position_y', 'position_x', 'shading_factor',
+                   'conversion_factor', 'leaves_days', 'stomatal_conductance', 'mass_emission_factor']
+
+class PlanningSession:
+
+    # -------------------------------------------------------------------------------------------------------------------
+    # __init__: This function creates the session from the filtered trees and computes the grids.
+    # Inputs: dictionary of columns of filtered trees, four file paths, concentration of PM10 and O3, gridsize
+    # -------------------------------------------------------------------------------------------------------------------
+
+    def __init__(self, filtered_columns, conversion_factor, EF, shading_coeff, MIR, C_PM10, C_O3, gridsize):
+        self.dic_conversion_factor, self.dic_EF, self.dic_shading_coefficient, dic_MIR = read_parameters(conversion_factor, EF, shading_coeff, MIR)
+        self.MIR = np.array([dic_MIR['isoprene'], dic_MIR['monoterpenes'], dic_MIR['sesquiterpenes']])
+        self.C_PM10 = C_PM10
+        self.C_O3 = C_O3
+        self.gridsize = gridsize
+
+        self.size = len(filtered_columns['crown_height'])
+        self.trees = {name: np.array(filtered_columns[name], dtype=column_dtypes[name]) for name in SESSION_COLUMNS}
+        self.species = {name: np.array(filtered_columns[name]) for name, dtype in species_columns}       # grows with the new species planted
+        self.alive = np.ones(self.size, dtype=bool)
+        self.rows, self.cols, self.results = self.contributions(self.trees)
+
+        # Grids covering all the trees, one layer per output: OFP, PM10, O3 removed mass, O3 net uptake (kg/y). Without any
+        # tree, the grids are empty and grow with the first trees planted (see add_to_grids).
+        if self.size == 0:
+            self.first_row, self.first_column = 0, 0
+            self.grids = np.zeros((4, 0, 0))
+        else:
+            self.first_row, self.first_column = int(self.rows.min()), int(self.cols.min())
+            self.grids = np.zeros((4, int(self.rows.max()) + 1 - self.first_row, int(self.cols.max()) + 1 - self.first_column))
+        self.rebuild()
+
+    # -------------------------------------------------------------------------------------------------------------------
+    # contributions: This function applies the model to some trees.
+    # Input: dictionary of columns of trees (with their scientific parameters)
+    # Outputs: row and column of the cell of each tree (counted from the LV95 origin), 2D array with the OFP, PM10,
+    #          O3 removed mass and O3 net uptake of each tree (kg/y)
+    # -------------------------------------------------------------------------------------------------------------------
+
+    def contributions(self, trees):
+        trees = dict(trees)
+        trees['max_incremental_reactivity'] = self.MIR
+        model_functions(trees, self.C_PM10, self.C_O3)
+        rows = anchored_cells(trees['position_y'], self.gridsize)
+        cols = anchored_cells(trees['position_x'], self.gridsize)
+        results = np.column_stack([trees['OFP_yearly'] * 10.0**-9, trees['PM10_yearly'], trees['O3_removed_mass_yearly'] * 10.0**-3, trees['O3_net_uptake_yearly'] * 10.0**-3])
+        return rows, cols, results
+
+    # -------------------------------------------------------------------------------------------------------------------
+    # new_trees: This function creates the columns of new trees and adds the scientific parameters of their genus.
+    # Inputs: species names, coordinates, crown heights and diameters, types of tree ("Feuillus" or "Conifères");
+    #         each input is either one value for all the trees or one value per tree
+    # Output: dictionary of columns
+    # -------------------------------------------------------------------------------------------------------------------
+
+    def new_trees(self, species_name, position_x, position_y, crown_height, crown_diameter, tree_type="Feuillus"):
+        species_name, position_x, position_y, crown_height, crown_diameter, tree_type = np.broadcast_arrays(
+            np.asarray(species_name, dtype=object), position_x, position_y, crown_height, crown_diameter, np.asarray(tree_type, dtype=object))
+        species_code, self.species = encode_species(species_name.ravel(), self.species)
+        trees = {'species_code': species_code,
+                 'position_x': np.array(position_x, dtype=np.float64).ravel(),
+                 'position_y': np.array(position_y, dtype=np.float64).ravel(),
+                 'crown_height': np.array(crown_height, dtype=np.float64).ravel(),
+                 'crown_diameter': np.array(crown_diameter, dtype=np.float64).ravel()}
+        self.set_tree_type(trees, tree_type.ravel())
+        self.set_parameters(trees)
+        return trees
+
+    # -------------------------------------------------------------------------------------------------------------------
+    # set_tree_type: This function sets the leaves days and the stomatal conductance of trees from their type.
+    # Input: dictionary of columns, array of types of tree
+    # Output: None
+    # -------------------------------------------------------------------------------------------------------------------
+
+    def set_tree_type(self, trees, tree_type):
+        values = [TREE_TYPES.get(str(name), (0, 0.0)) for name in tree_type]
+        trees['leaves_days'] = np.array([value[0] for value in values], dtype=column_dtypes['leaves_days'])
+        trees['stomatal_conductance'] = np.array([value[1] for value in values], dtype=column_dtypes['stomatal_conductance'])
+
+    # -------------------------------------------------------------------------------------------------------------------
+    # set_parameters: This function adds the scientific parameters of the genus of each tree (see genus_filter).
+    # Input: dictionary of columns
+    # Output: None; a ValueError is raised if a genus is missing from one of the parameter files
+    # -------------------------------------------------------------------------------------------------------------------
+
+    def set_parameters(self, trees):
+        genera = genus_names(self.species)
+        known, parameters = genus_parameters(genera, self.dic_conversion_factor, self.dic_EF, self.dic_shading_coefficient)
+        genus_codes = self.species['species_genus'][trees['species_code']]
+        unknown = sorted({genera[code] for code in genus_codes[~known[genus_codes]]})
+        if unknown:
+            raise ValueError(f"No scientific parameters for the genera: {', '.join(unknown)}")
+        trees['conversion_factor'] = parameters['conversion_factor'][genus_codes]
+        trees['mass_emission_factor'] = parameters['mass_emission_factor'][genus_codes]
+        trees['shading_factor'] = parameters['shading_factor'][genus_codes]
+
+    # -------------------------------------------------------------------------------------------------------------------
+    # add_to_grids: This function adds contributions to the grids, and makes the grids larger if some cells are outside.
+    #               Empty grids start at the cells of the contributions.
+    # Inputs: rows and columns of the cells, 2D array of contributions (one row per tree)
+    # Output: None
+    # -------------------------------------------------------------------------------------------------------------------
+
+    def add_to_grids(self, rows, cols, results):
+        if len(rows) == 0:
+            return
+        if self.grids.size == 0:
+            self.first_row, self.first_column = int(rows.min()), int(cols.min())
+        first_row = min(self.first_row, int(rows.min()))
+        first_column = min(self.first_column, int(cols.min()))
+        last_row = max(self.first_row + self.grids.shape[1], int(rows.max()) + 1)
+        last_column = max(self.first_column + self.grids.shape[2], int(cols.max()) + 1)
+        if (first_row, first_column, last_row - first_row, last_column - first_column) != (self.first_row, self.first_column) + self.grids.shape[1:]:
+            grids = np.zeros((4, last_row - first_row, last_column - first_column))
+            grids[:, self.first_row - first_row:self.first_row - first_row + self.grids.shape[1], self.first_column - first_column:self.first_column - first_column + self.grids.shape[2]] = self.grids
+            self.grids, self.first_row, self.first_column = grids, first_row, first_column
+        for k in range(4):
+            np.add.at(self.grids[k], (rows - self.first_row, cols - self.first_column), results[:, k])
+
+    # -------------------------------------------------------------------------------------------------------------------
+    # check_ids: This function checks that the given trees exist and were not felled.
+    # Input: identifiers of trees
+    # Output: array of identifiers without duplicates
+    # -------------------------------------------------------------------------------------------------------------------
+
+    def check_ids(self, ids):
+        ids = np.unique(np.asarray(ids, dtype=np.int64))
+        if len(ids) > 0 and (ids[0] < 0 or ids[-1] >= self.size or not self.alive[ids].all()):
+            raise ValueError("Some trees do not exist or were already felled")
+        return ids
+
+    # -------------------------------------------------------------------------------------------------------------------
+    # reserve: This function makes the arrays of trees larger if count more trees do not fit in them. Their capacity is
+    #          doubled, so that planting trees one by one does not copy all the trees every time.
+    # Input: amount of new trees
+    # Output: None
+    # -------------------------------------------------------------------------------------------------------------------
+
+    def reserve(self, count):
+        capacity = len(self.alive)
+        if self.size + count <= capacity:
+            return
+        capacity = max(2 * capacity, self.size + count)
+
+        def grow(array):
+            larger = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+            larger[:self.size] = array[:self.size]
+            return larger
+
+        self.trees = {name: grow(column) for name, column in self.trees.items()}
+        self.alive, self.rows, self.cols, self.results = grow(self.alive), grow(self.rows), grow(self.cols), grow(self.results)
+
+    # -------------------------------------------------------------------------------------------------------------------
+    # plant: This function plants new trees and adds their contributions to the grids (same inputs as new_trees).
+    # Output: identifiers of the new trees
+    # -------------------------------------------------------------------------------------------------------------------
+
+    def plant(self, species_name, position_x, position_y, crown_height, crown_diameter, tree_type="Feuillus"):
+        trees = self.new_trees(species_name, position_x, position_y, crown_height, crown_diameter, tree_type)
+        rows, cols, results = self.contributions(trees)
+        self.add_to_grids(rows, cols, results)
+
+        ids = np.arange(self.size, self.size + len(rows))
+        self.reserve(len(rows))
+        for name in SESSION_COLUMNS:
+            self.trees[name][ids] = trees[name]
+        self.alive[ids] = True
+        self.rows[ids], self.cols[ids], self.results[ids] = rows, cols, results
+        self.size += len(rows)
+        return ids
+
+    # -------------------------------------------------------------------------------------------------------------------
+    # fell: This function removes trees and subtracts their contributions from the grids.
+    # Input: identifiers of trees (their index in the filtered trees, or the identifiers returned by plant)
+    # Output: None
+    # -------------------------------------------------------------------------------------------------------------------
+
+    def fell(self, ids):
+        ids = self.check_ids(ids)
+        self.add_to_grids(self.rows[ids], self.cols[ids], -self.results[ids])
+        self.alive[ids] = False
+
+    # -------------------------------------------------------------------------------------------------------------------
+    # update: This function changes attributes of trees: their contributions are subtracted, computed again with the new
+    #         attributes and added to their (possibly new) cells.
+    # Inputs: identifiers of trees, new values: species_name, position_x, position_y, crown_height, crown_diameter and/or
+    #         tree_type, each one a single value or one value per tree
+    # Output: None
+    # -------------------------------------------------------------------------------------------------------------------
+
+    def update(self, ids, **attributes):
+        ids = self.check_ids(ids)
+        allowed = {'species_name', 'position_x', 'position_y', 'crown_height', 'crown_diameter', 'tree_type'}
+        if not set(attributes) <= allowed:
+            raise ValueError(f"Unknown attributes: {', '.join(sorted(set(attributes) - allowed))}")
+
+        trees = {name: self.trees[name][ids].copy() for name in SESSION_COLUMNS}
+        for name, values in attributes.items():
+            if name == 'tree_type':
+                self.set_tree_type(trees, np.broadcast_to(np.asarray(values, dtype=object), ids.shape))
+            elif name == 'species_name':
+                trees['species_code'], self.species = encode_species(np.broadcast_to(np.asarray(values, dtype=object), ids.shape), self.species)
+            else:
+                trees[name][:] = values
+        if 'species_name' in attributes:
+            self.set_parameters(trees)
+        rows, cols, results = self.contributions(trees)
+
+        self.add_to_grids(np.concatenate([self.rows[ids], rows]), np.concatenate([self.cols[ids], cols]), np.concatenate([-self.results[ids], results]))
+        for name in SESSION_COLUMNS:
+            self.trees[name][ids] = trees[name]
+        self.rows[ids], self.cols[ids], self.results[ids] = rows, cols, results
+
+    # -------------------------------------------------------------------------------------------------------------------
+    # score_planting, score_felling: These functions return the change of the totals (OFP, PM10, O3 removed mass,
+    #                                O3 net uptake in kg/y) that planting or felling trees would cause, without changing
+    #                                the session. They are meant to compare many candidate edits quickly.
+    # -------------------------------------------------------------------------------------------------------------------
+
+    def score_planting(self, species_name, position_x, position_y, crown_height, crown_diameter, tree_type="Feuillus"):
+        trees = self.new_trees(species_name, position_x, position_y, crown_height, crown_diameter, tree_type)
+        return self.contributions(trees)[2].sum(axis=0)
+
+    def score_felling(self, ids):
+        return -self.results[self.check_ids(ids)].sum(axis=0)
+
+    # -------------------------------------------------------------------------------------------------------------------
+    # rebuild: This function sums the contributions of all the remaining trees again, to remove the rounding errors that
+    #          add up after many edits.
+    # Output: None
+    # -------------------------------------------------------------------------------------------------------------------
+
+    def rebuild(self):
+        alive = np.flatnonzero(self.alive[:self.size])
+        cells = (self.rows[alive] - self.first_row) * self.grids.shape[2] + (self.cols[alive] - self.first_column)
+        for k in range(4):
+            self.grids[k] = np.bincount(cells, weights=self.results[alive, k], minlength=self.grids[k].size).reshape(self.grids.shape[1:])
+
+    # -------------------------------------------------------------------------------------------------------------------
+    # get_grids, totals: These functions return copies of the four grids (kg/y) with the LV95 coordinates (x, y) of
+    #                    their southwestern corner, and the totals over the grids (kg/y).
+    # -------------------------------------------------------------------------------------------------------------------
+
+    def get_grids(self):
+        return (*self.grids.copy(), (self.first_column * self.gridsize, self.first_row * self.gridsize))
+
+    def totals(self):
+        return self.grids.sum(axis=(1, 2))
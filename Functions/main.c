@@ -16,15 +16,12 @@
 // - binary string for the filename
 // - preallocated list of structures
 // - length of CSV document
+// - table of the species, filled with the species of the trees (see new_species_table)
 // ---------------------------------------------------------------------------------------------------------------
 
-void main_function1(char *filename, struct Tree *trees, int size_org) {
-    // Memory allocations
-    for (int i = 0; i < size_org; i++) {
-        memory_allocation((trees+i));
-    }
+void main_function1(char *filename, struct Tree *trees, int size_org, struct SpeciesTable *species) {
     // Create a list of structures
-    readwriteDocument(filename, trees, size_org);
+    readwriteDocument(filename, trees, size_org, species);
 }
 
 // ---------------------------------------------------------------------------------------
@@ -48,12 +45,14 @@ void main_function2(struct Tree *filtered_trees, int size_filtered_trees, double
     // ----- Calculations -----
     
     // Adjust and add coordinates
+    struct ProfileClock start = profile_start();
     extract_coordinates(filtered_trees, x, y, size_filtered_trees);
     coordinates_adaption(filtered_trees, x, y, size_filtered_trees);
     
     // Calculate lengths
     *length_y = distance(y, size_filtered_trees, gridsize);
     *length_x = distance(x, size_filtered_trees, gridsize);
+    profile_stop(PROFILE_COORDINATES, start, size_filtered_trees);
     printf("These are the lengths of our grid: %d, %d\n", *length_y, *length_x);
     
     // Adjust grid memory to the length we actually need
@@ -72,3 +71,164 @@ void main_function2(struct Tree *filtered_trees, int size_filtered_trees, double
     free(x);
     free(y);
 }
+
+// ---------------------------------------------------------------------------------------------------------------------
+// main_function1_columns: This function reads the file with the trees in Geneva into columns allocated by NumPy.
+// Inputs:
+// - binary string for the filename
+// - TreeColumns structure pointing to the columns; its size is the amount of trees read from the CSV document
+// - table of the species, filled with the species of the trees (see new_species_table)
+// ---------------------------------------------------------------------------------------------------------------------
+
+void main_function1_columns(char *filename, struct TreeColumns *columns, struct SpeciesTable *species) {
+    readwriteDocument_columns(filename, columns, species);
+}
+
+// ---------------------------------------------------------------------------------------
+// main_function2_columns: This function calculates the values across the grid for trees
+//                         stored in columns. It works like main_function2.
+// Inputs:
+// - TreeColumns structure pointing to the columns of filtered trees
+// - 4x predefined Pointer(Pointer(Pointer(double))) for the grids
+// - pointer to possible distances in y and x that will be calculated within the function
+// - concentration of PM10 in the city
+// - concentration of O3 in the city
+// - gridsize
+// ---------------------------------------------------------------------------------------
+
+void main_function2_columns(struct TreeColumns *columns, double ***grid_OFP, double ***grid_PM10, double ***grid_O3, double ***grid_O3_net_uptake, int *length_y, int *length_x, double C_PM10, double C_O3, int gridsize) {
+    // The origin of the grid is the most southwestern point
+    struct ProfileClock start = profile_start();
+    double min_x = min(columns->position_x, columns->size);
+    double min_y = min(columns->position_y, columns->size);
+
+    // Calculate lengths
+    *length_y = distance(columns->position_y, columns->size, gridsize);
+    *length_x = distance(columns->position_x, columns->size, gridsize);
+    profile_stop(PROFILE_COORDINATES, start, columns->size);
+    printf("These are the lengths of our grid: %d, %d\n", *length_y, *length_x);
+
+    // Adjust grid memory to the length we actually need
+    *grid_OFP = get_gridarray(*length_y, *length_x);
+    *grid_PM10 = get_gridarray(*length_y, *length_x);
+    *grid_O3 = get_gridarray(*length_y, *length_x);
+    *grid_O3_net_uptake = get_gridarray(*length_y, *length_x);
+    printf("Grids got created\n");
+
+    // Do calculations within the grid
+    add_columns_to_grids(columns, min_x, min_y, *length_y, *length_x, *grid_OFP, *grid_PM10, *grid_O3, *grid_O3_net_uptake, C_PM10, C_O3, gridsize);
+    convert_grids(*length_y, *length_x, *grid_OFP, *grid_PM10, *grid_O3, *grid_O3_net_uptake);
+    printf("Calculations are done\n");
+}
+
+// ---------------------------------------------------------------------------------------
+// main_function2_tile: This function calculates the values across a grid whose cells are
+//                      counted from the LV95 origin (0, 0), so that the grids of different
+//                      tiles line up. It covers the cells first_row, ..., first_row +
+//                      length_y - 1 and first_column, ..., first_column + length_x - 1.
+// Inputs:
+// - TreeColumns structure pointing to the columns of the filtered trees of the tile
+// - 4x predefined Pointer(Pointer(Pointer(double))) for the grids
+// - index of the first row and column of the tile, number of rows and columns
+// - concentration of PM10 in the city
+// - concentration of O3 in the city
+// - gridsize
+// Output: 0, -1 if the memory allocation of the grids failed (the grids are then freed and
+//         set to NULL)
+// ---------------------------------------------------------------------------------------
+
+int main_function2_tile(struct TreeColumns *columns, double ***grid_OFP, double ***grid_PM10, double ***grid_O3, double ***grid_O3_net_uptake, int first_row, int first_column, int length_y, int length_x, double C_PM10, double C_O3, int gridsize) {
+    *grid_OFP = get_gridarray(length_y, length_x);
+    *grid_PM10 = get_gridarray(length_y, length_x);
+    *grid_O3 = get_gridarray(length_y, length_x);
+    *grid_O3_net_uptake = get_gridarray(length_y, length_x);
+    if(*grid_OFP == NULL || *grid_PM10 == NULL || *grid_O3 == NULL || *grid_O3_net_uptake == NULL) {
+        free_grid(*grid_OFP);
+        free_grid(*grid_PM10);
+        free_grid(*grid_O3);
+        free_grid(*grid_O3_net_uptake);
+        *grid_OFP = *grid_PM10 = *grid_O3 = *grid_O3_net_uptake = NULL;
+        return -1;
+    }
+
+    add_columns_to_cells(columns, 0.0, 0.0, first_row, first_column, length_y, length_x, *grid_OFP, *grid_PM10, *grid_O3, *grid_O3_net_uptake, C_PM10, C_O3, gridsize);
+    convert_grids(length_y, length_x, *grid_OFP, *grid_PM10, *grid_O3, *grid_O3_net_uptake);
+    return 0;
+}
+
+// ---------------------------------------------------------------------------------------
+// main_function2_sparse: This function calculates the values across the grid like
+//                        main_function2_columns, but returns only the occupied cells.
+// Inputs:
+// - TreeColumns structure pointing to the columns of filtered trees
+// - arrays of at least columns->size elements for the index of the cells and for the
+//   values of the OFP, PM10, O3 removed mass and O3 net uptake in these cells
+// - pointer to possible distances in y and x that will be calculated within the function
+// - concentration of PM10 in the city
+// - concentration of O3 in the city
+// - gridsize
+// Output: number of occupied cells, -1 if the memory allocation failed
+// ---------------------------------------------------------------------------------------
+
+int main_function2_sparse(struct TreeColumns *columns, long long *cells, double *sparse_OFP, double *sparse_PM10, double *sparse_O3, double *sparse_O3_net_uptake, int *length_y, int *length_x, double C_PM10, double C_O3, int gridsize) {
+    // The origin of the grid is the most southwestern point
+    struct ProfileClock start = profile_start();
+    double min_x = min(columns->position_x, columns->size);
+    double min_y = min(columns->position_y, columns->size);
+
+    // Calculate lengths
+    *length_y = distance(columns->position_y, columns->size, gridsize);
+    *length_x = distance(columns->position_x, columns->size, gridsize);
+    profile_stop(PROFILE_COORDINATES, start, columns->size);
+    printf("These are the lengths of our grid: %d, %d\n", *length_y, *length_x);
+
+    int count = columns_to_sparse_cells(columns, min_x, min_y, *length_y, *length_x, cells, sparse_OFP, sparse_PM10, sparse_O3, sparse_O3_net_uptake, C_PM10, C_O3, gridsize);
+    printf("Calculations are done\n");
+    return count;
+}
+
+// ---------------------------------------------------------------------------------------
+// main_function_fused: This function reads the CSV file again after scan_inventory and
+//                      adds every tree with known parameters directly to the grids, chunk
+//                      by chunk (see add_file_to_grids). No tree is kept in memory.
+// Inputs:
+// - binary string for the filename
+// - amount of trees per chunk
+// - table of the species filled by scan_inventory, parameters of its genus codes
+// - average crown height and diameter of the file (see scan_inventory)
+// - coordinates of the most southwestern tree with known parameters
+// - 4x predefined Pointer(Pointer(Pointer(double))) for the grids
+// - distances in y and x
+// - concentration of PM10 in the city
+// - concentration of O3 in the city
+// - gridsize
+// Output: number of trees added to the grids, -1 if an error occurred (the grids are
+//         then freed and set to NULL)
+// ---------------------------------------------------------------------------------------
+
+long long main_function_fused(char *filename, int chunk_size, struct SpeciesTable *species, struct GenusParameters *parameters, double average_height, double average_crown_diameter, double min_x, double min_y, double ***grid_OFP, double ***grid_PM10, double ***grid_O3, double ***grid_O3_net_uptake, int length_y, int length_x, double C_PM10, double C_O3, int gridsize) {
+    *grid_OFP = get_gridarray(length_y, length_x);
+    *grid_PM10 = get_gridarray(length_y, length_x);
+    *grid_O3 = get_gridarray(length_y, length_x);
+    *grid_O3_net_uptake = get_gridarray(length_y, length_x);
+    printf("Grids got created\n");
+
+    long long added = -1;
+    if(*grid_OFP != NULL && *grid_PM10 != NULL && *grid_O3 != NULL && *grid_O3_net_uptake != NULL) {
+        added = add_file_to_grids(filename, chunk_size, species, parameters, average_height, average_crown_diameter, min_x, min_y, length_y, length_x, *grid_OFP, *grid_PM10, *grid_O3, *grid_O3_net_uptake, C_PM10, C_O3, gridsize);
+    }
+    if(added < 0) {
+        free_grid(*grid_OFP);
+        free_grid(*grid_PM10);
+        free_grid(*grid_O3);
+        free_grid(*grid_O3_net_uptake);
+        *grid_OFP = NULL;
+        *grid_PM10 = NULL;
+        *grid_O3 = NULL;
+        *grid_O3_net_uptake = NULL;
+        return -1;
+    }
+    convert_grids(length_y, length_x, *grid_OFP, *grid_PM10, *grid_O3, *grid_O3_net_uptake);
+    printf("Calculations are done\n");
+    return added;
+}
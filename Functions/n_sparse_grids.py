@@ -0,0 +1,126 @@
+import numpy as np
+import math
+import ctypes
+from Functions.h_structures import *
+from Functions.f_numpy_model import *
+
+# ------------------------------------------------------------------------------------------------------------------------
+# This file contains the sparse grids, used for high resolutions where most of the cells of the grid contain no tree. A
+# sparse grid only stores its occupied cells, as a dictionary with the shape of the grid, the sorted index of the occupied
+# cells (row * length_x + column) and their values, so its memory depends on the number of trees and not on the size of
+# the grid. The four outputs share the same array of cells. The functions of this file (totals, maximum, images for the
+# plots) accept both sparse grids and dense 2D NumPy arrays.
+# ------------------------------------------------------------------------------------------------------------------------
+
+# ---------------------------------------------------------------------------------------------
+# declare_sparse_functions: This function defines the C functions used in this file.
+# Input: shared library
+# Output: None
+# ---------------------------------------------------------------------------------------------
+
+def declare_sparse_functions(clibrary):
+    clibrary.main_function2_sparse.argtypes = [ctypes.POINTER(TreeColumns), ctypes.POINTER(ctypes.c_longlong)] + [ctypes.POINTER(ctypes.c_double)] * 4 + [ctypes.POINTER(ctypes.c_int)] * 2 + [ctypes.c_double, ctypes.c_double, ctypes.c_int]
+    clibrary.main_function2_sparse.restype = ctypes.c_int
+
+# ---------------------------------------------------------------------------------------------
+# sparse_grids: This function creates the four sparse grids sharing the same occupied cells.
+# Input: distances of grid in y and x direction, index of the occupied cells, four arrays of values
+# Output: grid_OFP, grid_PM10, grid_O3, grid_O3_net_uptake as sparse grids
+# ---------------------------------------------------------------------------------------------
+
+def sparse_grids(length_y, length_x, cells, *values):
+    return tuple({'shape': (length_y, length_x), 'cells': cells, 'values': value} for value in values)
+
+# -------------------------------------------------------------------------------------------------------------------------------
+# main_function_sparse: This function calculates the sparse grids of the filtered trees with C or NumPy.
+# Inputs: shared library (None for NumPy), dictionary of columns of filtered trees, concentration of PM10 and O3, gridsize
+# Outputs: grid_OFP, grid_PM10, grid_O3, grid_O3_net_uptake as sparse grids (kg/y)
+# -------------------------------------------------------------------------------------------------------------------------------
+
+def main_function_sparse(clibrary, filtered_columns, C_PM10, C_O3, gridsize):
+    if clibrary is None:
+        return sparse_grids(*main_function2_sparse_numpy(dict(filtered_columns), C_PM10, C_O3, gridsize))
+
+    declare_sparse_functions(clibrary)
+    size = len(filtered_columns['crown_height'])
+    cells = np.zeros(size, dtype=np.int64)                           # at most one occupied cell per tree
+    values = [np.zeros(size) for k in range(4)]
+    length_y = ctypes.c_int(0)
+    length_x = ctypes.c_int(0)
+    count = clibrary.main_function2_sparse(ctypes.byref(c_tree_columns(filtered_columns)), cells.ctypes.data_as(ctypes.POINTER(ctypes.c_longlong)),
+                                           *[value.ctypes.data_as(ctypes.POINTER(ctypes.c_double)) for value in values],
+                                           ctypes.byref(length_y), ctypes.byref(length_x), C_PM10, C_O3, gridsize)
+    if count < 0:
+        raise MemoryError("The sparse grids could not be calculated")
+    return sparse_grids(length_y.value, length_x.value, cells[:count].copy(), *[value[:count].copy() for value in values])
+
+# -----------------------------------------------------------------------------------------------
+# is_sparse, grid_shape: These functions tell if a grid is sparse and return its shape.
+# -----------------------------------------------------------------------------------------------
+
+def is_sparse(grid):
+    return isinstance(grid, dict)
+
+def grid_shape(grid):
+    return tuple(grid['shape']) if is_sparse(grid) else grid.shape
+
+# -----------------------------------------------------------------------------------------------
+# sparse_to_dense: This function creates the dense 2D NumPy array of a sparse grid.
+# -----------------------------------------------------------------------------------------------
+
+def sparse_to_dense(grid):
+    if not is_sparse(grid):
+        return grid
+    dense = np.zeros(grid['shape'])
+    dense.ravel()[grid['cells']] = grid['values']
+    return dense
+
+# ---------------------------------------------------------------------------------------------------------------
+# grid_total, grid_max, grid_min: These functions return the sum, the maximum and the minimum of a grid. For a
+#                                 sparse grid, the empty cells count as 0.
+# ---------------------------------------------------------------------------------------------------------------
+
+def grid_total(grid):
+    return np.sum(grid['values']) if is_sparse(grid) else np.sum(grid)
+
+def occupied_values(grid):
+    values = grid['values']
+    if len(values) < grid['shape'][0] * grid['shape'][1]:
+        values = np.append(values, 0.0)                  # at least one cell is empty
+    return values
+
+def grid_max(grid):
+    return occupied_values(grid).max() if is_sparse(grid) else grid.max()
+
+def grid_min(grid):
+    return occupied_values(grid).min() if is_sparse(grid) else grid.min()
+
+# ---------------------------------------------------------------------------------------------------------------------------
+# sparse_block_sum: This function sums the cells of a sparse grid by blocks of factor x factor cells (see block_sum in
+#                   k_grid_pyramid.py).
+# Input: sparse grid, integer factor
+# Output: sparse grid of lengths ceil(length_y / factor) and ceil(length_x / factor)
+# ---------------------------------------------------------------------------------------------------------------------------
+
+def sparse_block_sum(grid, factor):
+    length_y, length_x = grid['shape']
+    coarse_y, coarse_x = math.ceil(length_y / factor), math.ceil(length_x / factor)
+    rows, cols = np.divmod(grid['cells'], length_x)
+    cells, blocks = np.unique((rows // factor) * coarse_x + cols // factor, return_inverse=True)
+    values = np.bincount(blocks.ravel(), weights=grid['values'], minlength=len(cells))
+    return {'shape': (coarse_y, coarse_x), 'cells': cells, 'values': values}
+
+# ---------------------------------------------------------------------------------------------------------------------------
+# grid_image: This function returns a dense image of a grid for the plots. A sparse grid larger than max_pixels x max_pixels
+#             cells is first summed by blocks of factor x factor cells, so that the image always fits in memory.
+# Input: dense or sparse grid, maximum number of pixels per side
+# Output: 2D NumPy array, factor
+# ---------------------------------------------------------------------------------------------------------------------------
+
+def grid_image(grid, max_pixels=4000):
+    if not is_sparse(grid):
+        return grid, 1
+    factor = max(1, math.ceil(max(grid['shape']) / max_pixels))
+    if factor > 1:
+        grid = sparse_block_sum(grid, factor)
+    return sparse_to_dense(grid), factor
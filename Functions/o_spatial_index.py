@@ -0,0 +1,195 @@
+import numpy as np
+from matplotlib.path import Path
+from Functions.h_structures import *
+from Functions.f_numpy_model import *
+from Functions.l_tiles import anchored_cells
+
+# ------------------------------------------------------------------------------------------------------------------------
+# This file contains the spatial index of the trees, which answers questions such as "what is the PM10 uptake inside this
+# park" or "within 500 m of this school" without computing any grid. The trees are sorted by bucket, the buckets being the
+# square cells of bucket_size meters counted from the LV95 origin (see l_tiles.py), and the OFP, PM10, O3 removed mass and
+# O3 net uptake of every tree (kg/y) are kept with them. A query only looks at the buckets overlapping its region: the
+# buckets entirely inside the region are added with their precomputed totals, and only the trees of the buckets on its
+# border are tested one by one. The index can be saved to a .npz file and loaded again without the model.
+# ------------------------------------------------------------------------------------------------------------------------
+
+class SpatialIndex:
+
+    # -------------------------------------------------------------------------------------------------------------------
+    # __init__: This function sorts the trees by bucket and computes the totals of every bucket.
+    # Inputs: LV95 coordinates x and y of the trees, 2D array with the OFP, PM10, O3 removed mass and O3 net uptake of
+    #         each tree (kg/y), size of the buckets in meters, optional index of the trees (default: their position)
+    # -------------------------------------------------------------------------------------------------------------------
+
+    def __init__(self, position_x, position_y, values, bucket_size=100.0, ids=None):
+        self.bucket_size = float(bucket_size)
+        position_x = np.asarray(position_x, dtype=np.float64)
+        position_y = np.asarray(position_y, dtype=np.float64)
+        rows = anchored_cells(position_y, self.bucket_size)
+        cols = anchored_cells(position_x, self.bucket_size)
+        self.first_row, self.first_column = (int(rows.min()), int(cols.min())) if len(rows) else (0, 0)
+        self.length_y = int(rows.max()) + 1 - self.first_row if len(rows) else 1
+        self.length_x = int(cols.max()) + 1 - self.first_column if len(cols) else 1
+
+        # Sort the trees by bucket; the stable sort keeps the order of the trees within each bucket
+        buckets = (rows - self.first_row) * self.length_x + (cols - self.first_column)
+        order = np.argsort(buckets, kind='stable')
+        self.position_x = position_x[order]
+        self.position_y = position_y[order]
+        self.values = np.asarray(values, dtype=np.float64).reshape(-1, 4)[order]
+        self.ids = order if ids is None else np.asarray(ids, dtype=np.int64)[order]
+
+        # The trees of the bucket b are starts[b], ..., starts[b + 1] - 1
+        self.starts = np.searchsorted(buckets[order], np.arange(self.length_y * self.length_x + 1))
+        self.bucket_totals = np.zeros((self.length_y * self.length_x, 4))
+        np.add.at(self.bucket_totals, buckets[order], self.values)
+        self.bucket_totals = self.bucket_totals.reshape(self.length_y, self.length_x, 4)
+
+    # -------------------------------------------------------------------------------------------------------------------
+    # bucket_range: This function returns the buckets of the index overlapping an interval of coordinates.
+    # Inputs: lowest and highest coordinate, first bucket and number of buckets of the index in this direction
+    # Output: first and last bucket (counted from the first bucket of the index), none when last = first - 1
+    # -------------------------------------------------------------------------------------------------------------------
+
+    def bucket_range(self, low, high, first, length):
+        first_bucket = max(int(np.floor(low / self.bucket_size)) - first, 0)
+        last_bucket = min(int(np.floor(high / self.bucket_size)) - first, length - 1)
+        return first_bucket, max(last_bucket, first_bucket - 1)
+
+    # -------------------------------------------------------------------------------------------------------------------
+    # bucket_trees: This function returns the position of the trees of some buckets in the sorted arrays.
+    # Input: array of buckets (row * length_x + column)
+    # Output: array of integers
+    # -------------------------------------------------------------------------------------------------------------------
+
+    def bucket_trees(self, buckets):
+        lengths = self.starts[buckets + 1] - self.starts[buckets]
+        return np.repeat(self.starts[buckets] - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+
+    # -------------------------------------------------------------------------------------------------------------------
+    # query: This function sums the values of the trees in a region.
+    # Inputs: bounding box of the region (x_min, y_min, x_max, y_max), function telling which buckets are entirely
+    #         inside the region (from the 2D arrays of their lowest and highest x and y), function telling which points
+    #         are inside the region (from the arrays of their x and y), whether the index of the trees is returned
+    # Outputs: amount of trees, index of the trees (only when ids is True), four totals (kg/y)
+    # -------------------------------------------------------------------------------------------------------------------
+
+    def query(self, bbox, buckets_inside, points_inside, ids=False):
+        x_min, y_min, x_max, y_max = bbox
+        row_first, row_last = self.bucket_range(y_min, y_max, self.first_row, self.length_y)
+        column_first, column_last = self.bucket_range(x_min, x_max, self.first_column, self.length_x)
+        rows = np.arange(row_first, row_last + 1)
+        cols = np.arange(column_first, column_last + 1)
+
+        # Edges of the overlapping buckets
+        low_y = np.repeat(((rows + self.first_row) * self.bucket_size)[:, None], len(cols), axis=1)
+        low_x = np.repeat(((cols + self.first_column) * self.bucket_size)[None, :], len(rows), axis=0)
+        inside = buckets_inside(low_x, low_y, low_x + self.bucket_size, low_y + self.bucket_size)
+        buckets = rows[:, None] * self.length_x + cols[None, :]
+
+        # Buckets entirely inside the region: precomputed totals
+        totals = self.bucket_totals[row_first:row_last + 1, column_first:column_last + 1][inside].sum(axis=0)
+        count = int(np.sum(self.starts[buckets[inside] + 1] - self.starts[buckets[inside]]))
+
+        # Buckets on the border: the trees are tested one by one
+        trees = self.bucket_trees(buckets[~inside])
+        trees = trees[points_inside(self.position_x[trees], self.position_y[trees])]
+        totals = totals + self.values[trees].sum(axis=0)
+        count += len(trees)
+
+        totals = [float(total) for total in totals]
+        if ids:
+            return (count, np.sort(self.ids[np.concatenate([self.bucket_trees(buckets[inside]), trees])]), *totals)
+        return (count, *totals)
+
+    # -------------------------------------------------------------------------------------------------------------------
+    # bbox, radius, polygon: These functions return the amount of trees and the totals of the OFP, PM10, O3 removed mass
+    #                        and O3 net uptake (kg/y) of the trees in a region; trees on its edges are included.
+    #                        With ids=True, the index of these trees is returned after their amount.
+    # Inputs: bbox: lowest and highest LV95 coordinates x and y
+    #         radius: LV95 coordinates x and y of the center, radius in meters
+    #         polygon: list or array of LV95 vertices (x, y)
+    # -------------------------------------------------------------------------------------------------------------------
+
+    def bbox(self, x_min, y_min, x_max, y_max, ids=False):
+        return self.query((x_min, y_min, x_max, y_max),
+                          lambda low_x, low_y, high_x, high_y: (low_x >= x_min) & (high_x <= x_max) & (low_y >= y_min) & (high_y <= y_max),
+                          lambda x, y: (x >= x_min) & (x <= x_max) & (y >= y_min) & (y <= y_max), ids)
+
+    def radius(self, x, y, radius, ids=False):
+        def buckets_inside(low_x, low_y, high_x, high_y):
+            far_x = np.maximum(np.abs(low_x - x), np.abs(high_x - x))            # farthest corner of each bucket
+            far_y = np.maximum(np.abs(low_y - y), np.abs(high_y - y))
+            return far_x**2 + far_y**2 <= radius**2
+
+        return self.query((x - radius, y - radius, x + radius, y + radius), buckets_inside,
+                          lambda position_x, position_y: (position_x - x)**2 + (position_y - y)**2 <= radius**2, ids)
+
+    def polygon(self, vertices, ids=False):
+        vertices = np.asarray(vertices, dtype=np.float64)
+        path = Path(vertices, closed=False)
+        (x_min, y_min), (x_max, y_max) = vertices.min(axis=0), vertices.max(axis=0)
+
+        # A bucket is entirely inside when one of its corners is inside and no edge of the polygon crosses it
+        def buckets_inside(low_x, low_y, high_x, high_y):
+            inside = path.contains_points(np.column_stack([low_x.ravel(), low_y.ravel()])).reshape(low_x.shape)
+            return inside & ~edges_cross(vertices, low_x, low_y, high_x, high_y)
+
+        # Points on the edges are inside: the sign of the radius enlarging the polygon depends on its orientation
+        def points_inside(x, y):
+            points = np.column_stack([x, y])
+            return path.contains_points(points, radius=1e-9) | path.contains_points(points, radius=-1e-9)
+
+        return self.query((x_min, y_min, x_max, y_max), buckets_inside, points_inside, ids)
+
+    # -------------------------------------------------------------------------------------------------------------------
+    # save: This function saves the index to a .npz file (see load_spatial_index).
+    # -------------------------------------------------------------------------------------------------------------------
+
+    def save(self, file_name):
+        np.savez(file_name, position_x=self.position_x, position_y=self.position_y, values=self.values, ids=self.ids, bucket_size=self.bucket_size)
+
+# ---------------------------------------------------------------------------------------------------------------------------
+# edges_cross: This function tells which rectangles are touched by at least one edge of a polygon (Liang-Barsky clipping of
+#              every edge by every rectangle).
+# Input: array of vertices (x, y), 2D arrays of the lowest and highest x and y of the rectangles
+# Output: 2D array of booleans
+# ---------------------------------------------------------------------------------------------------------------------------
+
+def edges_cross(vertices, low_x, low_y, high_x, high_y):
+    cross = np.zeros(low_x.shape, dtype=bool)
+    for (x0, y0), (x1, y1) in zip(vertices, np.roll(vertices, -1, axis=0)):
+        t_first = np.zeros(low_x.shape)
+        t_last = np.ones(low_x.shape)
+        outside = np.zeros(low_x.shape, dtype=bool)
+        for p, q in ((x0 - x1, x0 - low_x), (x1 - x0, high_x - x0), (y0 - y1, y0 - low_y), (y1 - y0, high_y - y0)):
+            if p == 0:
+                outside |= q < 0
+            elif p < 0:
+                t_first = np.maximum(t_first, q / p)
+            else:
+                t_last = np.minimum(t_last, q / p)
+        cross |= ~outside & (t_first <= t_last)
+    return cross
+
+# ---------------------------------------------------------------------------------------------------------------------------
+# spatial_index: This function applies the model to the filtered trees and creates the spatial index of their results.
+# Inputs: dictionary of columns of filtered trees, concentration of PM10 and O3, size of the buckets in meters
+# Output: SpatialIndex
+# ---------------------------------------------------------------------------------------------------------------------------
+
+def spatial_index(filtered_columns, C_PM10, C_O3, bucket_size=100.0):
+    trees = dict(filtered_columns)
+    model_functions(trees, C_PM10, C_O3)
+    values = np.column_stack([trees['OFP_yearly'] * 10.0**-9, trees['PM10_yearly'], trees['O3_removed_mass_yearly'] * 10.0**-3, trees['O3_net_uptake_yearly'] * 10.0**-3])
+    return SpatialIndex(trees['position_x'], trees['position_y'], values, bucket_size)
+
+# ---------------------------------------------------------------------------------------------------------------------------
+# load_spatial_index: This function loads an index saved with SpatialIndex.save. The trees are already sorted by bucket.
+# Input: path of the .npz file
+# Output: SpatialIndex
+# ---------------------------------------------------------------------------------------------------------------------------
+
+def load_spatial_index(file_name):
+    with np.load(file_name) as data:
+        return SpatialIndex(data['position_x'], data['position_y'], data['values'], float(data['bucket_size']), data['ids'])
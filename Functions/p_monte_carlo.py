@@ -0,0 +1,266 @@
+import numpy as np
+from Functions.h_structures import *
+from Functions.e_filter_trees import *
+from Functions.f_numpy_model import *
+
+# ------------------------------------------------------------------------------------------------------------------------
+# This file contains the Monte Carlo mode, which estimates the uncertainty of the grids. Two inputs of the model are only
+# known on average:
+#   - the crown height and diameter of the trees missing them in the CSV file are set to the average of the measured
+#     values (readwriteDocument), which flags them (crown_height_imputed and crown_diameter_imputed). Here they are drawn
+#     from the 2D normal distribution of the measured (height, diameter), conditioned on the measured value when only one
+#     of both is missing.
+#   - the EF, conversion factor and shading coefficient of a genus are the average over its species (readfile). Here every
+#     genus gets the values of one of its species, drawn at random in every realisation, so the mean of the parameters over
+#     the realisations is the value of the main run. The leaf area grows exponentially with the shading coefficient, so the
+#     mean of the grids can still be somewhat larger than the grids of the main run.
+# The MIR values are the same for all the trees and are kept as they are in the filtered trees.
+# The realisations are computed in batches with NumPy (one row per realisation). The mean, the variance (Welford) and some
+# quantiles (P2 algorithm of Jain and Chlamtac) of every occupied grid cell are updated after every batch, so the memory
+# does not depend on the number of realisations. The grids use the same cells as main_function2_numpy.
+# ------------------------------------------------------------------------------------------------------------------------
+
+# ---------------------------------------------------------------------------------------------------------------------
+# read_species_values: This function reads a CSV file with scientific parameters like readfile, but keeps the values of
+#                      every species instead of averaging them for each genus.
+# Input: filepath of CSV file
+# Output: dictionary with the genera as keys and 2D arrays with one row per species as values
+# ---------------------------------------------------------------------------------------------------------------------
+
+def read_species_values(file_name):
+    values = {}
+    with open(file_name, "r") as file:
+        for line in file:
+            data = line.strip().split(";")
+            if len(data) < 2 or not data[0].strip():
+                continue
+            row = [0.0 if value.strip() == "None" else float(value) for value in data[1:]]       # no data available: 0.0, like readfile
+            values.setdefault(genus_of(data[0]), []).append(row)
+    return {genus: np.array(rows) for genus, rows in values.items()}
+
+# ---------------------------------------------------------------------------------------------------------------------
+# draw_crowns: This function draws the crown height and diameter of the trees missing them, for several realisations.
+# Inputs: crown heights and diameters, masks of the imputed heights and diameters, number of realisations, random generator
+# Outputs: 2D arrays of crown heights and diameters, one row per realisation
+# ---------------------------------------------------------------------------------------------------------------------
+
+def draw_crowns(height, diameter, missing_height, missing_diameter, size, generator):
+    heights = np.repeat(height[None, :], size, axis=0)
+    diameters = np.repeat(diameter[None, :], size, axis=0)
+    measured = ~missing_height & ~missing_diameter
+    if measured.sum() < 2 or not (missing_height | missing_diameter).any():
+        return heights, diameters
+
+    # 2D normal distribution of the trees with both values measured
+    mean = np.array([height[measured].mean(), diameter[measured].mean()])
+    cov = np.cov(height[measured], diameter[measured])
+    low = np.array([height[measured].min(), diameter[measured].min()])
+    high = np.array([height[measured].max(), diameter[measured].max()])
+
+    # Both values missing: joint distribution
+    both = missing_height & missing_diameter
+    draws = generator.multivariate_normal(mean, cov, size=(size, both.sum()))
+    heights[:, both] = np.clip(draws[..., 0], low[0], high[0])
+    diameters[:, both] = np.clip(draws[..., 1], low[1], high[1])
+
+    # One value missing: distribution conditioned on the measured one
+    for k, (missing, values, known) in enumerate(((missing_height & ~missing_diameter, heights, diameter),
+                                                  (missing_diameter & ~missing_height, diameters, height))):
+        slope = cov[0, 1] / cov[1 - k, 1 - k]
+        sigma = np.sqrt(max(cov[k, k] - cov[0, 1] * slope, 0.0))
+        conditional_mean = mean[k] + slope * (known[missing] - mean[1 - k])
+        values[:, missing] = np.clip(conditional_mean + sigma * generator.standard_normal((size, missing.sum())), low[k], high[k])
+    return heights, diameters
+
+# ---------------------------------------------------------------------------------------------------------------------
+# species_tables: This function puts the values of the species of every genus into arrays indexed by genus code.
+# Inputs: list of genera, dictionary of values (see read_species_values)
+# Outputs: 3D array (genus, species, values) padded with the first species, number of species of every genus
+# ---------------------------------------------------------------------------------------------------------------------
+
+def species_tables(genera, values):
+    counts = np.array([len(values.get(genus, [[0.0]])) for genus in genera])
+    width = max(len(next(iter(values.values()))[0]), 1) if values else 1
+    table = np.zeros((len(genera), counts.max(), width))
+    for g, genus in enumerate(genera):
+        if genus in values:
+            table[g] = np.concatenate([values[genus], np.repeat(values[genus][:1], counts.max() - counts[g], axis=0)])
+    return table, counts
+
+class CellStatistics:
+
+    # -------------------------------------------------------------------------------------------------------------------
+    # __init__: This function creates the statistics of the occupied cells of a grid.
+    # Inputs: shape of the grid, index of the occupied cells (row * length_x + column), list of quantiles (between 0 and 1)
+    # -------------------------------------------------------------------------------------------------------------------
+
+    def __init__(self, shape, cells, quantiles):
+        self.shape = shape
+        self.cells = cells
+        self.quantiles = list(quantiles)
+        self.count = 0
+        self.mean_values = np.zeros(len(cells))
+        self.M2 = np.zeros(len(cells))                                         # sum of the squared deviations (Welford)
+
+        # P2 markers of every quantile: heights and positions of 5 markers per cell, desired positions and their increments
+        self.first = np.zeros((5, len(cells)))                                 # first 5 values, used to start the markers
+        self.heights = np.zeros((len(self.quantiles), 5, len(cells)))
+        self.positions = np.repeat(np.arange(1.0, 6.0)[None, :, None], len(self.quantiles), axis=0) * np.ones(len(cells))
+        self.desired = np.array([[1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5] for p in self.quantiles])
+        self.increments = np.array([[0, p / 2, p, (1 + p) / 2, 1] for p in self.quantiles])
+
+    # -------------------------------------------------------------------------------------------------------------------
+    # update: This function adds a batch of realisations to the statistics.
+    # Input: 2D array with one row per realisation and one column per occupied cell
+    # -------------------------------------------------------------------------------------------------------------------
+
+    def update(self, batch):
+        # Mean and variance: the batch is merged with the previous realisations (Chan et al.)
+        size = len(batch)
+        batch_mean = batch.mean(axis=0)
+        delta = batch_mean - self.mean_values
+        total = self.count + size
+        self.M2 += ((batch - batch_mean)**2).sum(axis=0) + delta**2 * self.count * size / total
+        self.mean_values += delta * size / total
+
+        for values in batch:
+            if self.count < 5:
+                self.first[self.count] = values
+                self.count += 1
+                if self.count == 5:
+                    self.heights[:] = np.sort(self.first, axis=0)
+                continue
+            self.count += 1
+            for k in range(len(self.quantiles)):
+                self.update_markers(k, values)
+
+    # -------------------------------------------------------------------------------------------------------------------
+    # update_markers: This function moves the markers of one quantile after a new realisation (P2 algorithm).
+    # Inputs: number of the quantile, values of the realisation in every occupied cell
+    # -------------------------------------------------------------------------------------------------------------------
+
+    def update_markers(self, k, values):
+        q = self.heights[k]
+        n = self.positions[k]
+        q[0] = np.minimum(q[0], values)
+        q[4] = np.maximum(q[4], values)
+        cell = (values >= q[1]).astype(int) + (values >= q[2]) + (values >= q[3])      # q[cell] <= value < q[cell + 1]
+        n += np.arange(5)[:, None] > cell
+        self.desired[k] += self.increments[k]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for i in (1, 2, 3):
+                d = self.desired[k, i] - n[i]
+                move = ((d >= 1) & (n[i + 1] - n[i] > 1)) | ((d <= -1) & (n[i - 1] - n[i] < -1))
+                if not move.any():
+                    continue
+                s = np.sign(d)
+                parabolic = q[i] + s / (n[i + 1] - n[i - 1]) * ((n[i] - n[i - 1] + s) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                                                               + (n[i + 1] - n[i] - s) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                linear = np.where(s > 0, q[i] + (q[i + 1] - q[i]) / (n[i + 1] - n[i]), q[i] - (q[i - 1] - q[i]) / (n[i - 1] - n[i]))
+                moved = np.where((q[i - 1] < parabolic) & (parabolic < q[i + 1]), parabolic, linear)
+                q[i] = np.where(move, moved, q[i])
+                n[i] += np.where(move, s, 0.0)
+
+    # -------------------------------------------------------------------------------------------------------------------
+    # grid: This function puts the values of the occupied cells into a grid (the empty cells are 0).
+    # -------------------------------------------------------------------------------------------------------------------
+
+    def grid(self, values):
+        grid = np.zeros(self.shape)
+        grid.ravel()[self.cells] = values
+        return grid
+
+    # -------------------------------------------------------------------------------------------------------------------
+    # mean, std, quantile: These functions return the mean, the standard deviation and a quantile of every grid cell.
+    # -------------------------------------------------------------------------------------------------------------------
+
+    def mean(self):
+        return self.grid(self.mean_values)
+
+    def std(self):
+        return self.grid(np.sqrt(self.M2 / max(self.count - 1, 1)))
+
+    def quantile(self, p):
+        k = self.quantiles.index(p)
+        if self.count < 5:
+            return self.grid(np.quantile(self.first[:self.count], p, axis=0))
+        return self.grid(self.heights[k, 2])
+
+# ---------------------------------------------------------------------------------------------------------------------------
+# main_function_monte_carlo: This function computes the statistics of the four grids over many realisations of the uncertain
+#                            inputs (see the top of this file).
+# Inputs: dictionary of columns of filtered trees, file paths of the conversion factor, EF and shading coefficient,
+#         concentration of PM10 and O3, gridsize, number of
+#         realisations, list of quantiles, number of realisations computed at once, seed of the random generator
+# Outputs: list of CellStatistics for the OFP, PM10, O3 removed mass and O3 net uptake (kg/y),
+#          2D array with the four totals of every realisation (kg/y)
+# ---------------------------------------------------------------------------------------------------------------------------
+
+def main_function_monte_carlo(filtered_columns, conversion_factor, EF, shading_coeff, C_PM10, C_O3, gridsize, realisations,
+                              quantiles=(0.05, 0.95), batch_size=8, seed=0):
+    trees = dict(filtered_columns)
+    coordinates_adaption(trees)
+    length_y = distance(trees['position_y'], gridsize)
+    length_x = distance(trees['position_x'], gridsize)
+    cells = cell_index(trees['position_y_grid'], gridsize, length_y) * length_x + cell_index(trees['position_x_grid'], gridsize, length_x)
+    occupied, tree_cells = np.unique(cells, return_inverse=True)
+    tree_cells = tree_cells.ravel()
+    print(f"These are the lengths of our grid: {length_y}, {length_x}")
+
+    # Uncertain inputs
+    missing_height = trees['crown_height_imputed'] == 1
+    missing_diameter = trees['crown_diameter_imputed'] == 1
+    used, genus_codes = np.unique(trees['species_genus'][trees['species_code']], return_inverse=True)      # genera of the trees, sorted by name
+    genera, genus_order = np.unique(np.array(genus_names(trees), dtype=str)[used], return_inverse=True)
+    genus_codes = genus_order.ravel()[genus_codes.ravel()]
+    tables = {name: species_tables(genera, read_species_values(file_name))
+              for name, file_name in (('conversion_factor', conversion_factor), ('mass_emission_factor', EF), ('shading_factor', shading_coeff))}
+    print(f"Monte Carlo: {missing_height.sum()} crown heights and {missing_diameter.sum()} crown diameters drawn, {len(genera)} genera")
+
+    generator = np.random.default_rng(seed)
+    statistics = [CellStatistics((length_y, length_x), occupied, quantiles) for k in range(4)]
+    totals = np.zeros((realisations, 4))
+    for start in range(0, realisations, batch_size):
+        size = min(batch_size, realisations - start)
+        batch = dict(trees)
+        batch['crown_height'], batch['crown_diameter'] = draw_crowns(trees['crown_height'], trees['crown_diameter'], missing_height, missing_diameter, size, generator)
+        for name, (table, counts) in tables.items():
+            drawn = (generator.random((size, len(genera))) * counts).astype(np.int64)          # one species of every genus
+            values = table[genus_codes, drawn[:, genus_codes]]
+            batch[name] = values if name == 'mass_emission_factor' else values[..., 0]
+        model_functions(batch, C_PM10, C_O3)
+
+        # Sum of the trees of every occupied cell, for every realisation of the batch
+        rows = (np.arange(size)[:, None] * len(occupied) + tree_cells).ravel()
+        for k, (field, factor) in enumerate((('OFP_yearly', 10.0**-9), ('PM10_yearly', 1.0), ('O3_removed_mass_yearly', 10.0**-3), ('O3_net_uptake_yearly', 10.0**-3))):
+            values = np.broadcast_to(batch[field], (size, len(tree_cells)))
+            sums = np.bincount(rows, weights=values.ravel(), minlength=size * len(occupied)).reshape(size, len(occupied)) * factor
+            statistics[k].update(sums)
+            totals[start:start + size, k] = sums.sum(axis=1)
+        print(f"Realisations computed: {start + size} / {realisations}")
+
+    return statistics, totals
+
+# ---------------------------------------------------------------------------------------------------------------------------
+# write_monte_carlo: This function writes the mean, the standard deviation and the quantiles of the totals into the summary
+#                    file, and saves the grids of the statistics into a .npz file (one array per output and statistic, e.g.
+#                    OFP_mean, PM10_std, O3_q0.95).
+# Inputs: opened summary file, statistics and totals (see main_function_monte_carlo), path of the .npz file
+# Output: None
+# ---------------------------------------------------------------------------------------------------------------------------
+
+def write_monte_carlo(summary, statistics, totals, file_name):
+    quantiles = statistics[0].quantiles
+    names = ['OFP', 'PM10', 'O3', 'O3_net_uptake']
+    summary.write(f"Monte Carlo: {len(totals)} realisations, totals (mean ; standard deviation ; quantiles {' ; '.join(str(p) for p in quantiles)}):\n")
+    for name, column in zip(names, totals.T):
+        summary.write(f"    {name}: {column.mean()} ; {column.std(ddof=1) if len(column) > 1 else 0.0} ; {' ; '.join(str(np.quantile(column, p)) for p in quantiles)} kg/y\n")
+
+    grids = {}
+    for name, cell_statistics in zip(names, statistics):
+        grids[f"{name}_mean"] = cell_statistics.mean()
+        grids[f"{name}_std"] = cell_statistics.std()
+        for p in quantiles:
+            grids[f"{name}_q{p}"] = cell_statistics.quantile(p)
+    np.savez(file_name, **grids)
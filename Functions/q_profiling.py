@@ -0,0 +1,149 @@
+import numpy as np
+import ctypes
+import time
+import json
+import sys
+import platform
+import cProfile
+import pstats
+try:
+    import resource                       # not available on Windows
+except ImportError:
+    resource = None
+
+# ------------------------------------------------------------------------------------------------------------------------
+# This file contains the profiling of the program. The execution files split their run into stages (reading, filtering,
+# grid calculations, plots, ...) and record the wall time, the CPU time, the peak memory and the amount of items of each
+# one. The shared library keeps the same counters for its own stages (parsing of the CSV file, missing values, control
+# file, coordinates, allocation of the grids, model, binning of the trees into the cells, conversion to kg/y), which are
+# read at the end. Everything is written as JSON next to summary.txt. Optionally, the whole run is profiled with cProfile
+# (statistics saved for pstats or snakeviz), or the Python functions are made visible to perf (Python 3.12 and newer).
+# ------------------------------------------------------------------------------------------------------------------------
+
+# ------------------------------------------------------------------------------------------------------------------------
+# peak_memory: This function returns the peak resident memory of the process in MB (None on Windows).
+# ------------------------------------------------------------------------------------------------------------------------
+
+def peak_memory():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if platform.system() == "Darwin" else peak / 2**10          # bytes on MacOS, kB on Linux
+
+# ------------------------------------------------------------------------------------------------------------------------
+# declare_profile_functions: This function defines the C functions used in this file.
+# Input: shared library
+# Output: None
+# ------------------------------------------------------------------------------------------------------------------------
+
+def declare_profile_functions(clibrary):
+    clibrary.reset_profile.argtypes = []
+    clibrary.reset_profile.restype = None
+    clibrary.get_profile.argtypes = [ctypes.POINTER(ctypes.c_double)] * 2 + [ctypes.POINTER(ctypes.c_longlong)] * 2
+    clibrary.get_profile.restype = ctypes.c_int
+    clibrary.profile_stage_name.argtypes = [ctypes.c_int]
+    clibrary.profile_stage_name.restype = ctypes.c_char_p
+
+# ------------------------------------------------------------------------------------------------------------------------
+# c_profile: This function reads the counters of the stages of the shared library.
+# Input: shared library
+# Output: list of dictionaries, one per stage that was called
+# ------------------------------------------------------------------------------------------------------------------------
+
+def c_profile(clibrary):
+    stages = 16                                                      # more than the amount of stages in C
+    wall, cpu = np.zeros(stages), np.zeros(stages)
+    items, calls = np.zeros(stages, dtype=np.int64), np.zeros(stages, dtype=np.int64)
+    count = clibrary.get_profile(wall.ctypes.data_as(ctypes.POINTER(ctypes.c_double)), cpu.ctypes.data_as(ctypes.POINTER(ctypes.c_double)),
+                                 items.ctypes.data_as(ctypes.POINTER(ctypes.c_longlong)), calls.ctypes.data_as(ctypes.POINTER(ctypes.c_longlong)))
+    return [{'stage': clibrary.profile_stage_name(k).decode(), 'wall_s': float(wall[k]), 'cpu_s': float(cpu[k]), 'items': int(items[k]), 'calls': int(calls[k]),
+             'items_per_s': float(items[k] / wall[k]) if wall[k] > 0 else None}
+            for k in range(count) if calls[k] > 0]
+
+class Profiler:
+
+    # -------------------------------------------------------------------------------------------------------------------
+    # __init__: This function starts the profiling of the run and sets the counters of the shared library to zero.
+    # Inputs: shared library (None for the NumPy backend), None, "cprofile" or "perf"
+    # -------------------------------------------------------------------------------------------------------------------
+
+    def __init__(self, clibrary=None, mode=None):
+        self.clibrary = clibrary
+        self.mode = mode
+        self.stages = []
+        self.current = None
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        if clibrary is not None:
+            declare_profile_functions(clibrary)
+            clibrary.reset_profile()
+
+        self.cprofile = None
+        if mode == "cprofile":
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+        elif mode == "perf":
+            if hasattr(sys, "activate_stack_trampoline"):
+                sys.activate_stack_trampoline("perf")                 # run with: perf record -g python execution_file_...
+            else:
+                print("The perf mode needs Python 3.12 or newer, it is ignored")
+        elif mode is not None:
+            raise ValueError(f"Unknown profiling mode: {mode}")
+
+    # -------------------------------------------------------------------------------------------------------------------
+    # stage: This function ends the current stage and starts a new one.
+    # Inputs: name of the stage, optional amount of items handled (see items)
+    # -------------------------------------------------------------------------------------------------------------------
+
+    def stage(self, name, items=None):
+        self.stop()
+        self.current = {'stage': name, 'items': items, 'wall': time.perf_counter(), 'cpu': time.process_time()}
+
+    # -------------------------------------------------------------------------------------------------------------------
+    # items: This function sets the amount of items (trees, cells, realisations, ...) handled by the current stage.
+    # -------------------------------------------------------------------------------------------------------------------
+
+    def items(self, count):
+        if self.current is not None:
+            self.current['items'] = int(count)
+
+    # -------------------------------------------------------------------------------------------------------------------
+    # stop: This function ends the current stage. The peak memory is the one of the process at the end of the stage.
+    # -------------------------------------------------------------------------------------------------------------------
+
+    def stop(self):
+        if self.current is None:
+            return
+        wall = time.perf_counter() - self.current['wall']
+        items = self.current['items']
+        self.stages.append({'stage': self.current['stage'], 'wall_s': wall, 'cpu_s': time.process_time() - self.current['cpu'],
+                            'peak_memory_mb': peak_memory(), 'items': items, 'items_per_s': items / wall if items is not None and wall > 0 else None})
+        self.current = None
+
+    # -------------------------------------------------------------------------------------------------------------------
+    # write: This function ends the profiling and writes the profile into a JSON file. With the cProfile mode, the
+    #        statistics are saved next to it (.pstats) with a text summary of the 40 most expensive functions (.txt).
+    # Inputs: path of the JSON file, settings of the run written with the profile
+    # Output: dictionary written to the file
+    # -------------------------------------------------------------------------------------------------------------------
+
+    def write(self, file_name, **settings):
+        self.stop()
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            base_name = file_name.rsplit(".", 1)[0]
+            self.cprofile.dump_stats(f"{base_name}.pstats")
+            with open(f"{base_name}_cprofile.txt", "w") as file:
+                pstats.Stats(self.cprofile, stream=file).sort_stats("cumulative").print_stats(40)
+
+        profile = {'settings': settings,
+                   'mode': self.mode,
+                   'python': platform.python_version(),
+                   'wall_s': time.perf_counter() - self.start_wall,
+                   'cpu_s': time.process_time() - self.start_cpu,
+                   'peak_memory_mb': peak_memory(),
+                   'stages': self.stages,
+                   'c_stages': c_profile(self.clibrary) if self.clibrary is not None else []}
+        with open(file_name, "w") as file:
+            json.dump(profile, file, indent=2)
+        return profile
@@ -0,0 +1,253 @@
+import numpy as np
+import ctypes
+import collections
+import json
+import io
+import os
+import socket
+import socketserver
+from Functions.h_structures import *
+from Functions.e_filter_trees import *
+from Functions.f_numpy_model import *
+from Functions.i_cache import *
+from Functions.j_scenarios import scenario_totals
+from Functions.l_tiles import anchored_cells, declare_tile_functions
+
+# ------------------------------------------------------------------------------------------------------------------------
+# This file contains the session, which keeps the filtered trees in memory to answer many requests (concentrations,
+# gridsize, bounding box) without starting the program again. The shared library is loaded once, and the CSV file is read
+# and filtered once (or loaded from the cache). As in j_scenarios.py, the model is applied with unit concentrations and
+# the grids of any (C_PM10, C_O3) are obtained by scaling: the unit grids of the last gridsize and bounding box pairs are
+# kept, so a request with new concentrations only costs a multiplication of the grids, and a new gridsize or bounding box
+# costs one pass of the model over the trees. The grid cells are counted from the LV95 origin, like in the tiled mode (see
+# l_tiles.py), so the grids of different bounding boxes line up.
+# The session can also be served on localhost or on a Unix socket (see serve and SessionClient): every request is one JSON
+# line, answered by one JSON line with the totals, followed by the grids as a .npy array when they are asked for.
+# ------------------------------------------------------------------------------------------------------------------------
+
+# Largest number of cells of the grids of a request: the four grids of 2^25 cells need 1 GiB
+MAX_CELLS = 2**25
+
+class Session:
+
+    # -------------------------------------------------------------------------------------------------------------------
+    # __init__: This function loads the shared library and reads and filters the trees once.
+    # Inputs: path of the CSV file of the trees, four file paths of the scientific parameters, amount of trees read,
+    #         backend ("C" or "numpy"), path of the shared library, number of threads used by C (0 for all cores),
+    #         optional cache directory (see i_cache.py), number of unit grids kept in memory, precision of the crown sizes
+    #         and scientific parameters kept for the trees ("double" or "single", see set_precision), largest number of
+    #         cells of the grids of a request
+    # -------------------------------------------------------------------------------------------------------------------
+
+    def __init__(self, file_name, conversion_factor, EF, shading_coeff, MIR, nr_lines, backend="C", library=None, threads=0, cache_directory=None, memory=16, precision="double", max_cells=MAX_CELLS):
+        self.backend = backend
+        self.max_cells = max_cells
+        self.clibrary = None
+        self.threads = threads
+        if backend == "C":
+            self.clibrary = ctypes.CDLL(library)
+            declare_tile_functions(self.clibrary)
+            self.threads = self.clibrary.set_threads(threads)
+
+        cache = None
+        if cache_directory is not None:
+            key = cache_key([file_name, conversion_factor, EF, shading_coeff, MIR], nr_lines, precision, backend, directory=cache_directory)
+            cache = load_cache(cache_directory, key)
+        if cache is not None:
+            filtered_columns, self.genus_report = cache
+        else:
+            if backend == "C":
+                columns = get_tree_columns(nr_lines, outputs=False)
+                read_tree_columns(self.clibrary, file_name, columns)
+            else:
+                columns = tree_array_to_columns(*main_function1_numpy(file_name, nr_lines), outputs=False)
+            self.genus_report = {}
+            filtered_columns = filter_tree_columns(columns, conversion_factor, EF, shading_coeff, MIR, self.genus_report, precision)
+            del columns
+            if cache_directory is not None:
+                save_cache(cache_directory, key, filtered_columns, self.genus_report)
+
+        # The columns of the cache are memory-mapped: they are copied so that every request works on memory
+        self.columns = {name: np.array(column) for name, column in filtered_columns.items()}
+        self.size = len(self.columns['crown_height'])
+        self.memory = memory
+        self.unit = collections.OrderedDict()
+
+    # -------------------------------------------------------------------------------------------------------------------
+    # unit_grids: This function returns the grids of the trees in a bounding box with unit concentrations, computing them
+    #             only if they are not kept in memory. The least recently used grids are dropped beyond self.memory.
+    #             Grids of more than self.max_cells cells are refused with a ValueError, and a MemoryError is raised if
+    #             the grids cannot be allocated.
+    # Inputs: gridsize, bounding box (x_min, y_min, x_max, y_max) in LV95 coordinates or None for all the trees
+    # Outputs: dictionary with grid_OFP (kg/y), grid_PM10 and grid_O3 (kg/y per ug/m3), LV95 coordinates (x, y) of the
+    #          southwestern corner of the grid, amount of trees
+    # -------------------------------------------------------------------------------------------------------------------
+
+    def unit_grids(self, gridsize, bbox=None):
+        gridsize = int(gridsize)
+        if gridsize <= 0:
+            raise ValueError("The gridsize needs to be positive")
+        if bbox is not None:
+            bbox = tuple(float(value) for value in bbox)
+            if len(bbox) != 4 or bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+                raise ValueError("The bounding box needs to be (x_min, y_min, x_max, y_max)")
+        key = (gridsize, bbox)
+        if key in self.unit:
+            self.unit.move_to_end(key)
+            return self.unit[key]
+
+        columns = self.columns
+        if bbox is None:
+            y_min, y_max = columns['position_y'].min(), columns['position_y'].max()
+            x_min, x_max = columns['position_x'].min(), columns['position_x'].max()
+        else:
+            x_min, y_min, x_max, y_max = bbox
+            x, y = columns['position_x'], columns['position_y']
+            columns = select_tree_columns(columns, (x >= x_min) & (x <= x_max) & (y >= y_min) & (y <= y_max))
+
+        # The grid covers the bounding box, even where it has no trees
+        first_row, first_column = int(anchored_cells(y_min, gridsize)), int(anchored_cells(x_min, gridsize))
+        length_y = int(anchored_cells(y_max, gridsize)) + 1 - first_row
+        length_x = int(anchored_cells(x_max, gridsize)) + 1 - first_column
+        if length_y * length_x > self.max_cells:
+            raise ValueError(f"The grid of {length_y} x {length_x} cells is larger than the limit of {self.max_cells} cells: use a smaller bounding box or a larger gridsize")
+
+        if self.clibrary is None:
+            grids = main_function2_tile_numpy(dict(columns), first_row, first_column, length_y, length_x, 1.0, 1.0, gridsize)
+        else:
+            pointers = [ctypes.POINTER(ctypes.POINTER(ctypes.c_double))() for k in range(4)]
+            if self.clibrary.main_function2_tile(ctypes.byref(c_tree_columns(columns)), *[ctypes.byref(pointer) for pointer in pointers],
+                                                 first_row, first_column, length_y, length_x, 1.0, 1.0, gridsize) != 0:
+                raise MemoryError(f"The grids of {length_y} x {length_x} cells could not be allocated")
+            grids = [c_pp_to_np(length_y, length_x, pointer, self.clibrary.free_grid) for pointer in pointers]
+
+        self.unit[key] = {'grids': tuple(grids[:3]), 'origin': (first_column * gridsize, first_row * gridsize), 'trees': len(columns['crown_height'])}
+        if len(self.unit) > self.memory:
+            self.unit.popitem(last=False)
+        return self.unit[key]
+
+    # -------------------------------------------------------------------------------------------------------------------
+    # grids: This function returns the grids of the trees in a bounding box for some concentrations.
+    # Inputs: concentration of PM10 and O3, gridsize, optional bounding box (x_min, y_min, x_max, y_max) in LV95
+    # Outputs: grid_OFP, grid_PM10, grid_O3, grid_O3_net_uptake as 2D NumPy arrays (kg/y), LV95 coordinates (x, y) of the
+    #          southwestern corner of the grid. grid_OFP does not depend on the concentrations and is read-only.
+    # -------------------------------------------------------------------------------------------------------------------
+
+    def grids(self, C_PM10, C_O3, gridsize, bbox=None):
+        unit = self.unit_grids(gridsize, bbox)
+        grid_OFP, grid_PM10, grid_O3 = unit['grids']
+        grid_O3 = C_O3 * grid_O3
+        grid_OFP = grid_OFP.view()
+        grid_OFP.flags.writeable = False
+        return grid_OFP, C_PM10 * grid_PM10, grid_O3, grid_O3 - grid_OFP, unit['origin']
+
+    # -------------------------------------------------------------------------------------------------------------------
+    # totals: This function returns the totals of the trees in a bounding box for some concentrations, without any grid.
+    # Inputs: concentration of PM10 and O3, gridsize, optional bounding box (x_min, y_min, x_max, y_max) in LV95
+    # Outputs: amount of trees, total OFP, PM10, O3 removed mass and O3 net uptake (kg/y)
+    # -------------------------------------------------------------------------------------------------------------------
+
+    def totals(self, C_PM10, C_O3, gridsize, bbox=None):
+        unit = self.unit_grids(gridsize, bbox)
+        return (unit['trees'], *[float(total) for total in scenario_totals(unit['grids'], [(C_PM10, C_O3)])[0, 2:]])
+
+    # -------------------------------------------------------------------------------------------------------------------
+    # answer: This function answers one request of the server.
+    # Input: dictionary with C_PM10, C_O3, gridsize and optionally bbox and grids (whether the grids are returned)
+    # Outputs: dictionary of the answer (totals, origin and shape of the grid), 3D NumPy array with the four grids or None
+    # -------------------------------------------------------------------------------------------------------------------
+
+    def answer(self, request):
+        C_PM10, C_O3, gridsize, bbox = float(request['C_PM10']), float(request['C_O3']), request['gridsize'], request.get('bbox')
+        trees, OFP_tot, PM10_tot, O3_tot, O3_net_uptake_tot = self.totals(C_PM10, C_O3, gridsize, bbox)
+        unit = self.unit_grids(gridsize, bbox)
+        answer = {'trees': trees, 'OFP': OFP_tot, 'PM10': PM10_tot, 'O3': O3_tot, 'O3_net_uptake': O3_net_uptake_tot,
+                  'origin': list(unit['origin']), 'shape': list(unit['grids'][0].shape)}
+        if not request.get('grids', False):
+            return answer, None
+        return answer, np.stack(self.grids(C_PM10, C_O3, gridsize, bbox)[:4])
+
+# ------------------------------------------------------------------------------------------------------------------------
+# SessionHandler: This class answers the requests of one connection, one JSON line after the other, until the client
+#                 closes it. Errors in a request are answered with {"error": message} and do not close the connection.
+# ------------------------------------------------------------------------------------------------------------------------
+
+class SessionHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                answer, grids = self.server.session.answer(json.loads(line))
+            except (ValueError, KeyError, TypeError, MemoryError) as error:
+                answer, grids = {'error': str(error)}, None
+            data = b""
+            if grids is not None:
+                buffer = io.BytesIO()
+                np.save(buffer, grids)
+                data = buffer.getvalue()
+            answer['bytes'] = len(data)
+            self.wfile.write(json.dumps(answer).encode() + b"\n" + data)
+            self.wfile.flush()
+
+# ---------------------------------------------------------------------------------------------------------------------------
+# serve: This function serves a session until the process is stopped. The requests are answered one after the other, since
+#        C already uses all the cores for each of them.
+# Inputs: Session, address: (host, port) for TCP (e.g. ("localhost", 8765)) or the path of a Unix socket
+# Output: None
+# ---------------------------------------------------------------------------------------------------------------------------
+
+def serve(session, address):
+    if isinstance(address, str):
+        server_class = socketserver.UnixStreamServer
+        if os.path.exists(address):
+            os.remove(address)
+    else:
+        server_class = socketserver.TCPServer
+        server_class.allow_reuse_address = True
+    with server_class(address, SessionHandler) as server:
+        server.session = session
+        print(f"Serving {session.size} trees on {address}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    if isinstance(address, str) and os.path.exists(address):
+        os.remove(address)
+
+class SessionClient:
+
+    # -------------------------------------------------------------------------------------------------------------------
+    # __init__: This function connects to a served session; the connection is kept for all the requests.
+    # Input: address of the server (see serve)
+    # -------------------------------------------------------------------------------------------------------------------
+
+    def __init__(self, address):
+        family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+        self.connection = socket.socket(family, socket.SOCK_STREAM)
+        self.connection.connect(address)
+        self.file = self.connection.makefile("rwb")
+
+    # -------------------------------------------------------------------------------------------------------------------
+    # request: This function sends one request and waits for its answer.
+    # Inputs: concentration of PM10 and O3, gridsize, optional bounding box (x_min, y_min, x_max, y_max) in LV95,
+    #         whether the grids are returned
+    # Output: dictionary with the amount of trees, the totals (kg/y), the origin and shape of the grid, and the four
+    #         grids (OFP, PM10, O3, O3 net uptake) as a 3D NumPy array under 'grids' when they are asked for
+    # -------------------------------------------------------------------------------------------------------------------
+
+    def request(self, C_PM10, C_O3, gridsize, bbox=None, grids=False):
+        request = {'C_PM10': C_PM10, 'C_O3': C_O3, 'gridsize': gridsize, 'bbox': None if bbox is None else list(bbox), 'grids': grids}
+        self.file.write(json.dumps(request).encode() + b"\n")
+        self.file.flush()
+        answer = json.loads(self.file.readline())
+        if 'error' in answer:
+            raise ValueError(answer['error'])
+        if answer['bytes'] > 0:
+            answer['grids'] = np.load(io.BytesIO(self.file.read(answer['bytes'])))
+        return answer
+
+    def close(self):
+        self.file.close()
+        self.connection.close()
@@ -0,0 +1,123 @@
+import numpy as np
+import json
+import os
+import concurrent.futures
+from matplotlib.figure import Figure
+from matplotlib.colors import SymLogNorm
+from Functions.n_sparse_grids import *
+
+# ------------------------------------------------------------------------------------------------------------------------
+# This file contains the outputs of the grids. The four maps are rendered in separate processes, each one drawing on its
+# own matplotlib Figure (without pyplot and its global state, and without any window). The grids themselves can be saved
+# as rasters: one .npy file per grid, which can be opened as a memory-mapped array, and one JSON header with their
+# georeference in LV95 (EPSG:2056). The rows of the rasters go from north to south, as usual in GIS, so the geotransform
+# is the one of GDAL: x = x_0 + column * gridsize, y = y_0 - row * gridsize for the northwestern corner of a cell.
+# ------------------------------------------------------------------------------------------------------------------------
+
+# Names of the grids, in the order of the outputs of the program
+GRID_NAMES = ['OFP', 'PM10', 'O3', 'O3_net_uptake']
+
+# Settings of the map of each grid (the net uptake is mostly negative, so its colors go from its minimum to 0)
+MAPS = {'OFP': {'title': "Yearly Ozone Forming Potential (OFP) (kg/y)\n - grid based on indices", 'cmap': "YlGnBu", 'linthresh': 10,
+                'label': "OFP_yearly values", 'ticks': [100, 200, 300, 800], 'axes': ("x-index", "y-index"), 'file': "OFP_map"},
+        'PM10': {'title': "Yearly PM10 Deposition (kg/y)\n - grid based on indices", 'cmap': "YlGnBu", 'linthresh': 1,
+                 'label': "PM10_yearly values", 'ticks': [1, 2, 3, 4, 5], 'axes': ("x index", "y index"), 'file': "PM10_map"},
+        'O3': {'title': "Yearly amount of O3 absorbed (kg/y)\n - grid based on indices", 'cmap': "YlGnBu", 'linthresh': 2,
+               'label': "O3_removed_mass values", 'ticks': [1, 2, 3, 4, 5, 6, 7, 8], 'axes': ("x index", "y index"), 'file': "O3_map"},
+        'O3_net_uptake': {'title': "Yearly net amount of O3 absorbed (kg/y)\n - grid based on indices", 'cmap': "afmhot", 'linthresh': 10,
+                          'label': "O3_net_removed_mass values", 'ticks': [-100, -200, -300, -400, -600, -800], 'axes': ("x index", "y index"),
+                          'file': "O3_net_uptake_map"}}
+
+# ---------------------------------------------------------------------------------------------------------------------------
+# render_map: This function draws the map of one grid and saves it as a PNG file. It is called in the processes of the pool.
+# Inputs: name of the grid (see MAPS), image of the grid (see grid_image), extent of the axes in cell indices (None for the
+#         image itself), filepath
+# Output: filepath
+# ---------------------------------------------------------------------------------------------------------------------------
+
+def render_map(name, image, extent, file_name):
+    settings = MAPS[name]
+    if name == 'O3_net_uptake':
+        norm = SymLogNorm(linthresh=settings['linthresh'], vmin=image.min(), vmax=0)
+    else:
+        norm = SymLogNorm(linthresh=settings['linthresh'], vmin=0, vmax=image.max())     # log scale for the colors, not the values
+
+    figure = Figure()
+    axes = figure.subplots()
+    plot = axes.imshow(image, origin='lower', extent=extent, cmap=settings['cmap'], interpolation='nearest', norm=norm)
+    axes.set_title(settings['title'])
+    axes.set_xlabel(settings['axes'][0])
+    axes.set_ylabel(settings['axes'][1])
+    cbar = figure.colorbar(plot, ax=axes, label=settings['label'], ticks=settings['ticks'])
+    cbar.ax.set_yticklabels([str(tick) for tick in settings['ticks']])
+    figure.savefig(file_name)
+    return file_name
+
+# ---------------------------------------------------------------------------------------------------------------------------
+# render_maps: This function renders the maps of the four grids at once. Sparse grids larger than 4000 x 4000 cells are first
+#              summed by blocks of cells (see grid_image), so that only small images are sent to the processes.
+# Inputs: grid_OFP, grid_PM10, grid_O3, grid_O3_net_uptake (dense or sparse), amount of trees (part of the file names),
+#         directory, number of processes (None for one per map, at most one per core; 1 renders them in this process)
+# Output: list of filepaths
+# ---------------------------------------------------------------------------------------------------------------------------
+
+def render_maps(grids, nr_lines, directory="Results", processes=None):
+    jobs = []
+    for name, grid in zip(GRID_NAMES, grids):
+        image, factor = grid_image(grid)
+        extent = None if factor == 1 else (-0.5, image.shape[1] * factor - 0.5, -0.5, image.shape[0] * factor - 0.5)     # axes in cell indices
+        jobs.append((name, image, extent, os.path.join(directory, f"{MAPS[name]['file']}_{nr_lines}_indices.png")))
+
+    if processes is None:
+        processes = min(len(jobs), os.cpu_count())
+    if processes <= 1:
+        return [render_map(*job) for job in jobs]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as pool:
+        return list(pool.map(render_map, *zip(*jobs)))
+
+# ---------------------------------------------------------------------------------------------------------------------------
+# write_rasters: This function saves the four grids as rasters, rows from north to south, with a JSON header. Sparse grids
+#                are written cell by cell into a memory-mapped file, so that the dense grid is never in memory.
+# Inputs: grid_OFP, grid_PM10, grid_O3, grid_O3_net_uptake (dense or sparse), LV95 coordinates (x, y) of the southwestern
+#         corner of the grid, gridsize, directory, optional dictionary of settings written into the header
+# Output: dictionary of the header (also saved to grids.json in the directory)
+# ---------------------------------------------------------------------------------------------------------------------------
+
+def write_rasters(grids, origin, gridsize, directory, settings=None):
+    os.makedirs(directory, exist_ok=True)
+    length_y, length_x = grid_shape(grids[0])
+    files = {}
+    for name, grid in zip(GRID_NAMES, grids):
+        files[name] = f"{name}.npy"
+        file_name = os.path.join(directory, files[name])
+        if is_sparse(grid):
+            raster = np.lib.format.open_memmap(file_name, mode='w+', dtype=np.float64, shape=(length_y, length_x))
+            rows, cols = np.divmod(grid['cells'], length_x)
+            raster[length_y - 1 - rows, cols] = grid['values']
+            raster.flush()
+            del raster
+        else:
+            np.save(file_name, np.ascontiguousarray(grid[::-1]))
+
+    header = {'crs': "EPSG:2056",
+              'geotransform': [float(origin[0]), float(gridsize), 0.0, float(origin[1]) + length_y * gridsize, 0.0, -float(gridsize)],
+              'shape': [length_y, length_x],
+              'dtype': "float64",
+              'units': "kg/y",
+              'rows': "north to south",
+              'grids': files,
+              'settings': settings or {}}
+    with open(os.path.join(directory, "grids.json"), "w") as file:
+        json.dump(header, file, indent=2)
+    return header
+
+# ---------------------------------------------------------------------------------------------------------------------------
+# load_raster: This function opens a raster saved by write_rasters as a read-only memory-mapped array.
+# Inputs: directory, name of the grid (see GRID_NAMES)
+# Outputs: 2D NumPy array (rows from north to south), header (see write_rasters)
+# ---------------------------------------------------------------------------------------------------------------------------
+
+def load_raster(directory, name):
+    with open(os.path.join(directory, "grids.json"), "r") as file:
+        header = json.load(file)
+    return np.load(os.path.join(directory, header['grids'][name]), mmap_mode='r'), header
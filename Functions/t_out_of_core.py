@@ -0,0 +1,166 @@
+import numpy as np
+import math
+import ctypes
+import os
+import shutil
+from Functions.h_structures import *
+from Functions.e_filter_trees import *
+
+# ------------------------------------------------------------------------------------------------------------------------
+# This file contains the out-of-core mode of the program, for inventories that do not fit in memory. The columns of the
+# trees are binary .npy files on a local disk, opened as memory-mapped arrays: C reads the CSV file directly into them,
+# and the filtering and the calculations walk through them in blocks of a fixed amount of trees, so only the pages of the
+# current block need to be in memory and the operating system writes them back to their file instead of swapping. Grids
+# that are larger than a given amount of memory are memory-mapped files as well. The trees are added to the grids in the
+# same order as in the main run, so the grids are the same, bit for bit.
+# ------------------------------------------------------------------------------------------------------------------------
+
+# ---------------------------------------------------------------------------------------------
+# declare_out_of_core_functions: This function defines the C functions used in this file.
+# Input: shared library
+# Output: None
+# ---------------------------------------------------------------------------------------------
+
+def declare_out_of_core_functions(clibrary):
+    clibrary.add_columns_to_grids.argtypes = [ctypes.POINTER(TreeColumns), ctypes.c_double, ctypes.c_double, ctypes.c_int, ctypes.c_int] + [ctypes.POINTER(ctypes.POINTER(ctypes.c_double))] * 4 + [ctypes.c_double, ctypes.c_double, ctypes.c_int]
+    clibrary.add_columns_to_grids.restype = None
+    clibrary.convert_grids.argtypes = [ctypes.c_int, ctypes.c_int] + [ctypes.POINTER(ctypes.POINTER(ctypes.c_double))] * 4
+    clibrary.convert_grids.restype = None
+
+# ---------------------------------------------------------------------------------------------------------------------
+# open_tree_columns: This function creates the input columns for a given amount of trees as memory-mapped .npy files,
+#                    filled with zeros, in a directory that is emptied first. They are used like the columns allocated
+#                    by get_tree_columns (e.g. by read_tree_columns).
+# Input: directory, amount of trees
+# Output: dictionary of memory-mapped NumPy arrays
+# ---------------------------------------------------------------------------------------------------------------------
+
+def open_tree_columns(directory, size):
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory, exist_ok=True)
+    columns = {name: np.lib.format.open_memmap(os.path.join(directory, f"{name}.npy"), mode='w+', dtype=dtype, shape=(size,) + shape)
+               for name, dtype, shape in input_columns}
+    columns['max_incremental_reactivity'] = np.zeros(3)
+    return columns
+
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+# filter_tree_columns_out_of_core: This function does the same as filter_tree_columns, block by block, and writes the columns of the filtered trees to memory-
+#                                  mapped .npy files in a directory that is emptied first. A first pass over the species codes counts the filtered trees,
+#                                  and a second pass copies them with the scientific parameters of their genus (see genus_filter).
+# Inputs: dictionary of columns, four file paths, directory, amount of trees per block, optional dictionary filled with the amount of trees kept and dropped
+#         for each genus, precision ("double" or "single")
+# Outputs: dictionary of memory-mapped columns of the filtered trees
+# --------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+def filter_tree_columns_out_of_core(columns, conversion_factor, EF, shading_coeff, MIR, directory, block_size, report=None, precision="double"):
+    dic_conversion_factor, dic_EF, dic_shading_coefficient, dic_MIR = read_parameters(conversion_factor, EF, shading_coeff, MIR)
+    genera = genus_names(columns)
+    known, parameters = genus_parameters(genera, dic_conversion_factor, dic_EF, dic_shading_coefficient)
+    max_incremental_reactivity = np.array([dic_MIR['isoprene'], dic_MIR['monoterpenes'], dic_MIR['sesquiterpenes']])
+    dtype = precision_dtypes[precision]
+    for name in ['conversion_factor', 'mass_emission_factor', 'shading_factor']:
+        parameters[name] = parameters[name].astype(dtype)
+    size = len(columns['crown_height'])
+    blocks = [slice(start, min(start + block_size, size)) for start in range(0, size, block_size)]
+
+    # First pass: amount of trees of each genus
+    genus_count = np.zeros(len(genera), dtype=np.int64)
+    for block in blocks:
+        genus_count += np.bincount(columns['species_genus'][columns['species_code'][block]], minlength=len(genera))
+    if report is not None:
+        for genus, count, kept in zip(genera, genus_count, known):
+            if count > 0:
+                previous = report.get(genus, (0, 0))
+                report[genus] = (previous[0] + int(count), previous[1]) if kept else (previous[0], previous[1] + int(count))
+
+    # Second pass: copy of the filtered trees and their parameters, in the order of the columns
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory, exist_ok=True)
+    size_filtered = int(genus_count[known].sum())
+    filtered_columns = {}
+    for name, column in columns.items():
+        if name in shared_columns:
+            filtered_columns[name] = max_incremental_reactivity if name == 'max_incremental_reactivity' else column
+        else:
+            filtered_columns[name] = np.lib.format.open_memmap(os.path.join(directory, f"{name}.npy"), mode='w+', shape=(size_filtered,) + column.shape[1:],
+                                                               dtype=dtype if name in single_columns else column.dtype)
+    position = 0
+    for block in blocks:
+        codes = columns['species_genus'][columns['species_code'][block]]
+        mask = known[codes]
+        kept = int(mask.sum())
+        for name, column in filtered_columns.items():
+            if name in shared_columns:
+                continue
+            if name in parameters:
+                column[position:position + kept] = parameters[name][codes[mask]]
+            else:
+                column[position:position + kept] = columns[name][block][mask]
+        position += kept
+    for name, column in filtered_columns.items():
+        if name not in shared_columns:
+            column.flush()
+    return filtered_columns
+
+# ---------------------------------------------------------------------------------------------------------------------
+# open_grids: This function creates four grids filled with zeros, in memory if they need at most grid_memory bytes
+#             together and as memory-mapped .npy files in a directory otherwise.
+# Inputs: directory, distances of grid in y and x direction, amount of bytes of memory that the grids may use
+# Output: list of four 2D NumPy arrays
+# ---------------------------------------------------------------------------------------------------------------------
+
+def open_grids(directory, length_y, length_x, grid_memory):
+    if 4 * length_y * length_x * np.dtype(np.float64).itemsize <= grid_memory:
+        return [np.zeros((length_y, length_x)) for k in range(4)]
+    print("The grids are stored on the disk")
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory, exist_ok=True)
+    return [np.lib.format.open_memmap(os.path.join(directory, f"{name}.npy"), mode='w+', dtype=np.float64, shape=(length_y, length_x))
+            for name in ['OFP', 'PM10', 'O3', 'O3_net_uptake']]
+
+# ---------------------------------------------------------------------------------------------------------------------
+# c_grid_rows: This function creates the pointers to the rows of a contiguous 2D NumPy array, so that C can use it like
+#              a grid allocated by get_gridarray. The array of pointers needs to be kept alive while C uses it.
+# Input: 2D NumPy array
+# Output: NumPy array of the addresses of the rows, POINTER(POINTER(ctypes.c_double)) to it
+# ---------------------------------------------------------------------------------------------------------------------
+
+def c_grid_rows(grid):
+    if not grid.flags['C_CONTIGUOUS'] or grid.dtype != np.float64:
+        raise ValueError("The grid needs to be a contiguous array of doubles")
+    rows = grid.ctypes.data + np.arange(grid.shape[0], dtype=np.uintp) * np.uintp(grid.strides[0])
+    return rows, rows.ctypes.data_as(ctypes.POINTER(ctypes.POINTER(ctypes.c_double)))
+
+# ---------------------------------------------------------------------------------------------------------------------------------
+# main_function2_out_of_core: This function calculates the values across the grid like main_function2_columns, but reads the
+#                             columns of filtered trees block by block: a first pass finds the extent of the grid, and the second
+#                             one adds the trees of every block to the grids with C.
+# Inputs: shared library, dictionary of columns of filtered trees, concentration of PM10 and O3, gridsize, amount of trees per
+#         block, directory of the grids, amount of bytes of memory that the grids may use
+# Outputs: grid_OFP, grid_PM10, grid_O3, grid_O3_net_uptake as 2D NumPy arrays (kg/y)
+# ---------------------------------------------------------------------------------------------------------------------------------
+
+def main_function2_out_of_core(clibrary, filtered_columns, C_PM10, C_O3, gridsize, block_size, directory, grid_memory):
+    declare_out_of_core_functions(clibrary)
+    size = len(filtered_columns['crown_height'])
+    blocks = [slice(start, min(start + block_size, size)) for start in range(0, size, block_size)]
+
+    # First pass: the origin of the grid is the most southwestern point
+    min_x, max_x, min_y, max_y = math.inf, -math.inf, math.inf, -math.inf
+    for block in blocks:
+        min_x, max_x = min(min_x, filtered_columns['position_x'][block].min()), max(max_x, filtered_columns['position_x'][block].max())
+        min_y, max_y = min(min_y, filtered_columns['position_y'][block].min()), max(max_y, filtered_columns['position_y'][block].max())
+    length_y = max(int(math.ceil((max_y - min_y) / gridsize)), 1)
+    length_x = max(int(math.ceil((max_x - min_x) / gridsize)), 1)
+    print(f"These are the lengths of our grid: {length_y}, {length_x}")
+    grids = open_grids(directory, length_y, length_x, grid_memory)
+    rows = [c_grid_rows(grid) for grid in grids]
+    c_grids = [c_rows for addresses, c_rows in rows]
+
+    # Second pass: the trees are added block by block, in the order of the columns
+    for block in blocks:
+        clibrary.add_columns_to_grids(ctypes.byref(c_tree_columns(select_tree_columns(filtered_columns, block))), min_x, min_y, length_y, length_x,
+                                      *c_grids, C_PM10, C_O3, gridsize)
+    clibrary.convert_grids(length_y, length_x, *c_grids)
+    print("Calculations are done")
+    return grids
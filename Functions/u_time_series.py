@@ -0,0 +1,225 @@
+import numpy as np
+import math
+import zipfile
+from Functions.h_structures import *
+from Functions.f_numpy_model import *
+from Functions.j_scenarios import *
+
+# ------------------------------------------------------------------------------------------------------------------------
+# This file contains the time-series mode, which replaces the constants of the yearly model (annual concentrations, 183 or
+# 365 days of leaves, photoperiod of P = 12 h) by hourly concentrations, a leaf-on calendar for each type of leaves and
+# the length of the days, and gives one grid per month or per day. The results of a tree are proportional to its number
+# of leaf-on days and to the concentrations, so the model is applied only once for each type of leaves, with one leaf-on
+# day and unit concentrations (see unit_grids). The hours are then reduced to one weight per period and type of leaves:
+#   OFP:   sum over the hours of the period of leaves / 24
+#   PM10:  sum of leaves * C_PM10 / 24
+#   O3:    sum of leaves * daylight * C_O3 / P      (the stomata only take up O3 during the day)
+# and the grids of every period are sums of the grids of the types of leaves scaled by these weights, computed one period
+# at a time while they are written. The cost is one pass over the trees per type of leaves, whatever the number of hours
+# and periods. With constant concentrations, the default calendar and the photoperiod of the model, the sum of the periods
+# of a year of 365 days is the yearly grid.
+# ------------------------------------------------------------------------------------------------------------------------
+
+# Types of leaves: number of leaf-on days given to the trees while the CSV file is read (see main_function1_numpy)
+leaf_types = {'broadleaves': LEAVE_DAYS_BROADLEAVES, 'evergreens': LEAVE_DAYS_EVERGREENS}
+
+# Default leaf-on months of the broadleaves: April to September, 183 days like LEAVE_DAYS_BROADLEAVES
+BROADLEAVES_MONTHS = range(4, 10)
+
+# ---------------------------------------------------------------------------------------------------------------------
+# read_hourly_concentrations: This function reads a semicolon-delimited file with the hourly concentrations of PM10 and
+#                             O3 (columns Time;PM10;O3 in ug/m3, one row per hour, e.g. 2023-01-01 00:00;21.3;35.0).
+#                             Missing values (empty or "None") are replaced by the mean of their column.
+# Input: filepath of CSV file
+# Outputs: start of every hour (datetime64[h]), concentrations of PM10 and O3, number of missing values replaced
+# ---------------------------------------------------------------------------------------------------------------------
+
+def read_hourly_concentrations(file_name):
+    times, values = [], []
+    with open(file_name, "r") as file:
+        file.readline()                                           # skip the header
+        for line in file:
+            data = line.strip().split(";")
+            if len(data) < 3 or not data[0].strip():
+                continue
+            times.append(data[0].strip())
+            values.append([math.nan if value.strip() in ("", "None") else float(value) for value in data[1:3]])
+
+    times = np.array(times, dtype='datetime64[h]')
+    values = np.array(values, dtype=np.float64).reshape(-1, 2)
+    if len(times) == 0 or np.any(np.diff(times) != np.timedelta64(1, 'h')):
+        raise ValueError(f"{file_name} needs one row per hour, in order and without gaps")
+    missing = np.isnan(values)
+    for k in range(2):
+        if missing[:, k].all():
+            raise ValueError(f"{file_name} has no value of {['PM10', 'O3'][k]}")
+        values[missing[:, k], k] = values[~missing[:, k], k].mean()
+    return times, values[:, 0], values[:, 1], int(missing.sum())
+
+# ---------------------------------------------------------------------------------------------------------------------
+# leaf_fractions: This function gives the fraction of the leaves that are out (0 to 1) for every hour and type of leaves.
+#                 The calendar is a semicolon-delimited file with one row per day of the year (columns Day;broadleaves;
+#                 evergreens, with the day as MM-DD); a missing 02-29 takes the values of 02-28. Without a calendar, the
+#                 broadleaves have their leaves from April to September and the evergreens all year.
+# Input: start of every hour, optional filepath of the calendar
+# Output: dictionary with one array of fractions per type of leaves
+# ---------------------------------------------------------------------------------------------------------------------
+
+def leaf_fractions(times, file_name=None):
+    months = times.astype('datetime64[M]').astype(np.int64) % 12 + 1
+    if file_name is None:
+        return {'broadleaves': np.isin(months, BROADLEAVES_MONTHS).astype(np.float64), 'evergreens': np.ones(len(times))}
+
+    calendar = {}
+    with open(file_name, "r") as file:
+        header = [name.strip() for name in file.readline().strip().split(";")]
+        for line in file:
+            data = line.strip().split(";")
+            if len(data) < len(header) or not data[0].strip():
+                continue
+            calendar[data[0].strip()] = {name: float(value) for name, value in zip(header[1:], data[1:])}
+    if "02-28" in calendar:
+        calendar.setdefault("02-29", calendar["02-28"])
+
+    days = np.array([str(day)[5:10] for day in times.astype('datetime64[D]')])
+    fractions = {}
+    for leaf_type in leaf_types:
+        if leaf_type not in header:
+            raise ValueError(f"{file_name} needs a column {leaf_type}")
+        values = {day: row[leaf_type] for day, row in calendar.items() if leaf_type in row}
+        missing = set(days) - set(values)
+        if missing:
+            raise ValueError(f"{file_name} has no value of {leaf_type} for the days {', '.join(sorted(missing))}")
+        fractions[leaf_type] = np.clip(np.array([values[day] for day in days]), 0.0, 1.0)
+    return fractions
+
+# ---------------------------------------------------------------------------------------------------------------------
+# daylight_fractions: This function gives the fraction of every hour during which the sun is up. Without latitude, the
+#                     day lasts P hours centered on noon, like in the model. With a latitude, the length of the day
+#                     N = 24 / pi * arccos(-tan(latitude) tan(declination)) follows the declination of the sun
+#                     (23.44 sin(2 pi (284 + day of the year) / 365) degrees), and the hours are in solar time.
+# Input: start of every hour, optional latitude in degrees
+# Output: array of fractions (0 to 1)
+# ---------------------------------------------------------------------------------------------------------------------
+
+def daylight_fractions(times, latitude=None):
+    hours = (times - times.astype('datetime64[D]')).astype(np.int64).astype(np.float64)
+    if latitude is None:
+        length = np.full(len(times), float(P))
+    else:
+        day_of_year = (times.astype('datetime64[D]') - times.astype('datetime64[Y]')).astype(np.int64) + 1
+        declination = np.radians(23.44) * np.sin(2 * np.pi * (284 + day_of_year) / 365)
+        length = 24 / np.pi * np.arccos(np.clip(-np.tan(np.radians(latitude)) * np.tan(declination), -1.0, 1.0))
+    sunrise, sunset = 12 - length / 2, 12 + length / 2
+    return np.clip(np.minimum(hours + 1, sunset) - np.maximum(hours, sunrise), 0.0, 1.0)
+
+# ---------------------------------------------------------------------------------------------------------------------
+# period_index: This function gives the index of the period (month or day) of every hour.
+# Input: start of every hour, period ("monthly" or "daily")
+# Outputs: index of the period of every hour, names of the periods (e.g. 2023-01 or 2023-01-01)
+# ---------------------------------------------------------------------------------------------------------------------
+
+def period_index(times, period):
+    if period not in ("monthly", "daily"):
+        raise ValueError("The period needs to be \"monthly\" or \"daily\"")
+    starts = times.astype('datetime64[M]' if period == "monthly" else 'datetime64[D]')
+    names, index = np.unique(starts, return_inverse=True)
+    return index.ravel(), np.datetime_as_string(names)
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# period_weights: This function reduces the hours to the weights of the unit grids of every period and type of leaves (see the
+#                 top of this file). The sums over the hours of each period are computed at once with np.bincount.
+# Inputs: index of the period of every hour, number of periods, concentrations of PM10 and O3, leaf fractions, daylight fractions
+# Outputs: dictionary with, for every type of leaves, an array of shape (periods, 3) of the weights of the OFP, PM10 and O3
+# -----------------------------------------------------------------------------------------------------------------------------
+
+def period_weights(index, periods, C_PM10, C_O3, leaves, daylight):
+    weights = {}
+    for leaf_type, fraction in leaves.items():
+        weights[leaf_type] = np.column_stack([np.bincount(index, weights=fraction, minlength=periods) / 24,
+                                              np.bincount(index, weights=fraction * C_PM10, minlength=periods) / 24,
+                                              np.bincount(index, weights=fraction * daylight * C_O3, minlength=periods) / P])
+    return weights
+
+# ---------------------------------------------------------------------------------------------------------------------------
+# leaf_type_grids: This function applies the model once for every type of leaves, to the trees of this type only, with one
+#                  leaf-on day and unit concentrations. All the trees stay in the columns (the others get 0 days), so the
+#                  grids have the same origin and lengths as the yearly grids.
+# Inputs: dictionary of columns of filtered trees, gridsize
+# Output: dictionary with the unit grids (grid_OFP, grid_PM10, grid_O3, see unit_grids) of every type of leaves
+# ---------------------------------------------------------------------------------------------------------------------------
+
+def leaf_type_grids(filtered_columns, gridsize):
+    grids = {}
+    for leaf_type, days in leaf_types.items():
+        columns = dict(filtered_columns)
+        columns['leaves_days'] = (np.asarray(filtered_columns['leaves_days']) == days).astype(np.int32)
+        grids[leaf_type] = unit_grids(columns, gridsize)
+    return grids
+
+# ---------------------------------------------------------------------------------------------------------------------
+# period_grid: This function computes the grid of one output for one period: the sum over the types of leaves of their
+#              unit grids scaled by their weights. The net O3 uptake is the O3 removed mass minus the OFP.
+# Inputs: unit grids and weights of every type of leaves (see leaf_type_grids and period_weights), index of the period,
+#         index of the output (0: OFP, 1: PM10, 2: O3 removed mass, 3: O3 net uptake)
+# Output: 2D NumPy array (kg)
+# ---------------------------------------------------------------------------------------------------------------------
+
+def period_grid(grids, weights, period, k):
+    if k == 3:
+        return period_grid(grids, weights, period, 2) - period_grid(grids, weights, period, 0)
+    return sum(weights[leaf_type][period, k] * grids[leaf_type][k] for leaf_type in leaf_types)
+
+# ---------------------------------------------------------------------------------------------------------------------------------
+# main_function_time_series: This function prepares the grids of every month or day of the hourly concentrations. Only the unit
+#                            grids of the types of leaves and their weights are kept: the grid of a period is computed when it is
+#                            written (see period_grid and write_time_series), so the memory does not depend on the number of periods.
+#                            The totals of every period come from the weights and the totals of the unit grids.
+# Inputs: dictionary of columns of filtered trees, filepath of the hourly concentrations, optional filepath of the leaf-on calendar,
+#         period ("monthly" or "daily"), optional latitude in degrees (see daylight_fractions), gridsize
+# Outputs: names of the periods, unit grids and weights of every type of leaves, totals (2D NumPy array with one row per period: OFP,
+#          PM10, O3 and net O3 uptake in kg), number of missing values replaced
+# ---------------------------------------------------------------------------------------------------------------------------------
+
+def main_function_time_series(filtered_columns, concentrations_file, calendar_file, period, latitude, gridsize):
+    times, C_PM10, C_O3, missing = read_hourly_concentrations(concentrations_file)
+    index, names = period_index(times, period)
+    weights = period_weights(index, len(names), C_PM10, C_O3, leaf_fractions(times, calendar_file), daylight_fractions(times, latitude))
+    print(f"Time series: {len(times)} hours, {len(names)} {period} periods")
+
+    grids = leaf_type_grids(filtered_columns, gridsize)
+    totals = np.column_stack([sum(weights[leaf_type][:, k] * np.sum(grids[leaf_type][k]) for leaf_type in leaf_types) for k in range(3)])
+    totals = np.column_stack([totals, totals[:, 2] - totals[:, 0]])
+    return names, grids, weights, totals, missing
+
+# ---------------------------------------------------------------------------------------------------------------------------
+# write_time_series: This function writes the totals of every period into a semicolon-delimited file and the sum over all
+#                    the periods into the summary file, and saves the grids into a .npz file (one 3D array per output, with
+#                    the names of the periods in "periods"). The arrays of the .npz file are written one period at a time,
+#                    so only the grid of one period is in memory.
+# Inputs: opened summary file, names of the periods, unit grids, weights, totals and number of missing values (see
+#         main_function_time_series), filepath of the CSV file, filepath of the .npz file
+# Output: None
+# ---------------------------------------------------------------------------------------------------------------------------
+
+def write_time_series(summary, names, grids, weights, totals, missing, csv_file, npz_file):
+    with open(csv_file, "w") as file:
+        file.write("Period;Total OFP (kg);Total PM10 absorbed (kg);Total ozone absorbed (kg);Total net ozone absorbed (kg)\n")
+        for name, row in zip(names, totals):
+            file.write(f"{name};" + ";".join(str(value) for value in row) + "\n")
+
+    summary.write(f"Time series: {len(names)} periods from {names[0]} to {names[-1]}, {missing} missing hourly values replaced by the mean\n")
+    for name, total in zip(['OFP', 'PM10 absorbed', 'ozone absorbed', 'net ozone absorbed(+)/emitted(-)'], totals.sum(axis=0)):
+        summary.write(f"    Total amount of {name} over the time series: {total} kg\n")
+
+    # Same layout as np.savez: one .npy member per array, without compression
+    shape = (len(names),) + grids[next(iter(leaf_types))][0].shape
+    header = {'descr': np.lib.format.dtype_to_descr(np.dtype(np.float64)), 'fortran_order': False, 'shape': shape}
+    with zipfile.ZipFile(npz_file, "w", allowZip64=True) as archive:
+        with archive.open("periods.npy", "w") as member:
+            np.lib.format.write_array(member, np.asarray(names))
+        for k, output in enumerate(['OFP', 'PM10', 'O3', 'O3_net_uptake']):
+            with archive.open(f"{output}.npy", "w", force_zip64=True) as member:
+                np.lib.format.write_array_header_2_0(member, header)
+                for period in range(len(names)):
+                    member.write(np.ascontiguousarray(period_grid(grids, weights, period, k), dtype=np.float64).tobytes())
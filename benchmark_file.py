@@ -0,0 +1,295 @@
+import numpy as np
+import ctypes
+import os
+import time
+import json
+import platform
+import subprocess
+import datetime
+import concurrent.futures
+import multiprocessing
+
+from Functions.h_structures import *
+from Functions.e_filter_trees import *
+from Functions.f_numpy_model import *
+from Functions.s_outputs import render_maps
+from Functions.q_profiling import *
+
+# ---------------------------------------------------------------------------------------------------
+# This file compares the run time of the two backends for the grid calculations: main_function2_columns
+# in C (shared library) and main_function2_numpy (Functions/f_numpy_model.py). Both are run on the same
+# synthetic arrays of filtered trees and their grids are compared. The results are written to
+# "Results/benchmark.txt". The shared library needs to be compiled first (see README).
+# It also times every stage of the whole program (reading the CSV file, columns, filtering, grid
+# calculations, wrapping of the grids and plots) on synthetic inventories in the layout of the CSV file
+# of the SITG. Every size runs in its own process to measure its peak memory, and the results are
+# appended to "Results/benchmark_history.jsonl" so that the runs of different versions can be compared.
+# ---------------------------------------------------------------------------------------------------
+
+path = os.getcwd()
+library_name = 'Functions/main.dll' if os.name == 'nt' else 'Functions/main.so'
+
+# ---------------------------------------------------------------------
+# Input: Fix constant values. These values can be changed by the user.
+# ---------------------------------------------------------------------
+
+C_PM10 = 15.2                             # Concentration of PM10
+C_O3 = 48.09                              # Concentration of Ozone
+gridsize = 100                            # Size of the fields over which we calculate the output
+SIZES = [10000, 100000, 1000000]          # Amounts of synthetic trees
+REPEATS = 3                               # The best of REPEATS runs is kept for each backend
+PIPELINE_SIZES = [10000, 100000, 1000000, 10000000]   # Amounts of trees of the synthetic inventories used to time the whole program; [] skips it
+THREADS = 0                               # Number of threads used by the C backend, 0 for all cores
+
+# Species of the synthetic inventories and their weights, close to the mix of the trees of Geneva. Some genera have no
+# scientific parameters (Aesculus, Taxus, Cedrus, ...) and are dropped by the filter, like in the real inventory.
+SPECIES_MIX = [("Platanus acerifolia", 10), ("Acer platanoides", 8), ("Tilia cordata", 7), ("Aesculus hippocastanum", 6),
+               ("Quercus robur", 6), ("Carpinus betulus", 5), ("Acer pseudoplatanus", 5), ("Prunus avium", 4),
+               ("Fraxinus excelsior", 4), ("Betula pendula", 4), ("Pinus nigra", 4), ("Taxus baccata", 3), ("Celtis australis", 3),
+               ("Robinia pseudoacacia", 3), ("Fagus sylvatica", 3), ("Cedrus atlantica", 2), ("Picea abies", 2), ("Ginkgo biloba", 2),
+               ("Liquidambar styraciflua", 2), ("Populus nigra", 2), ("Ulmus minor", 2), ("Malus domestica", 2),
+               ("Magnolia grandiflora", 2), ("Cupressus sempervirens", 1), ("Indéterminé", 2)]
+CONIFERS = {"Pinus", "Taxus", "Cedrus", "Picea", "Cupressus"}
+
+# ------------------------------------------------------------------------------------------------------------------------
+# synthetic_filtered_trees: This function creates an array of filtered trees with random values in the ranges of the data
+#                           of the canton of Geneva. The trees are placed around a few centers to mimic the clustering of
+#                           trees along streets and in parks.
+# Input: amount of trees, seed of the random generator
+# Output: tree array
+# ------------------------------------------------------------------------------------------------------------------------
+
+def synthetic_filtered_trees(size, seed=0):
+    rng = np.random.default_rng(seed)
+    trees = np.zeros(size, dtype=tree_dtype)
+    centers_x = rng.uniform(2485000, 2512000, 50)
+    centers_y = rng.uniform(1110000, 1130000, 50)
+    center = rng.integers(0, 50, size)
+    trees['position_x'] = centers_x[center] + rng.normal(0, 500, size)
+    trees['position_y'] = centers_y[center] + rng.normal(0, 500, size)
+    trees['crown_height'] = rng.uniform(3, 25, size)
+    trees['crown_diameter'] = rng.uniform(2, 12, size)
+    trees['shading_factor'] = rng.uniform(0.0, 0.1, size)
+    trees['conversion_factor'] = rng.uniform(50, 300, size)
+    evergreen = rng.random(size) < 0.2
+    trees['leaves_days'] = np.where(evergreen, LEAVE_DAYS_EVERGREENS, LEAVE_DAYS_BROADLEAVES)
+    trees['stomatal_conductance'] = np.where(evergreen, STOMATAL_COND_EVERGREENS, STOMATAL_COND_BROADLEAVES)
+    trees['mass_emission_factor'] = rng.uniform(0, 40, (size, 3))
+    trees['max_incremental_reactivity'] = [10.61, 4.18, 2.42]
+    return trees
+
+# ------------------------------------------------------------------------------------------------------
+# run_c: This function runs main_function2_columns of the shared library on the columns of the trees.
+# Output: run time and the four grids as 2D NumPy arrays
+# ------------------------------------------------------------------------------------------------------
+
+def run_c(clibrary, trees):
+    columns = tree_array_to_columns(trees, outputs=False)
+    grids = [ctypes.POINTER(ctypes.POINTER(ctypes.c_double))() for k in range(4)]
+    length_y = ctypes.c_int(0)
+    length_x = ctypes.c_int(0)
+
+    main_func2 = clibrary.main_function2_columns
+    main_func2.argtypes = [ctypes.POINTER(TreeColumns)] + [ctypes.POINTER(ctypes.POINTER(ctypes.POINTER(ctypes.c_double)))] * 4 + [ctypes.POINTER(ctypes.c_int)] * 2 + [ctypes.c_double, ctypes.c_double, ctypes.c_int]
+    main_func2.restype = None
+
+    start = time.perf_counter()
+    main_func2(ctypes.byref(c_tree_columns(columns)), *[ctypes.byref(grid) for grid in grids], ctypes.byref(length_y), ctypes.byref(length_x), C_PM10, C_O3, gridsize)
+    run_time = time.perf_counter() - start
+
+    grids_np = [c_pp_to_np(length_y.value, length_x.value, grid, clibrary.free_grid) for grid in grids]
+    return run_time, grids_np
+
+# -------------------------------------------------------------------------------------------------------
+# run_numpy: This function runs main_function2_numpy on a copy of the tree array.
+# Output: run time and the four grids as 2D NumPy arrays
+# -------------------------------------------------------------------------------------------------------
+
+def run_numpy(trees):
+    trees = trees.copy()
+    start = time.perf_counter()
+    grids_np = main_function2_numpy(trees, C_PM10, C_O3, gridsize)
+    run_time = time.perf_counter() - start
+    return run_time, grids_np
+
+# ------------------------------------------------------------------------------------------------------------------------
+# write_synthetic_inventory: This function writes a synthetic inventory in the layout of SIPV_ICA_ARBRE_ISOLE.csv (30 fields
+#                            separated by semicolons; species name, trunk height, total height, crown diameter, type and LV95
+#                            coordinates in the fields read by readwriteDocument). 60% of the trees stand in parks (around
+#                            random centers) and 40% along streets (segments of random direction and length), and some
+#                            heights and diameters are missing. The file is written chunk by chunk.
+# Input: filepath, amount of trees, seed of the random generator
+# Output: None
+# ------------------------------------------------------------------------------------------------------------------------
+
+def write_synthetic_inventory(file_name, size, seed=0):
+    rng = np.random.default_rng(seed)
+    species = np.array([name for name, weight in SPECIES_MIX])
+    weights = np.array([weight for name, weight in SPECIES_MIX], dtype=np.float64)
+    types = np.array(["Conifères" if genus_of(name) in CONIFERS else "Feuillus" for name in species])
+    parks = np.column_stack([rng.uniform(2487000, 2510000, 300), rng.uniform(1112000, 1132000, 300)])
+    streets = np.column_stack([rng.uniform(2487000, 2510000, 2000), rng.uniform(1112000, 1132000, 2000), rng.uniform(0, np.pi, 2000), rng.uniform(100, 1500, 2000)])
+
+    with open(file_name, "w", encoding="utf-8") as file:
+        file.write(";".join(["ID_ARBRE", "ESPECE"] + [f"CHAMP_{k}" for k in range(2, 8)] + ["HAUTEUR_TRONC", "HAUTEUR_TOTALE", "DIAMETRE_COURONNE"]
+                            + [f"CHAMP_{k}" for k in range(11, 22)] + ["TYPE"] + [f"CHAMP_{k}" for k in range(23, 28)] + ["E", "N"]) + "\n")
+        for start in range(0, size, 1000000):
+            count = min(1000000, size - start)
+            kind = rng.choice(len(species), count, p=weights / weights.sum())
+            in_park = rng.random(count) < 0.6
+            park = parks[rng.integers(0, len(parks), count)]
+            street = streets[rng.integers(0, len(streets), count)]
+            along = rng.uniform(0, 1, count) * street[:, 3]
+            x = np.where(in_park, park[:, 0] + rng.normal(0, 150, count), street[:, 0] + along * np.cos(street[:, 2]) + rng.normal(0, 3, count))
+            y = np.where(in_park, park[:, 1] + rng.normal(0, 150, count), street[:, 1] + along * np.sin(street[:, 2]) + rng.normal(0, 3, count))
+            total_height = rng.gamma(4, 3, count) + 2
+            trunk_height = np.minimum(rng.uniform(1, 3, count), total_height / 2)
+            diameter = np.clip(total_height * rng.uniform(0.3, 0.8, count), 1, 25)
+
+            height_text = np.char.mod("%.1f", total_height)
+            height_text[rng.random(count) < 0.08] = ""
+            diameter_text = np.char.mod("%.1f", diameter)
+            diameter_text[rng.random(count) < 0.10] = ""
+            lines = [f"{start + k};{species[kind[k]]};;;;;;;{trunk};{height};{crown};;;;;;;;;;;;{types[kind[k]]};;;;;;{position_x};{position_y}"
+                     for k, (trunk, height, crown, position_x, position_y) in enumerate(zip(np.char.mod("%.1f", trunk_height), height_text, diameter_text,
+                                                                                            np.char.mod("%.2f", x), np.char.mod("%.2f", y)))]
+            file.write("\n".join(lines) + "\n")
+
+# ------------------------------------------------------------------------------------------------------------------------
+# run_pipeline: This function runs the stages of the execution files on a CSV file with the C backend and times each one.
+#               It is run in a new process for every inventory, so that the peak memory only belongs to this inventory.
+# Input: path of the shared library, filepath, amount of trees, number of threads, directory of the plots
+# Output: dictionary with the run time of every stage (s), the counters of the stages of C (see Functions/q_profiling.py),
+#         the peak memory (MB), the amount of filtered trees and the totals
+# ------------------------------------------------------------------------------------------------------------------------
+
+def run_pipeline(library, file_name, size, threads, directory):
+    clibrary = ctypes.CDLL(library)
+    clibrary.set_threads.argtypes = [ctypes.c_int]
+    clibrary.set_threads.restype = ctypes.c_int
+    threads = clibrary.set_threads(threads)
+    clibrary.main_function2_columns.argtypes = [ctypes.POINTER(TreeColumns)] + [ctypes.POINTER(ctypes.POINTER(ctypes.POINTER(ctypes.c_double)))] * 4 + [ctypes.POINTER(ctypes.c_int)] * 2 + [ctypes.c_double, ctypes.c_double, ctypes.c_int]
+    clibrary.main_function2_columns.restype = None
+    clibrary.free_grid.argtypes = [ctypes.POINTER(ctypes.POINTER(ctypes.c_double))]
+    clibrary.free_grid.restype = None
+    declare_profile_functions(clibrary)
+    stages = {}
+
+    # Columns allocated by NumPy and given to C (no conversion is needed afterwards)
+    start = time.perf_counter()
+    columns = get_tree_columns(size, outputs=False)
+    stages['columns'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    read_tree_columns(clibrary, file_name, columns)
+    stages['parse'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    filtered_columns = filter_tree_columns(columns, os.path.join(path, 'Data/conversion_factor.csv'), os.path.join(path, 'Data/EF.csv'),
+                                           os.path.join(path, 'Data/shading_coeff.csv'), os.path.join(path, 'Data/MIR.csv'))
+    del columns
+    stages['filter'] = time.perf_counter() - start
+
+    grids = [ctypes.POINTER(ctypes.POINTER(ctypes.c_double))() for k in range(4)]
+    length_y = ctypes.c_int(0)
+    length_x = ctypes.c_int(0)
+    start = time.perf_counter()
+    clibrary.main_function2_columns(ctypes.byref(c_tree_columns(filtered_columns)), *[ctypes.byref(grid) for grid in grids],
+                                    ctypes.byref(length_y), ctypes.byref(length_x), C_PM10, C_O3, gridsize)
+    stages['grid'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    grids = [c_pp_to_np(length_y.value, length_x.value, grid, clibrary.free_grid) for grid in grids]
+    stages['wrap'] = time.perf_counter() - start
+
+    # Same maps as the execution files
+    start = time.perf_counter()
+    render_maps(grids, size, directory)
+    stages['plot'] = time.perf_counter() - start
+
+    return {'stages': stages, 'total': sum(stages.values()), 'c_stages': c_profile(clibrary), 'peak_memory_mb': peak_memory(), 'threads': threads,
+            'filtered_trees': len(filtered_columns['crown_height']), 'grid': [length_y.value, length_x.value],
+            'totals': [float(np.sum(grid)) for grid in grids]}
+
+# ------------------------------------------------------------------------------------------------------------------------
+# version: This function returns the current git commit of the program, or None outside of a git repository.
+# ------------------------------------------------------------------------------------------------------------------------
+
+def version():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=path, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# ------------------------------------------------------------------------------------------------------------------------
+# compare_history: This function prints the ratio between the run time of every stage and the one of the last run with the
+#                  same amount of trees on the same machine in the history.
+# Input: list of previous records, new record
+# Output: None
+# ------------------------------------------------------------------------------------------------------------------------
+
+def compare_history(history, record):
+    previous = [old for old in history if old['trees'] == record['trees'] and old['machine'] == record['machine']]
+    if not previous:
+        return
+    previous = previous[-1]
+    for stage, run_time in record['stages'].items():
+        if stage in previous['stages'] and previous['stages'][stage] > 0:
+            ratio = run_time / previous['stages'][stage]
+            print(f"    {stage}: {ratio:.2f} x the run of {previous['date']} ({previous['version']}){' <- slower' if ratio > 1.2 else ''}")
+
+# -----------------
+# Running the code
+# -----------------
+
+if __name__ == "__main__":
+    clibrary = ctypes.CDLL(os.path.join(path, library_name))
+    benchmark = open("Results/benchmark.txt", "w")
+    benchmark.write("Trees ; C backend (s) ; NumPy backend (s) ; Max relative difference\n")
+
+    for size in SIZES:
+        trees = synthetic_filtered_trees(size)
+        time_c = min(run_c(clibrary, trees)[0] for k in range(REPEATS))
+        time_numpy = min(run_numpy(trees)[0] for k in range(REPEATS))
+
+        # Compare the grids of both backends
+        grids_c = run_c(clibrary, trees)[1]
+        grids_numpy = run_numpy(trees)[1]
+        difference = max(np.max(np.abs(c - n)) / np.max(np.abs(c)) for c, n in zip(grids_c, grids_numpy))
+
+        print(f"{size} trees: C {time_c:.4f}s, NumPy {time_numpy:.4f}s, max relative difference {difference:.2e}")
+        benchmark.write(f"{size} ; {time_c} ; {time_numpy} ; {difference}\n")
+
+    benchmark.close()
+
+    # ------------------------------------------------------------------------------------
+    # Whole program: one new process per synthetic inventory, results added to the history
+    # ------------------------------------------------------------------------------------
+
+    history_name = "Results/benchmark_history.jsonl"
+    history = []
+    if os.path.isfile(history_name):
+        with open(history_name, "r") as file:
+            history = [json.loads(line) for line in file if line.strip()]
+    directory = os.path.join(path, 'Cache', 'benchmark')
+    os.makedirs(directory, exist_ok=True)
+
+    for size in PIPELINE_SIZES:
+        file_name = os.path.join(directory, f'inventory_{size}.csv')
+        if not os.path.isfile(file_name):
+            print(f"Writing a synthetic inventory of {size} trees")
+            write_synthetic_inventory(file_name + ".tmp", size)
+            os.replace(file_name + ".tmp", file_name)
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            result = pool.submit(run_pipeline, os.path.join(path, library_name), file_name, size, THREADS, directory).result()
+
+        record = {'date': datetime.datetime.now().isoformat(timespec='seconds'), 'version': version(), 'machine': platform.node(),
+                  'system': platform.platform(), 'cpus': os.cpu_count(), 'trees': size, 'gridsize': gridsize, **result}
+        print(f"{size} trees: " + ", ".join(f"{stage} {run_time:.3f}s" for stage, run_time in result['stages'].items()) + f", peak memory {result['peak_memory_mb']} MB")
+        compare_history(history, record)
+        history.append(record)
+        with open(history_name, "a") as file:
+            file.write(json.dumps(record) + "\n")
+
+    print("Done")
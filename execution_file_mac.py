@@ -1,12 +1,24 @@
 import numpy as np
 import ctypes
 import os
-import matplotlib.pyplot as plt
-from matplotlib.colors import SymLogNorm
+import shutil
 import time
 
 from Functions.h_structures import *
 from Functions.e_filter_trees import *
+from Functions.f_numpy_model import *
+from Functions.g_streaming import *
+from Functions.i_cache import *
+from Functions.j_scenarios import *
+from Functions.k_grid_pyramid import *
+from Functions.l_tiles import *
+from Functions.n_sparse_grids import *
+from Functions.o_spatial_index import *
+from Functions.p_monte_carlo import *
+from Functions.q_profiling import *
+from Functions.s_outputs import *
+from Functions.t_out_of_core import *
+from Functions.u_time_series import *
 
 # ---------------------------------------------------------------------------------------------------
 # This is our main Python file, which calls functions in C and needs to be run.                   
@@ -17,292 +29,371 @@ from Functions.e_filter_trees import *
 
 path = os.getcwd() 
 str_to_filepath = os.path.join(path, 'Data/SIPV_ICA_ARBRE_ISOLE.csv')
-
-# -----------------
-# Import C library
-# -----------------
-
-clibrary = ctypes.CDLL(os.path.join(path, 'Functions/main.so'))
+str_to_library = os.path.join(path, 'Functions/main.so')
 
 # ---------------------------------------------------------------------
 # Input: Fix constant values. These values can be changed by the user. 
 # ---------------------------------------------------------------------
 
+BACKEND = "C"             # "C" runs the model in the shared library, "numpy" runs it with NumPy (Functions/f_numpy_model.py) and does not need the shared library
+
 C_PM10 = 15.2             # Concentration of PM10 (2023) (Value used in the thesis of Kofel, Donato, et al.: 16.99 (2019))
 C_O3 = 48.09              # Concentration of Ozone (2023) (Value used in the thesis of Kofel, Donato, et al.: 44.786 (2019))
 gridsize = 100            # Size of the fields over which we calculate the output
+THREADS = 0               # Number of threads used by the C backend, 0 for all cores (or OMP_NUM_THREADS); needs the shared library compiled with -fopenmp, the results do not depend on it
 NR_LINES_GE = 120000      # Amount of data taken into account from the CSV file
-
-summary = open("Results/summary.txt", "w")
-summary.write(f"Concentration of PM10 in microgrammes per m^3 : {C_PM10}\n") 
-summary.write(f"Concentration of Ozone in microgrammes per m^3: {C_O3}\n")
-summary.write(f"Amount of trees analyzed: {NR_LINES_GE}\n")
-summary.write(f"Size of grid cells: {gridsize}\n")
-
-# Test runtime
-start = time.time()
-
-# ----------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
-# Defining the functions of C in Python
-# main_func1: This function will read the CSV document containing data about the trees in the canton and write its content into a CSV file and an array containing Tree structures.
-# main_func2 will be defined later because the length of the array containing the filtered trees is necessary.
-# ----------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
-
-main_func1 = clibrary.main_function1
-main_func1.argtypes = [ctypes.c_char_p, ctypes.POINTER(NR_LINES_GE * Tree), ctypes.c_int]
-main_func1.restype = None
-
-# -------------------------------------------------------------------------- 
-# get_array: This function will allocate memory for an array of structures.
-# --------------------------------------------------------------------------
-
-get_array = clibrary.gettreearray
-get_array.argtypes = [ctypes.c_int]
-get_array.restype = ctypes.POINTER(NR_LINES_GE * Tree)
-
-# ---------------------------------------------------------------------------
-# get_gridarray: This function will allocate memory for a 2D array (= grid).
-# ---------------------------------------------------------------------------
-
-get_gridarray = clibrary.get_gridarray
-get_gridarray.argtypes = [ctypes.c_int, ctypes.c_int]
-get_gridarray.restype = ctypes.POINTER(ctypes.POINTER(ctypes.c_double))
-
-# -------------------------------------------------------------------
-# free_tree_array1: This function frees an array of Tree structures.
-# -------------------------------------------------------------------
-
-free_tree_array1 = clibrary.free_tree_array
-free_tree_array1.argtypes = [ctypes.POINTER(NR_LINES_GE * Tree)]
-free_tree_array1.restype = None
-
-# ----------------------------------------------------
-# free_grid: This function frees a 2D array (= grid).
-# ----------------------------------------------------
-
-free_grid = clibrary.free_grid
-free_grid.argtypes=[ctypes.POINTER(ctypes.POINTER(ctypes.c_double))]
-free_grid.restype = None
-
-# -----------------------------------------
-# Defining input for main function 1 and 2
-# -----------------------------------------
-
-# Input for main_func1
-trees = get_array(NR_LINES_GE)
-str_to_filepath.encode(encoding="utf-8")
-filepath = ctypes.c_char_p(str_to_filepath.encode(encoding="utf-8"))
-
-# Input for main_func2
-grid_OFP = ctypes.POINTER(ctypes.POINTER(ctypes.c_double))()
-grid_PM10 = ctypes.POINTER(ctypes.POINTER(ctypes.c_double))()
-grid_O3 = ctypes.POINTER(ctypes.POINTER(ctypes.c_double))()
-grid_O3_net_uptake = ctypes.POINTER(ctypes.POINTER(ctypes.c_double))()
-length_y = ctypes.c_int(0)
-length_x = ctypes.c_int(0)
-
-# -----------------
-# Running the code
-# -----------------
-
-# -------------------
-# Running main_func1
-# -------------------
-
-main_func1(filepath, trees, NR_LINES_GE)
-
-# Create an empty NumPy array
-# tree_dtype is defined in the structure file.
-np_trees = np.empty(NR_LINES_GE, dtype=tree_dtype)
-
-# Populate the NumPy array with data from the trees array
-for i in range(NR_LINES_GE):
-    tree = trees.contents[i]
-    species_name = tree.species_name.decode('utf-8') if tree.species_name else None
-    np_trees[i] = (
-        species_name,  # Decode using UTF-8
-        tree.crown_height,
-        tree.crown_diameter,
-        tree.position_y,
-        tree.position_x,
-        tree.position_y_grid,
-        tree.position_x_grid,
-        tree.shading_factor,
-        tree.conversion_factor,
-        tree.leaves_days,
-        tree.stomatal_conductance,
-        tuple(tree.mass_emission_factor),
-        tuple(tree.max_incremental_reactivity),
-        tree.leaf_area,
-        tree.leaf_dry_wright,
-        tree.OFP_hourly,
-        tree.OFP_yearly,
-        tree.PM10_yearly,
-        tree.O3_instantaneous,
-        tree.O3_yearly,
-        tree.O3_removal_yearly,
-        tree.O3_removed_mass_yearly,
-        tree.O3_net_uptake_yearly
-    )
-
-# -------------
-# Filter trees
-# -------------
-
-# Getting paths of necessary CSV data documents
-Shading = os.path.join(path,'Data/shading_coeff.csv')
-EF = os.path.join(path,'Data/EF.csv')
-conversion_factor = os.path.join(path,'Data/conversion_factor.csv')
-MIR = os.path.join(path,'Data/MIR.csv')
-
-# Launch filtration
-print("Filtering through array")
-np_filtered_trees = np.empty(0, dtype=tree_dtype)
-np_filtered_trees = filter_trees(np_trees, np_filtered_trees, conversion_factor, EF, Shading, MIR)
-print("Filtering done")
-# ---------------------------------------
-# Grid calculations / running main_func2
-# ---------------------------------------
-print("Starting calculations")
-size_filtered_trees = len(np_filtered_trees)
-summary.write(f"Amount of trees used for calculations: {size_filtered_trees}\n")
-
-# Convert np.array to pointer in c
-c_filtered_trees = np_filtered_trees.ctypes.data_as(ctypes.POINTER(size_filtered_trees * Tree))
-free_tree_array1(trees)
-
-# Defining main_func2 (needs to be defined down here because of size_filtered_trees)
-main_func2 = clibrary.main_function2
-main_func2.argtypes = [ctypes.POINTER(size_filtered_trees * Tree), 
-                        ctypes.c_int,
-                        ctypes.POINTER(ctypes.POINTER(ctypes.POINTER(ctypes.c_double))),
-                        ctypes.POINTER(ctypes.POINTER(ctypes.POINTER(ctypes.c_double))),
-                        ctypes.POINTER(ctypes.POINTER(ctypes.POINTER(ctypes.c_double))),
-                        ctypes.POINTER(ctypes.POINTER(ctypes.POINTER(ctypes.c_double))),
-                        ctypes.POINTER(ctypes.c_int),
-                        ctypes.POINTER(ctypes.c_int),
-                        ctypes.c_double,
-                        ctypes.c_double,
-                        ctypes.c_int
-                       ] 
-main_func2.restype = None
-
-# Running main_func2
-main_func2(
-    c_filtered_trees,
-    size_filtered_trees,
-    ctypes.byref(grid_OFP),
-    ctypes.byref(grid_PM10),
-    ctypes.byref(grid_O3),
-    ctypes.byref(grid_O3_net_uptake),
-    ctypes.byref(length_y),
-    ctypes.byref(length_x),
-    C_PM10,
-    C_O3,
-    gridsize
-)
-
-# --------------------------
-# Free filtered trees array
-# --------------------------
-
-# Redefine free_tree_array function for different size of array
-free_tree_array2 = clibrary.free_tree_array
-free_tree_array2.argtypes = [ctypes.POINTER(size_filtered_trees * Tree)]
-free_tree_array2.restype = None
-
-free_tree_array2(c_filtered_trees)
-
-# -----------------------------
-# Conversion for visualization
-# -----------------------------
-print("Starting visualization")
-# Convert Pointer(Pointer(double)) to a 2D array in Python
-rows = length_y.value
-cols = length_x.value
-grid_OFP_np = c_pp_to_np(rows, cols, grid_OFP)
-grid_PM10_np = c_pp_to_np(rows, cols, grid_PM10)
-grid_O3_np = c_pp_to_np(rows, cols, grid_O3)
-grid_O3_net_uptake_np = c_pp_to_np(rows, cols, grid_O3_net_uptake)
-
-# ------------------------ 
-# Calculate total amounts
-# ------------------------
-
-OFP_tot = np.sum(grid_OFP_np)
-PM10_tot = np.sum(grid_PM10_np)
-O3_tot = np.sum(grid_O3_np)
-O3_net_uptake_tot = np.sum(grid_O3_net_uptake_np)
-summary.write(f"Total amount of OFP: {OFP_tot} kg/y\n")
-summary.write(f"Total amount of PM10 absorbed: {PM10_tot} kg/y\n")
-summary.write(f"Total amount of ozone absorbed: {O3_tot} kg/y\n")
-summary.write(f"Total net ozone absorbed(+)/emitted(-): {O3_net_uptake_tot} kg/y\n")
-OFP_max = grid_OFP_np.max()
-PM10_max = grid_PM10_np.max()
-O3_max = grid_O3_np.max()
-O3_net_uptake_min = grid_O3_net_uptake_np.min()
-summary.write(f"Max amount of OFP for one gridcell: {OFP_max} kg/y\n")
-summary.write(f"Max amount of PM10 absorbed for one gridcell: {PM10_max} kg/y\n")
-summary.write(f"Max amount of ozone absorbed for one gridcell: {O3_max} kg/y\n")
-summary.write(f"Max amount of net ozone emitted for one gridcell: {O3_net_uptake_min} kg/y\n")
-
-# --------------
-# Visualization
-# --------------
-
-# OFP
-plt.imshow(grid_OFP_np, origin='lower', cmap="YlGnBu", interpolation='nearest', norm = SymLogNorm(linthresh=10, vmin=0, vmax=OFP_max)) # Symlognorm allows to depict the colors on a log scale, but not the values.
-plt.title("Yearly Ozone Forming Potential (OFP) (kg/y)\n - grid based on indices")
-plt.xlabel("x-index")
-plt.ylabel("y-index")
-cbar = plt.colorbar(label = "OFP_yearly values", ticks = [100, 200, 300, 800])
-cbar.ax.set_yticklabels(['100', '200', '300', '800'])
-plt.savefig(f'Results/OFP_map_{NR_LINES_GE}_indices.png')
-
-# PM10  
-plt.clf()
-plt.imshow(grid_PM10_np, origin='lower', cmap='YlGnBu', interpolation='nearest', norm = SymLogNorm(linthresh=1, vmin=0, vmax=PM10_max))
-plt.title("Yearly PM10 Deposition (kg/y)\n - grid based on indices")
-plt.xlabel("x index")
-plt.ylabel("y index")
-cbar = plt.colorbar(label = "PM10_yearly values", ticks = [1, 2, 3, 4, 5])
-cbar.ax.set_yticklabels(['1', '2', '3', '4', '5'])
-plt.savefig(f'Results/PM10_map_{NR_LINES_GE}_indices.png')
-
-# O3 removal
-plt.clf()
-plt.imshow(grid_O3_np, origin='lower', cmap='YlGnBu', interpolation='nearest', norm = SymLogNorm(linthresh=2, vmin=0, vmax=O3_max))
-plt.title("Yearly amount of O3 absorbed (kg/y)\n - grid based on indices")
-plt.xlabel("x index")
-plt.ylabel("y index")
-cbar = plt.colorbar(label = "O3_removed_mass values", ticks = [1, 2, 3, 4, 5, 6, 7, 8])
-cbar.ax.set_yticklabels(['1', '2', '3', '4', '5', '6', '7', '8'])
-plt.savefig(f'Results/O3_map_{NR_LINES_GE}_indices.png')
-
-# O3 net uptake 
-plt.clf()
-plt.imshow(grid_O3_net_uptake_np, origin='lower', cmap='afmhot', interpolation='nearest', norm = SymLogNorm(linthresh=10, vmin=O3_net_uptake_min, vmax=0))
-plt.title("Yearly net amount of O3 absorbed (kg/y)\n - grid based on indices")
-plt.xlabel("x index")
-plt.ylabel("y index")
-cbar = plt.colorbar(label = "O3_net_removed_mass values", ticks = [-100, -200, -300, -400, -600, -800])
-cbar.ax.set_yticklabels(['-100', '-200', '-300', '-400', '-600', '-800'])
-plt.savefig(f'Results/O3_net_uptake_map_{NR_LINES_GE}_indices.png')
-
-print("This was the last grid.")
-
-# ----------------------
-# Free allocated memory
-# ----------------------
-
-free_grid(grid_O3)
-free_grid(grid_O3_net_uptake)
-free_grid(grid_OFP)
-free_grid(grid_PM10)
-end = time.time()
-summary.write(f"Run time: {end- start}s")
-summary.close()
-print("Done")
+STREAMING = False         # True reads the whole CSV file in chunks and discovers the amount of trees itself (C backend only); NR_LINES_GE is then ignored. "fused" does the same without giving the trees to Python: C reads, filters and adds them to the grids
+CHUNK_SIZE = 100000       # Amount of trees read at once in the streaming mode; the memory used depends on this value, not on the size of the CSV file
+SCENARIOS = []            # List of scenarios (C_PM10, C_O3), e.g. [(10, 40), (20, 60)], evaluated at once after the main run; their totals are written to Results/scenarios.csv (not used in the streaming mode)
+PYRAMID = []              # List of coarser grid sizes, e.g. [250, 1000], built from the grids at gridsize by summing blocks of cells; each one needs to be a positive multiple of gridsize
+TILE_SIZE = 0             # Number of grid cells per side of the tiles, e.g. 50; 0 runs without tiles. With tiles, the grid cells are aligned on multiples of gridsize in LV95 coordinates and the tiles are computed in parallel (not used in the streaming mode)
+PROCESSES = 0             # Number of processes computing the tiles, 0 for all cores
+SPARSE = False            # True only stores the grid cells containing trees, so that the memory does not depend on the size of the grid (for small grid sizes); not used in the streaming and tiled modes
+SPATIAL_INDEX = 0         # Size in meters of the buckets of the spatial index of the trees saved to Results/spatial_index.npz, e.g. 100; 0 does not build it. It gives the totals in any box, circle or polygon (see Functions/o_spatial_index.py); not used in the streaming mode
+MONTE_CARLO = 0           # Number of realisations of the uncertain inputs (missing crown sizes, parameters of the species of each genus), e.g. 200; 0 runs without it. The statistics of the grids are saved to Results/monte_carlo.npz (not used in the streaming mode)
+MC_QUANTILES = [0.05, 0.95]   # Quantiles of every grid cell and of the totals computed in the Monte Carlo mode
+TIME_SERIES = None        # Semicolon-delimited file of hourly concentrations, e.g. "Data/hourly_concentrations.csv" (columns Time;PM10;O3 in ug/m3, one row per hour); None runs without it. The grids of every period are saved to Results/time_series.npz and their totals to Results/time_series.csv (not used in the streaming mode)
+LEAF_CALENDAR = None      # Semicolon-delimited file with the fraction of leaves (0 to 1) of the broadleaves and evergreens for every day (columns Day;broadleaves;evergreens, with the day as MM-DD); None keeps the leaves of the broadleaves from April to September (183 days) and the ones of the evergreens all year
+PERIOD = "monthly"        # "monthly" or "daily" grids in the time-series mode
+LATITUDE = None           # Latitude in degrees used for the length of the days in the time-series mode, e.g. 46.2 for Geneva; None uses the photoperiod of 12 h of the model
+RENDER = True             # False skips the maps, for runs that only need the grids and totals; the four maps are rendered in parallel processes
+RASTERS = False           # True saves the four grids to Results/rasters/ (one .npy file per grid and grids.json with their LV95 georeference, see Functions/s_outputs.py)
+PROFILER = None           # None only records the time, CPU time and memory of every stage in Results/profile.json; "cprofile" also profiles every Python function (Results/profile.pstats), "perf" makes the Python functions visible to perf (Python 3.12 and newer)
+CACHE = False             # True saves the filtered trees (and the grids of the tiles) in Cache/, so that the next runs with the same input files, NR_LINES_GE, PRECISION and BACKEND skip reading and filtering (not used in the streaming mode)
+OUT_OF_CORE = None        # Directory on a local disk, e.g. "Scratch", where the columns of the trees are stored as memory-mapped files, for inventories that do not fit in memory (C backend only); None keeps them in memory. The trees are read, filtered and added to the grids in blocks of BLOCK_SIZE trees (not used in the streaming, sparse and tiled modes)
+BLOCK_SIZE = 1000000      # Amount of trees filtered and added to the grids at once in the out-of-core mode
+GRID_MEMORY = 2**30       # Amount of bytes of memory that the four grids may use in the out-of-core mode; larger grids are memory-mapped files in OUT_OF_CORE as well
+PRECISION = "double"      # "single" stores the crown sizes and scientific parameters of the filtered trees as float32, which saves memory for very large inventories; the model is still computed in double precision and the bound of the relative error is written to Results/summary.txt (not used in the streaming mode)
+
+if PRECISION not in precision_dtypes:
+    raise ValueError("PRECISION needs to be \"double\" or \"single\"")
+if STREAMING not in (False, True, "fused"):
+    raise ValueError("STREAMING needs to be False, True or \"fused\"")
+if STREAMING and BACKEND != "C":
+    raise ValueError("The streaming mode needs the C backend")
+if OUT_OF_CORE and BACKEND != "C":
+    raise ValueError("The out-of-core mode needs the C backend")
+if SPARSE and (STREAMING or TILE_SIZE > 0):
+    raise ValueError("The sparse grids cannot be used in the streaming and tiled modes")
+if PERIOD not in ("monthly", "daily"):
+    raise ValueError("PERIOD needs to be \"monthly\" or \"daily\"")
+if any(size <= 0 or size % gridsize != 0 for size in PYRAMID):
+    raise ValueError("The grid sizes of PYRAMID need to be positive multiples of gridsize")
+
+# -------------------------------------------------------------------------------------------------------------
+# Run: the processes computing the tiles import this file again, so the run only starts from the main process
+# -------------------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    summary = open("Results/summary.txt", "w")
+    summary.write(f"Concentration of PM10 in microgrammes per m^3 : {C_PM10}\n") 
+    summary.write(f"Concentration of Ozone in microgrammes per m^3: {C_O3}\n")
+    summary.write(f"Size of grid cells: {gridsize}\n")
+    summary.write(f"Backend: {BACKEND}\n")
+
+    # Test runtime
+    start = time.time()
+
+    # -----------------
+    # Import C library
+    # -----------------
+
+    if BACKEND == "C":
+        clibrary = ctypes.CDLL(str_to_library)
+
+        # Number of threads used for the calculations
+        clibrary.set_threads.argtypes = [ctypes.c_int]
+        clibrary.set_threads.restype = ctypes.c_int
+        summary.write(f"Threads: {clibrary.set_threads(THREADS)}\n")
+
+        # -------------------------------------------------------------------------------------------------------------------------------------------------------------------
+        # Defining the functions of C in Python
+        # The trees are stored in columns (see Functions/h_structures.py): NumPy allocates one array per field and C only receives their pointers.
+        # main_func1: This function will read the CSV document containing data about the trees in the canton and write its content into a CSV file and the columns of trees.
+        #             It is called by read_tree_columns (see Functions/e_filter_trees.py), which also adds the table of the species of the trees to the columns.
+        # main_func2: This function will calculate the values across the grid for the columns of filtered trees.
+        # -------------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+        main_func2 = clibrary.main_function2_columns
+        main_func2.argtypes = [ctypes.POINTER(TreeColumns),
+                               ctypes.POINTER(ctypes.POINTER(ctypes.POINTER(ctypes.c_double))),
+                               ctypes.POINTER(ctypes.POINTER(ctypes.POINTER(ctypes.c_double))),
+                               ctypes.POINTER(ctypes.POINTER(ctypes.POINTER(ctypes.c_double))),
+                               ctypes.POINTER(ctypes.POINTER(ctypes.POINTER(ctypes.c_double))),
+                               ctypes.POINTER(ctypes.c_int),
+                               ctypes.POINTER(ctypes.c_int),
+                               ctypes.c_double,
+                               ctypes.c_double,
+                               ctypes.c_int
+                              ]
+        main_func2.restype = None
+
+        # ---------------------------------------------------------------------------
+        # get_gridarray: This function will allocate memory for a 2D array (= grid).
+        # ---------------------------------------------------------------------------
+
+        get_gridarray = clibrary.get_gridarray
+        get_gridarray.argtypes = [ctypes.c_int, ctypes.c_int]
+        get_gridarray.restype = ctypes.POINTER(ctypes.POINTER(ctypes.c_double))
+
+        # ------------------------------------------------------------------------------------------------------------
+        # free_grid: This function frees a 2D array (= grid). It is called automatically once the NumPy array wrapping
+        #            the grid is deleted (see c_pp_to_np in Functions/e_filter_trees.py).
+        # ------------------------------------------------------------------------------------------------------------
+
+        free_grid = clibrary.free_grid
+        free_grid.argtypes=[ctypes.POINTER(ctypes.POINTER(ctypes.c_double))]
+        free_grid.restype = None
+
+        # ---------------------------------
+        # Defining input for main function 2
+        # ---------------------------------
+
+        # Input for main_func2
+        grid_OFP = ctypes.POINTER(ctypes.POINTER(ctypes.c_double))()
+        grid_PM10 = ctypes.POINTER(ctypes.POINTER(ctypes.c_double))()
+        grid_O3 = ctypes.POINTER(ctypes.POINTER(ctypes.c_double))()
+        grid_O3_net_uptake = ctypes.POINTER(ctypes.POINTER(ctypes.c_double))()
+        length_y = ctypes.c_int(0)
+        length_x = ctypes.c_int(0)
+
+    # Getting paths of necessary CSV data documents
+    Shading = os.path.join(path,'Data/shading_coeff.csv')
+    EF = os.path.join(path,'Data/EF.csv')
+    conversion_factor = os.path.join(path,'Data/conversion_factor.csv')
+    MIR = os.path.join(path,'Data/MIR.csv')
+
+    # -----------------
+    # Running the code
+    # -----------------
+
+    # The time, CPU time and memory of every stage of Python and C are written to Results/profile.json
+    profiler = Profiler(clibrary if BACKEND == "C" else None, PROFILER)
+
+    # The amount of trees kept and dropped for each genus is written to Results/genus_filter.csv
+    genus_report = {}
+
+    if STREAMING:
+        # -------------------------------------------------------------------
+        # Streaming: reading, filtering and calculations chunk by chunk
+        # -------------------------------------------------------------------
+        print("Streaming through the CSV file")
+        profiler.stage("streaming")
+        streaming_function = main_function_fused if STREAMING == "fused" else main_function_streaming
+        grid_OFP_np, grid_PM10_np, grid_O3_np, grid_O3_net_uptake_np, NR_LINES_GE, size_filtered_trees, grid_origin = streaming_function(
+            clibrary, str_to_filepath, CHUNK_SIZE, conversion_factor, EF, Shading, MIR, C_PM10, C_O3, gridsize, genus_report)
+        profiler.items(NR_LINES_GE)
+    else:
+        # ---------------------------------------------------------------------------------------------
+        # Cache: if the input files and NR_LINES_GE did not change, the filtered trees are read from it
+        # ---------------------------------------------------------------------------------------------
+
+        profiler.stage("read", NR_LINES_GE)
+        cache = None
+        if CACHE:
+            key = cache_key([str_to_filepath, conversion_factor, EF, Shading, MIR], NR_LINES_GE, PRECISION, BACKEND, directory=os.path.join(path, 'Cache'))
+            cache = load_cache(os.path.join(path, 'Cache'), key)
+
+        if cache is not None:
+            print("Loading the filtered trees from the cache")
+            filtered_columns, genus_report = cache
+        else:
+            # -------------------
+            # Running main_func1
+            # -------------------
+
+            if BACKEND == "C" and OUT_OF_CORE:
+                columns = open_tree_columns(os.path.join(path, OUT_OF_CORE, 'trees'), NR_LINES_GE)      # memory-mapped files, read directly by C
+                read_tree_columns(clibrary, str_to_filepath, columns)
+            elif BACKEND == "C":
+                columns = get_tree_columns(NR_LINES_GE, outputs=False)       # the columns for the per-tree results are not needed
+                read_tree_columns(clibrary, str_to_filepath, columns)
+            else:
+                columns = tree_array_to_columns(*main_function1_numpy(str_to_filepath, NR_LINES_GE), outputs=False)
+
+            # -------------
+            # Filter trees
+            # -------------
+
+            # Launch filtration
+            print("Filtering through array")
+            profiler.stage("filter", NR_LINES_GE)
+            if OUT_OF_CORE:
+                filtered_columns = filter_tree_columns_out_of_core(columns, conversion_factor, EF, Shading, MIR, os.path.join(path, OUT_OF_CORE, 'filtered'),
+                                                                   BLOCK_SIZE, genus_report, PRECISION)
+            else:
+                filtered_columns = filter_tree_columns(columns, conversion_factor, EF, Shading, MIR, genus_report, PRECISION)
+            del columns
+            if OUT_OF_CORE:
+                shutil.rmtree(os.path.join(path, OUT_OF_CORE, 'trees'), ignore_errors=True)        # only the filtered trees are kept on the disk
+            print("Filtering done")
+
+            if CACHE:
+                profiler.stage("save_cache")
+                save_cache(os.path.join(path, 'Cache'), key, filtered_columns, genus_report)
+
+        size_filtered_trees = len(filtered_columns['crown_height'])
+        summary.write(f"Memory of the filtered trees: {bytes_per_tree(filtered_columns)} bytes per tree ({PRECISION} precision)\n")
+        if PRECISION == "single":
+            summary.write(f"Bound of the relative error of the results due to the single precision: {precision_error_bound(filtered_columns):.3e}\n")
+
+        # LV95 coordinates (x, y) of the southwestern corner of the grid: the most southwestern tree (LV95 multiple of gridsize for the tiles)
+        grid_origin = (float(np.min(filtered_columns['position_x'])), float(np.min(filtered_columns['position_y'])))
+
+        # ---------------------------------------
+        # Grid calculations / running main_func2
+        # ---------------------------------------
+        print("Starting calculations")
+        profiler.stage("grid", size_filtered_trees)
+
+        if SPARSE:
+            # Sparse grids: only the occupied cells are computed and stored (see Functions/n_sparse_grids.py)
+            grid_OFP_np, grid_PM10_np, grid_O3_np, grid_O3_net_uptake_np = main_function_sparse(clibrary if BACKEND == "C" else None, filtered_columns, C_PM10, C_O3, gridsize)
+            summary.write(f"Sparse grids: {len(grid_OFP_np['cells'])} occupied cells out of {grid_shape(grid_OFP_np)[0] * grid_shape(grid_OFP_np)[1]}\n")
+        elif TILE_SIZE > 0:
+            # Tiles computed by a pool of processes; only the tiles whose trees changed are computed again when CACHE = True
+            processes = PROCESSES if PROCESSES > 0 else os.cpu_count()
+            tile_directory = os.path.join(path, 'Cache', 'tiles') if CACHE else None
+            grid_OFP_np, grid_PM10_np, grid_O3_np, grid_O3_net_uptake_np, grid_origin = main_function_tiled(
+                filtered_columns, C_PM10, C_O3, gridsize, TILE_SIZE, processes, BACKEND, str_to_library, tile_directory, THREADS if processes == 1 else 1)
+            summary.write(f"Tiles of {TILE_SIZE} x {TILE_SIZE} cells, southwestern corner of the grid (LV95): {grid_origin}\n")
+        elif OUT_OF_CORE:
+            # Out-of-core: the filtered trees are added to the grids block by block; large grids are memory-mapped files (see Functions/t_out_of_core.py)
+            grid_OFP_np, grid_PM10_np, grid_O3_np, grid_O3_net_uptake_np = main_function2_out_of_core(
+                clibrary, filtered_columns, C_PM10, C_O3, gridsize, BLOCK_SIZE, os.path.join(path, OUT_OF_CORE, 'grids'), GRID_MEMORY)
+        elif BACKEND == "C":
+            # Running main_func2
+            main_func2(
+                ctypes.byref(c_tree_columns(filtered_columns)),
+                ctypes.byref(grid_OFP),
+                ctypes.byref(grid_PM10),
+                ctypes.byref(grid_O3),
+                ctypes.byref(grid_O3_net_uptake),
+                ctypes.byref(length_y),
+                ctypes.byref(length_x),
+                C_PM10,
+                C_O3,
+                gridsize
+            )
+
+            # -----------------------------
+            # Conversion for visualization
+            # -----------------------------
+            print("Starting visualization")
+            profiler.stage("wrap")
+            # Wrap Pointer(Pointer(double)) as a 2D array in Python, without copy; the arrays own the grids and free them
+            rows = length_y.value
+            cols = length_x.value
+            grid_OFP_np = c_pp_to_np(rows, cols, grid_OFP, free_grid)
+            grid_PM10_np = c_pp_to_np(rows, cols, grid_PM10, free_grid)
+            grid_O3_np = c_pp_to_np(rows, cols, grid_O3, free_grid)
+            grid_O3_net_uptake_np = c_pp_to_np(rows, cols, grid_O3_net_uptake, free_grid)
+        else:
+            grid_OFP_np, grid_PM10_np, grid_O3_np, grid_O3_net_uptake_np = main_function2_numpy(filtered_columns, C_PM10, C_O3, gridsize)
+
+    write_genus_report(genus_report, "Results/genus_filter.csv")
+    summary.write(f"Amount of trees analyzed: {NR_LINES_GE}\n")
+    summary.write(f"Amount of trees used for calculations: {size_filtered_trees}\n")
+
+    # ------------------------ 
+    # Calculate total amounts
+    # ------------------------
+
+    profiler.stage("totals")
+    OFP_tot = grid_total(grid_OFP_np)
+    PM10_tot = grid_total(grid_PM10_np)
+    O3_tot = grid_total(grid_O3_np)
+    O3_net_uptake_tot = grid_total(grid_O3_net_uptake_np)
+    summary.write(f"Total amount of OFP: {OFP_tot} kg/y\n")
+    summary.write(f"Total amount of PM10 absorbed: {PM10_tot} kg/y\n")
+    summary.write(f"Total amount of ozone absorbed: {O3_tot} kg/y\n")
+    summary.write(f"Total net ozone absorbed(+)/emitted(-): {O3_net_uptake_tot} kg/y\n")
+    OFP_max = grid_max(grid_OFP_np)
+    PM10_max = grid_max(grid_PM10_np)
+    O3_max = grid_max(grid_O3_np)
+    O3_net_uptake_min = grid_min(grid_O3_net_uptake_np)
+    summary.write(f"Max amount of OFP for one gridcell: {OFP_max} kg/y\n")
+    summary.write(f"Max amount of PM10 absorbed for one gridcell: {PM10_max} kg/y\n")
+    summary.write(f"Max amount of ozone absorbed for one gridcell: {O3_max} kg/y\n")
+    summary.write(f"Max amount of net ozone emitted for one gridcell: {O3_net_uptake_min} kg/y\n")
+
+    # ------------------------------------------------------------------------------------------------
+    # Pyramid: the grids at coarser grid sizes are obtained by summing blocks of cells of the base grids
+    # ------------------------------------------------------------------------------------------------
+
+    if PYRAMID:
+        profiler.stage("pyramid", len(PYRAMID))
+        pyramid = grid_pyramid((grid_OFP_np, grid_PM10_np, grid_O3_np, grid_O3_net_uptake_np), gridsize, PYRAMID)
+        write_pyramid(summary, pyramid)
+
+    # -----------------------------------------------------------------------------------------
+    # Scenarios: the model is applied once with unit concentrations and scaled for each scenario
+    # -----------------------------------------------------------------------------------------
+
+    if SCENARIOS and not STREAMING:
+        print("Evaluating the scenarios")
+        profiler.stage("scenarios", len(SCENARIOS))
+        totals = scenario_totals(unit_grids(filtered_columns, gridsize), SCENARIOS)
+        write_scenarios(totals, "Results/scenarios.csv")
+
+    # -----------------------------------------------------------------------------------------------------------
+    # Monte Carlo: statistics of the grids over many realisations of the inputs that are only known on average
+    # -----------------------------------------------------------------------------------------------------------
+
+    if MONTE_CARLO > 0 and not STREAMING:
+        print("Running the Monte Carlo realisations")
+        profiler.stage("monte_carlo", MONTE_CARLO)
+        statistics, totals = main_function_monte_carlo(filtered_columns, conversion_factor, EF, Shading, C_PM10, C_O3, gridsize, MONTE_CARLO, MC_QUANTILES)
+        write_monte_carlo(summary, statistics, totals, "Results/monte_carlo.npz")
+
+    # ---------------------------------------------------------------------------------------------------------
+    # Time series: grids of every month or day of the hourly concentrations, with the leaf-on calendar
+    # ---------------------------------------------------------------------------------------------------------
+
+    if TIME_SERIES and not STREAMING:
+        print("Computing the time series")
+        profiler.stage("time_series")
+        periods, series_grids, series_weights, series_totals, missing_values = main_function_time_series(
+            filtered_columns, os.path.join(path, TIME_SERIES), os.path.join(path, LEAF_CALENDAR) if LEAF_CALENDAR else None, PERIOD, LATITUDE, gridsize)
+        write_time_series(summary, periods, series_grids, series_weights, series_totals, missing_values, "Results/time_series.csv", "Results/time_series.npz")
+        del series_grids
+
+    # ---------------------------------------------------------------------------------------------------------
+    # Spatial index: the results of every tree, sorted by bucket, for the totals in any region of the canton
+    # ---------------------------------------------------------------------------------------------------------
+
+    if SPATIAL_INDEX > 0 and not STREAMING:
+        print("Building the spatial index")
+        profiler.stage("spatial_index", size_filtered_trees)
+        spatial_index(filtered_columns, C_PM10, C_O3, SPATIAL_INDEX).save("Results/spatial_index.npz")
+
+    # ------------------------------------------------------------------------------------------
+    # Outputs: rasters of the grids for other programs (GIS) and maps rendered in parallel processes
+    # ------------------------------------------------------------------------------------------
+
+    grids = (grid_OFP_np, grid_PM10_np, grid_O3_np, grid_O3_net_uptake_np)
+    if RASTERS:
+        profiler.stage("rasters", 4)
+        write_rasters(grids, grid_origin, gridsize, "Results/rasters", {'C_PM10': C_PM10, 'C_O3': C_O3, 'trees': NR_LINES_GE, 'backend': BACKEND})
+
+    if RENDER:
+        profiler.stage("plots", 4)
+        render_maps(grids, NR_LINES_GE, "Results")
+    del grids
+
+    print("This was the last grid.")
+
+    # ------------------------------------------------------------------------------
+    # Free allocated memory: the grids of C are freed together with the NumPy arrays
+    # ------------------------------------------------------------------------------
+
+    del grid_OFP_np, grid_PM10_np, grid_O3_np, grid_O3_net_uptake_np
+    end = time.time()
+    summary.write(f"Run time: {end- start}s")
+    summary.close()
+    profiler.write("Results/profile.json", backend=BACKEND, gridsize=gridsize, trees=NR_LINES_GE, filtered_trees=size_filtered_trees, threads=THREADS,
+                   streaming=STREAMING, out_of_core=OUT_OF_CORE, sparse=SPARSE, tile_size=TILE_SIZE, cache=CACHE, render=RENDER, rasters=RASTERS)
+    print("Done")
 
 # ----
 # End
@@ -0,0 +1,41 @@
+import os
+import time
+
+from Functions.r_session import *
+
+# ---------------------------------------------------------------------------------------------------
+# This file serves the trees of the canton to other programs (e.g. a dashboard). The CSV file is read
+# and filtered once, then every request (concentrations, gridsize, bounding box) is answered with the
+# totals and, if asked for, the grids, without reading the files again (see Functions/r_session.py).
+# From Python, the requests are sent with SessionClient:
+#     client = SessionClient(("localhost", 8765))
+#     answer = client.request(15.2, 48.09, 100, bbox=(2499000, 1116000, 2501000, 1118000), grids=True)
+# ---------------------------------------------------------------------------------------------------
+
+path = os.getcwd()
+str_to_filepath = os.path.join(path, 'Data/SIPV_ICA_ARBRE_ISOLE.csv')
+str_to_library = os.path.join(path, 'Functions/main.dll' if os.name == 'nt' else 'Functions/main.so')
+
+# ---------------------------------------------------------------------
+# Input: Fix constant values. These values can be changed by the user.
+# ---------------------------------------------------------------------
+
+BACKEND = "C"                  # "C" or "numpy", see the execution files
+THREADS = 0                    # Number of threads used by the C backend, 0 for all cores
+NR_LINES_GE = 120000           # Amount of data taken into account from the CSV file
+CACHE = False                  # True reads the filtered trees from Cache/ when the input files did not change, so the server starts faster (see the execution files)
+ADDRESS = ("localhost", 8765)  # (host, port) for TCP, or the path of a Unix socket, e.g. "/tmp/trees.sock" (not on Windows)
+MEMORY = 16                    # Number of pairs (gridsize, bounding box) whose grids are kept, so that new concentrations are only a scaling of them
+PRECISION = "double"           # "single" keeps the crown sizes and scientific parameters of the trees as float32 (see the execution files)
+
+if __name__ == "__main__":
+    start = time.time()
+    session = Session(str_to_filepath, os.path.join(path, 'Data/conversion_factor.csv'), os.path.join(path, 'Data/EF.csv'),
+                      os.path.join(path, 'Data/shading_coeff.csv'), os.path.join(path, 'Data/MIR.csv'), NR_LINES_GE, BACKEND,
+                      str_to_library, THREADS, os.path.join(path, 'Cache') if CACHE else None, MEMORY, PRECISION)
+    print(f"{session.size} trees loaded in {time.time() - start}s")
+    serve(session, ADDRESS)
+
+# ----
+# End
+# ----